@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+"""
+Micro and macro benchmarks of the concepts and adapter hot paths.
+
+Adapters are fed the recorded payloads in bench/fixtures through
+Market.hookTransport, so no exchange is contacted.
+
+usage:
+    python bench/run.py                         # run everything
+    python bench/run.py -k depth                # only benchmarks matching
+    python bench/run.py -o results.json         # save the results
+    python bench/run.py -c baseline.json        # compare against a run
+
+Each benchmark runs in a process of its own. For each, reports
+operations per second (best of --repeat runs), how much its setup and
+runs raised the peak memory of that process (on unix) and the number of
+objects tracked by the garbage collector left behind per operation.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# runs from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mexbtcapi.concepts.currencies import USD, BTC
+from mexbtcapi.concepts.currency import Amount, ExchangeRate
+from mexbtcapi.concepts.fixedpoint import FixedAmount, FixedExchangeRate
+from mexbtcapi.concepts.market import Market, Order
+from mexbtcapi.util.cache import create_cache
+from mexbtcapi.util.comp import comp
+from mexbtcapi.util.monitor import Monitor
+from mexbtcapi.util.scheduler import get_scheduler
+
+
+# measure the adapters, not the exchanges' rate limits
+for _exchange in ("BTCe", "Bitstamp", "Bitfinex"):
+    get_scheduler(_exchange).enabled = False
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+
+benchmarks = []
+
+
+def benchmark(name):
+    """registers a benchmark. The decorated function does the setup and
+    returns the callable to measure"""
+    def register(setup):
+        benchmarks.append((name, setup))
+        return setup
+    return register
+
+
+def fixture(name, raw=False):
+    with open(os.path.join(FIXTURES, name)) as f:
+        data = f.read()
+    return data if raw else json.loads(data)
+
+
+class FixtureTransport(object):
+    """A util.record-like hook that answers every request with the same
+    payload"""
+    live = False
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def wrap(self, name, f=None, key=None):
+        return lambda *args, **kwargs: self.payload
+
+    def hook(self, name, obj=None):
+        return _FixtureClient(self.payload)
+
+
+class _FixtureClient(object):
+    def __init__(self, payload):
+        self._payload = payload
+
+    def __getattr__(self, attr):
+        if attr == 'orderbook':     # vircurex exposes depth as a property
+            return self._payload
+        return lambda *args, **kwargs: self._payload
+
+
+class StaticMarket(Market):
+    """A Market that always returns the same depth"""
+    DEPTH_LIMITS = True
+
+    def __init__(self, levels):
+        super(StaticMarket, self).__init__("static", USD, BTC)
+        now = datetime.datetime.now()
+        make = lambda typ, p, v: Order(self, now, typ, Amount(v, BTC),
+                                       ExchangeRate(BTC, USD, p))
+        self.depth = {
+            'asks': [make(Order.ASK, Decimal(100) + i, 1) for i in range(levels)],
+            'bids': [make(Order.BID, Decimal(99) - i, 1) for i in range(levels)],
+        }
+
+    def getDepth(self, *args, **kwargs):
+        return self.depth
+
+
+# ---- concepts ---------------------------------------------------------
+
+@benchmark("amount_add")
+def _():
+    a, b = Amount("1.5", USD), Amount("2.25", USD)
+    return lambda: a + b
+
+
+@benchmark("amount_mul")
+def _():
+    a, k = Amount("1.5", USD), Decimal("1.1")
+    return lambda: a * k
+
+
+@benchmark("fixed_amount_add")
+def _():
+    a = FixedAmount.from_decimal("1.5", USD)
+    b = FixedAmount.from_decimal("2.25", USD)
+    return lambda: a + b
+
+
+@benchmark("fixed_exchange_rate_convert")
+def _():
+    er = FixedExchangeRate.from_decimal(BTC, USD, "123.45")
+    a = FixedAmount.from_decimal("2", BTC)
+    return lambda: er.convert(a)
+
+
+@benchmark("exchange_rate_convert")
+def _():
+    er, a = ExchangeRate(BTC, USD, "123.45"), Amount("2", BTC)
+    return lambda: er.convert(a)
+
+
+def _simulate(levels):
+    market = StaticMarket(levels)
+    size = Amount(levels * 100, USD)  # walks about all the book
+    return lambda: market.simulateOrder(
+        Order(market, None, Order.MARKET_BUY, size, None))
+
+for _levels in (10, 100, 1000):
+    benchmark("simulate_order_%d" % _levels)(
+        lambda levels=_levels: _simulate(levels))
+
+
+@benchmark("compare_sort_1000")
+def _():
+    orders = list(reversed(StaticMarket(1000).depth['asks']))
+    c = comp(BTC)
+    return lambda: sorted(orders, c)
+
+
+# ---- adapters ---------------------------------------------------------
+
+@benchmark("btce_getDepth")
+def _():
+    from mexbtcapi.api.btce.high_level import BTCeMarket, batcher
+    batcher.timeout = 0     # measure the requests, not the batcher's reuse
+    market = BTCeMarket(USD)
+    market.hookTransport(FixtureTransport(fixture("btce_depth.json", True)))
+    return market.getDepth
+
+
+@benchmark("btce_getDepth_lazy_top")
+def _():
+    from mexbtcapi.api.btce.high_level import BTCeMarket, batcher
+    batcher.timeout = 0
+    market = BTCeMarket(USD)
+    market.hookTransport(FixtureTransport(fixture("btce_depth.json", True)))
+    return lambda: market.getDepth(lazy=True)['asks'][0]
+
+
+@benchmark("btce_depthToOrders")
+def _():
+    from mexbtcapi.api.btce.high_level import BTCeMarket
+    market = BTCeMarket(USD)
+    asks = fixture("btce_depth.json")['btc_usd']['asks']
+    return lambda: market._depthToOrders(asks, Order.ASK)
+
+
+@benchmark("btce_getDepth_to_numpy")
+def _():
+    from mexbtcapi.api.btce.high_level import BTCeMarket, batcher
+    batcher.timeout = 0
+    market = BTCeMarket(USD)
+    market.hookTransport(FixtureTransport(fixture("btce_depth.json", True)))
+    return lambda: market.getDepth(lazy=True).to_numpy()
+
+
+@benchmark("bitfinex_getDepth")
+def _():
+    from mexbtcapi.api.bitfinex.high_level import BitfinexMarket
+    # the fixture replaces the client, which needn't be installed
+    market = BitfinexMarket(USD, transport=FixtureTransport(
+        fixture("bitfinex_order_book.json")))
+    return market.getDepth
+
+
+@benchmark("bitstamp_getDepth")
+def _():
+    from mexbtcapi.api.bitstamp.rest.high_level import BitstampMarket
+    market = BitstampMarket(USD, transport=FixtureTransport(
+        fixture("bitstamp_order_book.json")))
+    return market.getDepth
+
+
+@benchmark("vircurex_getDepth")
+def _():
+    from mexbtcapi.api.vircurex.high_level import VirCurExMarket
+    market = VirCurExMarket(USD, transport=FixtureTransport(
+        fixture("vircurex_orderbook.json")))
+    return market.getDepth
+
+
+# ---- util -------------------------------------------------------------
+
+@benchmark("cache_call_hit")
+def _():
+    cache = create_cache(timeout=10 ** 9)
+    f = lambda x: x * 2
+    cache.call(f, (21,))
+    return lambda: cache.call(f, (21,))
+
+
+@benchmark("cache_call_miss")
+def _():
+    cache = create_cache(timeout=10 ** 9)
+    f = lambda x: x * 2
+    counter = [0]
+    def call():
+        counter[0] += 1
+        return cache.call(f, (counter[0],))
+    return call
+
+
+@benchmark("monitor_flush_100")
+def _():
+    fd, filename = tempfile.mkstemp(prefix="mexbtcapi-bench-")
+    os.close(fd)
+    monitor = Monitor(lambda: None, memory=100, filename=filename)
+    now = datetime.datetime.now()
+    monitor.data.extend((now, i) for i in range(100))
+    def flush():
+        monitor.flushed_to = 0
+        monitor.flush()
+        open(filename, "w").close()     # don't let the file grow
+    return flush
+
+
+@benchmark("codec_dumps_depth_1000")
+def _():
+    from mexbtcapi.util import codec
+    depth = StaticMarket(1000).depth
+    return lambda: codec.dumps(depth)
+
+
+@benchmark("codec_loads_depth_1000")
+def _():
+    from mexbtcapi.util import codec
+    market = StaticMarket(1000)
+    data = codec.dumps(market.depth)
+    return lambda: codec.loads(data, market)
+
+
+# ---- runner -----------------------------------------------------------
+
+def measure(f, min_time, repeat):
+    """returns the best operations per second of repeat runs, each
+    lasting at least min_time seconds"""
+    f()     # warm up
+    best = 0
+    for _ in range(repeat):
+        n, elapsed, batch = 0, 0.0, 1
+        start = time.time()
+        while elapsed < min_time:
+            for _ in xrange(batch):
+                f()
+            n += batch
+            batch *= 2
+            elapsed = time.time() - start
+        best = max(best, n / elapsed)
+    return best
+
+
+def _maxrss():
+    """the peak memory of this process in bytes, None if unknown"""
+    if resource is None:
+        return None
+    # KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure_objects(f, n):
+    """returns the objects tracked by the garbage collector that running
+    f n times leaves behind, per operation"""
+    gc.collect()
+    before = len(gc.get_objects())
+    for _ in xrange(n):
+        f()
+    gc.collect()
+    return (len(gc.get_objects()) - before) / float(n)
+
+
+def run_one(name, min_time, repeat, memory_ops):
+    """runs the benchmark name in this process, returning its results"""
+    setup = dict(benchmarks)[name]
+    baseline = _maxrss()
+    try:
+        f = setup()
+    except (ImportError, SystemExit) as e:
+        return {'skipped': str(e)}
+    ops = measure(f, min_time, repeat)
+    objects = measure_objects(f, memory_ops)
+    peak = _maxrss()
+    return {'ops_per_sec': ops, 'objects_per_op': objects,
+            'peak_bytes': None if peak is None else peak - baseline}
+
+
+def run(pattern=None, min_time=0.2, repeat=3, memory_ops=100):
+    results = {}
+    for name, setup in benchmarks:
+        if pattern and pattern not in name:
+            continue
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+            "--child", name, "--min-time", str(min_time),
+            "--repeat", str(repeat), "--memory-ops", str(memory_ops)],
+            stdout=subprocess.PIPE)
+        output = child.communicate()[0]
+        if child.returncode:
+            print "%-24s failed" % name
+            continue
+        result = json.loads(output)
+        if 'skipped' in result:
+            print "%-24s skipped (%s)" % (name, result['skipped'])
+            continue
+        results[name] = result
+        peak = result['peak_bytes']
+        print "%-24s %14.1f ops/s  peak +%s  objects/op %.2f" % (name,
+            result['ops_per_sec'],
+            "-" if peak is None else "%.1fM" % (peak / 1048576.0),
+            result['objects_per_op'])
+    return results
+
+
+def compare(old, new):
+    print
+    print "%-24s %14s %14s %8s" % ("benchmark", "before", "after", "ratio")
+    for name in sorted(new):
+        if name not in old:
+            continue
+        a, b = old[name]['ops_per_sec'], new[name]['ops_per_sec']
+        print "%-24s %14.1f %14.1f %7.2fx" % (name, a, b, b / a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-k", dest="pattern",
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument("-o", "--output", help="save results to this file")
+    parser.add_argument("-c", "--compare",
+                        help="compare against the results in this file")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory-ops", type=int, default=100,
+                        help="operations run to count the objects left")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_one(args.child, args.min_time, args.repeat,
+                          args.memory_ops), sys.stdout)
+        return
+
+    results = run(args.pattern, args.min_time, args.repeat,
+                  args.memory_ops)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'results': results}, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)['results'], results)
+
+
+if __name__ == "__main__":
+    main()
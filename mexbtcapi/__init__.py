@@ -1,12 +1,14 @@
-from api import bitstamp
-from api import btce
-from api import vircurex
-from api import bitfinex
 import logging
 
-logging.basicConfig()
+from api import LazyAdapter, adapters, get_market
+
 logging.getLogger(__name__)
 
+btce = LazyAdapter("BTCe")
+bitstamp = LazyAdapter("Bitstamp")
+vircurex = LazyAdapter("VirCurEx")
+bitfinex = LazyAdapter("Bitfinex")
+
 apis = [btce,
 	bitstamp,
         vircurex,
@@ -1,3 +1,102 @@
+"""The exchange adapters.
+
+Adapters are registered by name, and each one is only imported the first
+time it's used, so importing mexbtcapi doesn't pay for (or need the
+third-party clients of) the exchanges a program never touches.
+"""
+
+import importlib
 import logging
+import threading
+from collections import OrderedDict
 
 logging.getLogger(__name__)
+
+
+class MissingDependencyError(ImportError):
+    """raised when an adapter is used without the third-party client it
+    needs"""
+
+
+# adapter name -> module
+ADAPTERS = OrderedDict([
+    ("BTCe", "mexbtcapi.api.btce"),
+    ("Bitstamp", "mexbtcapi.api.bitstamp"),
+    ("VirCurEx", "mexbtcapi.api.vircurex"),
+    ("Bitfinex", "mexbtcapi.api.bitfinex"),
+])
+
+_lock = threading.RLock()
+_loaded = {}
+_markets = {}   # (adapter name, base, quote) -> Market
+
+
+def register(name, module):
+    """registers the adapter module (its dotted name) as name. The module
+    must define market, and may define participant and secret_container"""
+    with _lock:
+        ADAPTERS[name] = module
+        _loaded.pop(name, None)
+        for key in [k for k in _markets if k[0] == name]:
+            del _markets[key]
+    return LazyAdapter(name)
+
+
+def _resolve(name):
+    if name in ADAPTERS:
+        return name
+    for registered in ADAPTERS:
+        if registered.lower() == name.lower():
+            return registered
+    raise KeyError("no adapter registered as {0}".format(name))
+
+
+def load(name):
+    """imports the adapter registered as name (in any case), and returns
+    its module"""
+    with _lock:
+        name = _resolve(name)
+        if name not in _loaded:
+            _loaded[name] = importlib.import_module(ADAPTERS[name])
+        return _loaded[name]
+
+
+def get_market(exchange, base, quote):
+    """returns the Market of exchange (an adapter name) where base is
+    traded for quote, e.g. get_market("BTCe", BTC, USD). Currencies may be
+    given by name.
+
+    Markets are created once and shared: every caller gets the same
+    instance, with its connections and caches already warm"""
+    from mexbtcapi.concepts.currency import Currency
+    base, quote = Currency(str(base)), Currency(str(quote))
+    with _lock:
+        key = (_resolve(exchange), base, quote)
+        market = _markets.get(key)
+        if market is None:
+            market = _markets[key] = load(key[0]).market(quote, base)
+        return market
+
+
+class LazyAdapter(object):
+    """Stands for an adapter module, importing it when one of its
+    attributes (other than name) is first used"""
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def module(self):
+        return load(self.name)
+
+    def __getattr__(self, attr):
+        return getattr(self.module, attr)
+
+    def __repr__(self):
+        loaded = "loaded" if self.name in _loaded else "not loaded"
+        return "<LazyAdapter({0}, {1})>".format(self.name, loaded)
+
+
+def adapters():
+    """a LazyAdapter for each registered adapter"""
+    return [LazyAdapter(name) for name in ADAPTERS]
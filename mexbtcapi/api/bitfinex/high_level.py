@@ -6,16 +6,42 @@ with the mexbtcapi package
 """
 
 import logging
+import threading
 
 from mexbtcapi import concepts
+from mexbtcapi.api import MissingDependencyError
 from mexbtcapi.concepts.currencies import *
 from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate
-from mexbtcapi.concepts.market import ActiveParticipant, Market as BaseMarket, Order, Trade
+from mexbtcapi.concepts.depth import Depth, LazyOrders
+from mexbtcapi.concepts.market import ActiveParticipant, Market as BaseMarket, Order, Quote, Trade
+from mexbtcapi.util.scheduler import get_scheduler, ACCOUNT, MARKET_DATA, \
+    TRADING
+from mexbtcapi.util.tracing import traced
 
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def _getClient():
+    """the client shared by every BitfinexMarket"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                from bitfinex.client import Client
+            except ImportError:
+                raise MissingDependencyError("Couldn't find module bitfinex. "
+                    "Download and install from: "
+                    "https://github.com/scottjbarr/bitfinex "
+                    "or run: pip install bitfinex")
+            _client = get_scheduler(BitfinexMarket.MARKET_NAME).hook(
+                Client(), MARKET_DATA)
+        return _client
+
 
 class BitfinexTicker(concepts.market.Ticker):
     def __repr__(self):
@@ -38,21 +64,21 @@ class BitfinexOrder(Order):
 
 
 class BitfinexMarket(BaseMarket):
+    """transport: if given, requests go through it (see hookTransport)
+    from the start. One that doesn't need the real client, like a
+    util.record Player, lets the market work without the bitfinex module
+    """
     MARKET_NAME = "Bitfinex"
+    DEPTH_LIMITS = True
 
-    def __init__(self, currency, item = BTC, depth = 50):
-        try:
-            from bitfinex.client import Client
-        except ImportError:
-            import sys
-            print "Couldn't find module bitfinex. Download and install from:"
-            print "https://github.com/scottjbarr/bitfinex"
-            print "Or run:\n pip install bitfinex"
-            sys.exit(1)
-            
+    def __init__(self, currency, item = BTC, depth = 50, transport = None):
         super(BitfinexMarket, self).__init__(self.MARKET_NAME, currency, item)
-        self.client = Client()
         self.depth = depth
+        if transport is None:
+            self.client = _getClient()
+        else:
+            self.client = None
+            self.hookTransport(transport)
 
     def getTicker(self):
         logger.debug("getting ticker")
@@ -62,39 +88,80 @@ class BitfinexMarket(BaseMarket):
     def _getCurrencyPair(self):
         return "%s%s"%(self.currency2.name.lower(), self.currency1.name.lower())
 
-    def getDepth(self):
+    def hookTransport(self, hook):
+        name = self.MARKET_NAME + "." + self._getCurrencyPair()
+        self.client = hook.hook(name, self.client)
+
+    def unhookTransport(self):
+        self.client = _getClient()
+
+    @traced
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
         logger.debug("getting depth")
 
-        parameters = {'limit_asks': self.depth, 'limit_bids': self.depth}
-        
-        d = self.client.order_book(self._getCurrencyPair(), parameters)
+        def fetch(limit, lazy=True):
+            parameters = {'limit_asks': limit, 'limit_bids': limit}
+
+            d = self._publicCall("depth", self.client.order_book,
+                                 self._getCurrencyPair(), parameters)
 
-        ret = {
-            'asks': self._depthToOrders(d[u'asks'], Order.ASK),
-            'bids': self._depthToOrders(d[u'bids'], Order.BID),
-        }
-        return ret
+            return self._observeDepth(Depth(self,
+                self._depthToOrders(d[u'asks'], Order.ASK, lazy),
+                self._depthToOrders(d[u'bids'], Order.BID, lazy)))
 
-    def _depthToOrders(self, depth, order_type):
+        if max_notional is None and max_levels is None:
+            return fetch(self.depth, lazy)
+        # start shallow, and only fetch deeper if the order needs it
+        return self._progressiveDepth(fetch, max_notional, max_levels, lazy)
+
+    def _fetchQuote(self):
+        from datetime import datetime
+        logger.debug("getting quote")
+
+        parameters = {'limit_asks': 1, 'limit_bids': 1}
+        d = self._publicCall("quote", self.client.order_book,
+                             self._getCurrencyPair(), parameters)
+
+        def top(levels):
+            if not levels:
+                return None, None, None
+            l = levels[0]
+            return (ExchangeRate(self.currency2, self.currency1, Decimal(l[u'price'])),
+                    Amount(Decimal(l[u'amount']), self.currency2),
+                    datetime.fromtimestamp(float(l[u'timestamp'])))
+        bid, bid_size, bid_time = top(d[u'bids'])
+        ask, ask_size, ask_time = top(d[u'asks'])
+        timestamp = max(bid_time, ask_time) or datetime.now()
+        return Quote(self, timestamp, bid, ask, bid_size, ask_size)
+
+    def _depthToOrders(self, depth, order_type, lazy=False):
         from datetime import datetime
-        orders = []
 
-        for d in depth:
+        c1, c2 = self.currency1, self.currency2
+
+        def make(d):
             # TODO: change the low-level stream to use Amount instead of numbers
             # this means also changing the "hash" of Amount.
-            amount = Amount(Decimal(d[u'amount']), self.currency2)
-            price = ExchangeRate(self.currency2, self.currency1, Decimal(d[u'price']))
-            order = Order(self, datetime.fromtimestamp(d[u'timestamp']), order_type, amount, price)
-            orders.append(order)
+            amount = Amount.fast(Decimal(d[u'amount']), c2)
+            price = ExchangeRate.fast(c2, c1, Decimal(d[u'price']))
+            timestamp = datetime.fromtimestamp(float(d[u'timestamp']))
+            return Order.from_trusted(self, timestamp, order_type, amount, price)
 
-        return orders
+        # bitfinex sends both sides best price first
+        if lazy:
+            return LazyOrders(depth, make)
+        return map(make, depth)
 
 
 class BitfinexParticipant(ActiveParticipant):
 
     def __init__(self, market, key, secret, nonce):
         super(BitfinexParticipant, self).__init__(market)
-        self.private = low_level.Private(key, secret)
+        # orders go before market data, and count against key's limit too
+        self.private = get_scheduler(BitfinexMarket.MARKET_NAME).hook(
+            low_level.Private(key, secret), ACCOUNT, key,
+            dict.fromkeys(('bid', 'ask', 'cancel_bid', 'cancel_ask'),
+                          TRADING))
 
     def placeOrder(self, order):
         """places an Order in the market for limit/amount"""
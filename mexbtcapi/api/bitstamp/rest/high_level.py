@@ -29,60 +29,113 @@ import datetime
 
 import mexbtcapi
 from mexbtcapi import concepts
+from mexbtcapi.api import MissingDependencyError
 from mexbtcapi.concepts.currencies import BTC, USD
 from mexbtcapi.concepts.currency import Amount, ExchangeRate
-from mexbtcapi.concepts.market import Market as BaseMarket, PassiveParticipant, Order
+from mexbtcapi.concepts.depth import Depth, LazyOrders
+from mexbtcapi.concepts.market import Market as BaseMarket, PassiveParticipant, Order, Quote
+from mexbtcapi.util.scheduler import get_scheduler, MARKET_DATA
+from mexbtcapi.util.tracing import traced
 
 import urllib
 import urllib2
-import sys
 import json
+import threading
 
 try:
     from bitstamp import client
 except ImportError:
-    print "Couldn't find module bitstamp. Download and install from:"
-    print "https://github.com/kmadac/bitstamp-python-client.git"
-    sys.exit(1)
+    client = None
 
 MARKET_NAME= "Bitstamp"
 _URL = "https://www.bitstamp.net/api/"
 
+_public_api = None
+_public_api_lock = threading.Lock()
+
+def _getPublicApi():
+    """the public API client shared by every BitstampMarket"""
+    global _public_api
+    with _public_api_lock:
+        if _public_api is None:
+            _public_api = get_scheduler(MARKET_NAME).hook(client.public(),
+                                                          MARKET_DATA)
+        return _public_api
+
 class BitStampTicker( concepts.market.Ticker):
     TIME_PERIOD= 24*60*60
 
 class BitstampMarket(BaseMarket):
-    def __init__( self, currency, currency2 = BTC):
+    """transport: if given, requests go through it (see hookTransport)
+    from the start. One that doesn't need the real client, like a
+    util.record Player, lets the market work without the bitstamp module
+    """
+    DEPTH_LIMITS = True
+
+    def __init__( self, currency, currency2 = BTC, transport = None):
+        if client is None and transport is None:
+            raise MissingDependencyError("Couldn't find module bitstamp. "
+                "Download and install from: "
+                "https://github.com/kmadac/bitstamp-python-client.git")
         mexbtcapi.concepts.market.Market.__init__(self, MARKET_NAME, currency, BTC)
         if currency != USD:
             raise Exception("Currency not supported on Bitstamp: " + currency)
         self.xchg_factory = partial(ExchangeRate, BTC, USD)
-        self.public_api = client.public()
+        if transport is None:
+            self.public_api = _getPublicApi()
+        else:
+            self.public_api = None
+            self.hookTransport(transport)
 
+    @traced
     def getTicker(self):
         url = _URL + "ticker"
-        data = self.public_api.ticker()
+        data = self._publicCall("ticker", self.public_api.ticker)
         for x,y in [('bid','buy'),('ask','sell')]:
             data[y]= data[x]
         fields= list(BitStampTicker.RATE_FIELDS)
         fields.remove('average') #not present on Bitstamp API
         data2 = dict( [ (x, self.xchg_factory(data[x])) for x in fields] )
         data2['time']= datetime.datetime.now()
-        return BitStampTicker( market=self, **data2 ) 
+        return BitStampTicker( market=self, **data2 )
+
+    def _fetchQuote(self):
+        # the ticker is a fraction of the size of the order book, but
+        # doesn't have the sizes of the bid and ask
+        data = self._publicCall("ticker", self.public_api.ticker)
+        timestamp = datetime.datetime.fromtimestamp(int(data['timestamp']))
+        return Quote(self, timestamp, self.xchg_factory(Decimal(data['bid'])),
+                     self.xchg_factory(Decimal(data['ask'])))
+
+    def hookTransport(self, hook):
+        self.public_api = hook.hook(MARKET_NAME, self.public_api)
+
+    def unhookTransport(self):
+        self.public_api = _getPublicApi()
 
-    def getDepth(self):
-        data = self.public_api.order_book()
+    @traced
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
+        if max_notional is not None or max_levels is not None:
+            # the whole book is always fetched; only build what's needed
+            depth = self.getDepth(lazy=True)
+            return self._truncateDepth(depth, max_notional, max_levels, lazy)
+        data = self._publicCall("depth", self.public_api.order_book)
         #print data
-        ret = {}
+        ret = Depth(self, None, None)
+        timestamp = datetime.datetime.now()     # shared by the whole book
         for typ in ('bids', 'asks'):
-            depth = []
-            ret[typ]=depth
-            for o in data[typ]:
+            order_type = (typ == 'bids' and Order.BID) or Order.ASK
+            def make(o, order_type=order_type):
                 rate = Decimal(o[0])
                 amount = Decimal(o[1])
-                from_amount = Amount(rate * amount, USD)
-                price = self.xchg_factory(rate)
-                order_type = (typ == 'bids' and Order.BID) or Order.ASK
-                depth.append(Order(self, None, order_type, from_amount, price))
-        return ret
+                from_amount = Amount.fast(rate * amount, USD)
+                price = ExchangeRate.fast(BTC, USD, rate)
+                return Order.from_trusted(self, timestamp, order_type,
+                                          from_amount, price)
+            # bitstamp sends both sides best price first
+            if lazy:
+                ret[typ] = LazyOrders(data[typ], make, pairs=True)
+            else:
+                ret[typ] = map(make, data[typ])
+        return self._observeDepth(ret)
 
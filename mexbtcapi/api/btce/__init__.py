@@ -1,4 +1,4 @@
-from public import getDepth, getTradeHistory
+from public import getDepth, getDepths, getTradeHistory, getTradeHistories
 from trade import TradeAPI
 from scraping import scrapeMainPage
 from keyhandler import KeyHandler
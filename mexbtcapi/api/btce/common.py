@@ -1,8 +1,19 @@
 import httplib
 import json
+import select
+import socket
+import threading
+import time
+
+from mexbtcapi.util.scheduler import get_scheduler, MARKET_DATA
+from mexbtcapi.util.tracing import phase
 
 btce_domain = "btc-e.com"
 
+# every request takes a token of the exchange's rate limit first, unless
+# the transport is hooked to one that doesn't reach the exchange
+scheduler = get_scheduler("BTCe")
+
 all_currencies = ("btc", "usd", "rur", "ltc", "nmc", "eur", "nvc", "trc", "ppc")  
 all_pairs = ("btc_usd", "btc_rur", "ltc_btc", "ltc_usd", "ltc_rur",
              "nmc_btc", "usd_rur", "eur_usd", "nvc_btc", "trc_btc",
@@ -31,19 +42,141 @@ min_orders = {"btc_usd":0.1,
               "trc_btc":0.1,
               "ppc_btc":0.1}
 
-def makeRequest(url, extra_headers = None, params = {}):
+class ConnectionPool(object):
+    '''Keeps up to size idle keep-alive connections to domain, so that
+    requests don't pay for a TCP and TLS handshake each. Connections are
+    made with connection_class (an httplib connection class).'''
+
+    def __init__(self, domain, size=4,
+                 connection_class=httplib.HTTPSConnection):
+        self.domain = domain
+        self.size = size
+        self.connection_class = connection_class
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self, max_idle = None):
+        '''returns an idle connection, or a new (unconnected) one. Idle
+        connections the exchange has closed, or (if max_idle is given)
+        idle for more than max_idle seconds, are dropped'''
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, since = self.idle.pop()
+            if (max_idle is None or time.time() - since <= max_idle) \
+                    and not stale(conn):
+                return conn
+            conn.close()
+        return self.connection_class(self.domain)
+
+    def put(self, conn):
+        '''returns conn, its response read, to the pool'''
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+
+def stale(conn):
+    '''whether an idle connection can't be used any more: with no
+    request pending, a readable socket means the exchange closed it (or
+    sent something unexpected)'''
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+pool = ConnectionPool(btce_domain)
+
+# a trade API request isn't sent again once it may have reached the
+# exchange, so it only reuses connections idle for less than this
+# (seconds), which the exchange is unlikely to be closing meanwhile
+tapi_max_idle = 5
+
+def setEndpoint(domain, connection_class = httplib.HTTPSConnection):
+    '''Sends every request to domain (which may include a port) instead
+    of btc-e.com, e.g. to a mexbtcapi.mock server over plain HTTP with
+    httplib.HTTPConnection.'''
+    global btce_domain
+    btce_domain = domain
+    pool.clear()
+    pool.domain = domain
+    pool.connection_class = connection_class
+
+def httpRequest(url, extra_headers = None, params = {}):
     headers = {"Content-type": "application/x-www-form-urlencoded"}
     if extra_headers is not None:
         headers.update(extra_headers)
         
-    conn = httplib.HTTPSConnection(btce_domain)
-    conn.request("POST", url, params, headers)
-    response = conn.getresponse().read()
-    conn.close()    
+    conn = pool.get(tapi_max_idle if url == "/tapi" else None)
+    reused = conn.sock is not None
+    sent = False
+    try:
+        if not reused:
+            with phase("connect", "BTCe"):
+                conn.connect()
+        with phase("ttfb", "BTCe"):
+            conn.request("POST", url, params or None, headers)
+            sent = True
+            r = conn.getresponse()
+        with phase("body", "BTCe"):
+            response = r.read()
+    except (httplib.HTTPException, socket.error):
+        conn.close()
+        # the exchange may have closed the idle connection: try again on
+        # another. Once a trade API request is sent, the exchange may have
+        # executed it even if no answer came back, so it isn't sent again
+        if not reused or (sent and url == "/tapi"):
+            raise
+        return httpRequest(url, extra_headers, params)
+
+    if r.will_close:
+        conn.close()
+    else:
+        pool.put(conn)
 
     return response
-              
-def makeJSONRequest(url, extra_headers = None, params = {}):
+
+makeRequest = httpRequest
+live = True     # whether requests reach the exchange
+
+def hookTransport(hook):
+    '''Routes every request through hook, a mexbtcapi.util.record
+    Recorder or Player. Requests are told apart by their url. A hook
+    whose live attribute is False (a Player) doesn't reach the exchange,
+    so its requests aren't rate limited.'''
+    global makeRequest, live
+    makeRequest = hook.wrap(btce_domain, httpRequest,
+                            key=lambda url, *args, **kwargs: url)
+    live = getattr(hook, 'live', True)
+
+def unhookTransport():
+    '''Undoes hookTransport: requests go to the exchange again.'''
+    global makeRequest, live
+    makeRequest = httpRequest
+    live = True
+
+def acquire(priority = MARKET_DATA, key = None):
+    '''waits for a token of the rate limit, for a request of priority
+    (made with the API key, if given)'''
+    if live:
+        with phase("queue", "BTCe"):
+            scheduler.acquire(priority, key)
+
+def makeJSONRequest(url, extra_headers = None, params = {},
+                    priority = MARKET_DATA, key = None):
+    acquire(priority, key)
+    return sendJSONRequest(url, extra_headers, params)
+
+def sendJSONRequest(url, extra_headers = None, params = {}):
+    '''makeJSONRequest, for a request that already has its token'''
     response = makeRequest(url, extra_headers, params)
     
     # Fix up bogus values returned by the API; sometimes floating-point
@@ -51,7 +184,8 @@ def makeJSONRequest(url, extra_headers = None, params = {}):
     response = response.replace(".,", ".0,")
     
     try:
-        r = json.loads(response)
+        with phase("decode", "BTCe"):
+            r = json.loads(response)
     except Exception as e:
         print "Error while attempting to parse JSON response: %s" % e
         print "Response: %r" % response
@@ -12,15 +12,22 @@ import logging
 from mexbtcapi import concepts
 from mexbtcapi.concepts.currencies import *
 from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate
-from mexbtcapi.concepts.market import ActiveParticipant, Market as BaseMarket, Order, Trade, SecretContainer
+from mexbtcapi.concepts.depth import Depth, LazyOrders
+from mexbtcapi.util.tracing import traced
+from mexbtcapi.concepts.market import ActiveParticipant, Market as BaseMarket, Order, Quote, Trade, TradeList, SecretContainer
 
-from public import getDepth, getTradeHistory
+import common
+from public import getDepth, getTradeHistory, DEPTH_LIMIT, PairBatcher
 from trade import TradeAPI
 from scraping import scrapeMainPage
 from keyhandler import KeyHandler
 
 logger = logging.getLogger(__name__)
 
+# BTCeMarkets polled together get their depth and trades through a single
+# request for all of their pairs, shared for batcher.timeout seconds
+batcher = PairBatcher()
+
 
 class BTCeTicker(concepts.market.Ticker):
     TIME_PERIOD = timedelta(days=1)
@@ -47,6 +54,7 @@ class BTCeOrder(Order):
 
 class BTCeMarket(BaseMarket):
     MARKET_NAME = "BTCe"
+    DEPTH_LIMITS = True
 
     def __init__(self, currency, item = BTC):
         super(BTCeMarket, self).__init__(self.MARKET_NAME, currency, item)
@@ -74,30 +82,76 @@ class BTCeMarket(BaseMarket):
     def _getCurrencyPair(self):
         return "%s_%s"%(self.currency2.name.lower(), self.currency1.name.lower())
 
-    def getDepth(self):
-        logger.debug("getting depth")
-        
-        asks, bids = getDepth(self._getCurrencyPair())
+    def hookTransport(self, hook):
+        # the low level btc-e API is shared by all BTCeMarkets
+        common.hookTransport(hook)
+        batcher.clear()
 
-        ret = {
-            'asks': self._depthToOrders(asks, Order.ASK),
-            'bids': self._depthToOrders(bids, Order.BID),
-        }
-        return ret
+    def unhookTransport(self):
+        common.unhookTransport()
+        batcher.clear()
 
-    def _depthToOrders(self, depth, order_type):
-        orders = []
+    @traced
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
+        logger.debug("getting depth")
+
+        def fetch(limit, lazy=True):
+            asks, bids = self._publicCall("depth", getDepth,
+                                          self._getCurrencyPair(), limit)
+            return self._observeDepth(Depth(self,
+                self._depthToOrders(asks, Order.ASK, lazy),
+                self._depthToOrders(bids, Order.BID, lazy)))
+
+        if max_notional is None and max_levels is None:
+            asks, bids = batcher.getDepth(self._getCurrencyPair(),
+                                          call=self._publicCall)
+            return self._observeDepth(Depth(self,
+                self._depthToOrders(asks, Order.ASK, lazy),
+                self._depthToOrders(bids, Order.BID, lazy)))
+        # the v3 API can limit the depth: only fetch as deep as needed
+        return self._progressiveDepth(fetch, max_notional, max_levels, lazy,
+                                      limit=DEPTH_LIMIT)
+
+    def _fetchQuote(self):
+        logger.debug("getting quote")
+        # the v3 ticker has no sizes, the top level of the depth has
+        quote_call = lambda kind, f, *args: self._publicCall("quote", f, *args)
+        asks, bids = batcher.getDepth(self._getCurrencyPair(), 1,
+                                      call=quote_call)
+        return Quote.fromDepth(self, {
+            'asks': self._depthToOrders(asks, Order.ASK, True),
+            'bids': self._depthToOrders(bids, Order.BID, True),
+        })
+
+    @traced
+    def getTrades(self):
+        logger.debug("getting trades")
+
+        trades = TradeList()
+        for t in batcher.getTradeHistory(self._getCurrencyPair(),
+                                         call=self._publicCall):
+            amount = Amount.fast(Decimal(t.amount), self.currency2)
+            price = ExchangeRate.fast(self.currency2, self.currency1, Decimal(t.price))
+            trades.append(Trade.from_trusted(self, t.date, amount, price))
+        return trades
+
+    def _depthToOrders(self, depth, order_type, lazy=False):
         timestamp = datetime.now() # Don't need the information about each order when checking depth
 
-        for p, v in depth:
+        c1, c2 = self.currency1, self.currency2
+
+        def make(level):
+            p, v = level
             # TODO: change the low-level stream to use Amount instead of numbers
             # this means also changing the "hash" of Amount.
-            amount = Amount(Decimal(v), self.currency2)
-            price = ExchangeRate(self.currency2, self.currency1, Decimal(p))
-            order = Order(self, timestamp, order_type, amount, price)
-            orders.append(order)
-
-        return orders
+            amount = Amount.fast(Decimal(v), c2)
+            price = ExchangeRate.fast(c2, c1, Decimal(p))
+            return Order.from_trusted(self, timestamp, order_type, amount, price)
+
+        # btc-e sends both sides best price first
+        if lazy:
+            return LazyOrders(depth, make, pairs=True)
+        return map(make, depth)
 
 class BTCeSimpleSecretContainer(SecretContainer):
     """
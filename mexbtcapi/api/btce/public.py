@@ -1,14 +1,13 @@
 import datetime
+import threading
+import time
 
 import common
 
-def getDepth(pair):
-    '''Retrieve the depth for the given pair.  Returns a tuple (asks, bids);
-    each of these is a list of (price, volume) tuples.'''
-    
-    common.validatePair(pair)
-    
-    depth = common.makeJSONRequest("/api/2/%s/depth" % pair)
+# the most levels the v3 API sends per side
+DEPTH_LIMIT = 2000
+
+def _parseDepth(depth):
     if type(depth) is not dict:
         raise Exception("The response is not a dict.")
     
@@ -21,8 +20,54 @@ def getDepth(pair):
         raise Exception("The response does not contain a bids list.")
     
     return asks, bids
-    
-   
+
+def _multiPairRequest(method, pairs, limit=None):
+    '''Makes a request to the v3 API for many pairs at once, returning
+    the response as a dictionary of pair to its part of the response.'''
+
+    for pair in pairs:
+        common.validatePair(pair)
+
+    url = "/api/3/%s/%s" % (method, "-".join(pairs))
+    if limit is not None:
+        url += "?limit=%d" % limit
+    response = common.makeJSONRequest(url)
+    if type(response) is not dict:
+        raise Exception("The response is not a dict.")
+    if u'error' in response:
+        raise Exception("The response is an error: %s" % response[u'error'])
+
+    result = {}
+    for pair in pairs:
+        if unicode(pair) not in response:
+            raise Exception("The response does not contain %s." % pair)
+        result[pair] = response[unicode(pair)]
+    return result
+
+def getDepth(pair, limit=None):
+    '''Retrieve the depth for the given pair.  Returns a tuple (asks, bids);
+    each of these is a list of (price, volume) tuples. If limit is given,
+    each list has at most limit levels (up to DEPTH_LIMIT).'''
+
+    if limit is not None:
+        return getDepths([pair], limit)[pair]
+
+    common.validatePair(pair)
+
+    depth = common.makeJSONRequest("/api/2/%s/depth" % pair)
+    return _parseDepth(depth)
+
+def getDepths(pairs, limit=None):
+    '''Retrieve the depth for many pairs with a single request.  Returns a
+    dictionary of pair to (asks, bids), as returned by getDepth. Without
+    a limit, asks for DEPTH_LIMIT levels: the v3 API sends only 150 by
+    default.'''
+
+    limit = DEPTH_LIMIT if limit is None else min(limit, DEPTH_LIMIT)
+    depths = _multiPairRequest("depth", pairs, limit)
+    return dict((pair, _parseDepth(d)) for pair, d in depths.items())
+
+
 class Trade:
     __slots__ = ('trade_type', 'price', 'tid', 'amount', 'date')
     
@@ -46,5 +91,114 @@ def getTradeHistory(pair):
         t.date = datetime.datetime.fromtimestamp(t.date)
         result.append(t)
     return result
-    
-    
+
+def getTradeHistories(pairs, limit=None):
+    '''Retrieve the trade history for many pairs with a single request.
+    Returns a dictionary of pair to a list of Trade instances.'''
+
+    histories = _multiPairRequest("trades", pairs, limit)
+
+    result = {}
+    for pair, history in histories.items():
+        if type(history) is not list:
+            raise Exception("The response is a %r, not a list." % type(history))
+        trades = result[pair] = []
+        for h in history:
+            # the v3 API names two of the fields differently
+            t = Trade()
+            t.trade_type = h.get(u'type')
+            t.price = h.get(u'price')
+            t.tid = h.get(u'tid')
+            t.amount = h.get(u'amount')
+            t.date = datetime.datetime.fromtimestamp(h.get(u'timestamp'))
+            trades.append(t)
+    return result
+
+
+class _Fetch(object):
+    '''A batched request: the pairs it asked for, and its response once
+    done.'''
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.started = time.time()
+        self.finished = None
+        self.data = None
+        self.error = None
+        self.done = threading.Event()
+        self.served = set()     # pairs that got their part of data
+
+
+class PairBatcher(object):
+    '''Shares the requests of many pairs: a pair that asks for its depth
+    (or trades) gets, with the same request, those of the pairs that used
+    the previous response; each of those gets its part from this response
+    if it asks within the next timeout seconds. A pair asking twice gets
+    a new response. Pairs that ask while a request including them is on
+    its way wait for it.'''
+
+    def __init__(self, timeout=0.5):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.responses = {}     # (method, limit) -> latest _Fetch done
+        self.inflight = {}      # (method, limit) -> [_Fetch]
+
+    def clear(self):
+        '''forgets the shared responses'''
+        with self.lock:
+            self.responses.clear()
+
+    def _get(self, method, fetch, pair, limit, call):
+        key = (method, limit)
+        with self.lock:
+            latest = self.responses.get(key)
+            if latest is not None and pair in latest.data and \
+                    pair not in latest.served and \
+                    time.time() - latest.finished <= self.timeout:
+                latest.served.add(pair)
+                return latest.data[pair]
+            flights = self.inflight.setdefault(key, [])
+            waiting = [f for f in flights if pair in f.pairs]
+            if waiting:
+                f = waiting[0]
+            else:
+                served = latest.served if latest is not None else set()
+                f = _Fetch(sorted(served | set([pair])))
+                flights.append(f)
+        if not waiting:
+            return self._fetch(key, f, fetch, pair, limit, call)
+        f.done.wait()
+        if f.error is not None:
+            raise f.error
+        with self.lock:
+            f.served.add(pair)
+        return f.data[pair]
+
+    def _fetch(self, key, f, fetch, pair, limit, call):
+        try:
+            if call is None:
+                f.data = fetch(f.pairs, limit)
+            else:
+                f.data = call(key[0], fetch, f.pairs, limit)
+        except Exception as e:
+            f.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight[key].remove(f)
+                f.finished = time.time()
+                if f.error is None:
+                    f.served.add(pair)
+                    latest = self.responses.get(key)
+                    if latest is None or latest.started <= f.started:
+                        self.responses[key] = f
+            f.done.set()
+        return f.data[pair]
+
+    # call: makes the request, as call(kind, f, *args) (e.g. to hedge it)
+
+    def getDepth(self, pair, limit=None, call=None):
+        return self._get("depth", getDepths, pair, limit, call)
+
+    def getTradeHistory(self, pair, limit=None, call=None):
+        return self._get("trades", getTradeHistories, pair, limit, call)
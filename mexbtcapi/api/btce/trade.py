@@ -1,9 +1,12 @@
 import urllib
 import hashlib
 import hmac
+import threading
 from datetime import datetime
 
 import common
+from mexbtcapi.util.scheduler import TRADING, ACCOUNT
+from mexbtcapi.util.tracing import trace
 
 
 """
@@ -120,23 +123,37 @@ class TradeAPI(object):
         self.key = key
         self.secret = secret
         self.nonce = nonce
+        # held from taking a nonce until the exchange answers, so requests
+        # reach it in nonce order
+        self.lock = threading.RLock()
        
     def next_nonce(self):
-        n = self.nonce
-        self.nonce += 1
-        return n
+        with self.lock:
+            n = self.nonce
+            self.nonce += 1
+            return n
         
     def _post(self, params):
-        params["nonce"] = self.next_nonce()
-        encoded_params = urllib.urlencode(params)
+        with trace("BTCe", params.get("pair"), params.get("method")):
+            return self._signedPost(params)
 
-        # Hash the params string to produce the Sign header value
-        H = hmac.new(self.secret, digestmod=hashlib.sha512)
-        H.update(encoded_params)
-        sign = H.hexdigest()
-        
-        headers = {"Key":self.key, "Sign":sign}
-        result = common.makeJSONRequest("/tapi", headers, encoded_params)
+    def _signedPost(self, params):
+        priority = TRADING if params.get("method") in ("Trade", "CancelOrder") \
+            else ACCOUNT
+        # the token first: the scheduler may reorder the requests waiting
+        # for one, so they only take their nonces once they have it
+        common.acquire(priority, self.key)
+        with self.lock:
+            params["nonce"] = self.next_nonce()
+            encoded_params = urllib.urlencode(params)
+
+            # Hash the params string to produce the Sign header value
+            H = hmac.new(self.secret, digestmod=hashlib.sha512)
+            H.update(encoded_params)
+            sign = H.hexdigest()
+
+            headers = {"Key":self.key, "Sign":sign}
+            result = common.sendJSONRequest("/tapi", headers, encoded_params)
         
         success = result.get(u'success')
         if not success:
@@ -29,21 +29,21 @@ import datetime
 
 import mexbtcapi
 from mexbtcapi import concepts
+from mexbtcapi.api import MissingDependencyError
 from mexbtcapi.concepts.currencies import *
 from mexbtcapi.concepts.currency import Amount, ExchangeRate
+from mexbtcapi.concepts.depth import Depth, LazyOrders
+from mexbtcapi.util.tracing import traced
 from mexbtcapi.concepts.market import Market as BaseMarket, PassiveParticipant, Order
 
 import urllib
 import urllib2
-import sys
 import json
 
 try:
     import vircurex
 except ImportError:
-    print "Couldn't find module vircurex. Please download from:"
-    print "https://github.com/dkronst/pyvircurex.git"
-    sys.exit(1)
+    vircurex = None
 
 MARKET_NAME= "VirCurEx"
 
@@ -51,28 +51,66 @@ class VirCurExTicker(concepts.market.Ticker):
     TIME_PERIOD= 24*60*60
 
 class VirCurExMarket(BaseMarket):
-    def __init__( self, currency1, currency2 = BTC):
+    """transport: if given, requests go through it (see hookTransport)
+    from the start. One that doesn't need the real client, like a
+    util.record Player, lets the market work without the vircurex module
+    """
+    DEPTH_LIMITS = True
+
+    def __init__( self, currency1, currency2 = BTC, transport = None):
+        if vircurex is None and transport is None:
+            raise MissingDependencyError("Couldn't find module vircurex. "
+                "Please download from: "
+                "https://github.com/dkronst/pyvircurex.git")
         mexbtcapi.concepts.market.Market.__init__(self, MARKET_NAME, currency1, currency2)
         self.xchg_factory = partial(ExchangeRate, currency2, currency1)
-        self.pair = vircurex.data.Pair(str(currency2) + "_" + str(currency1))
+        if transport is None:
+            self.pair = vircurex.data.Pair(str(currency2) + "_" +
+                                           str(currency1))
+        else:
+            self.pair = None
+            self.hookTransport(transport)
 
     def getTicker(self):
         raise NotImplementedError
         return VirCurExTicker( market=self)
 
-    def getDepth(self):
-        data = self.pair.orderbook
+    def hookTransport(self, hook):
+        name = MARKET_NAME + "." + str(self.currency2) + "_" + str(self.currency1)
+        self.pair = hook.hook(name, self.pair)
+
+    def unhookTransport(self):
+        self.pair = vircurex.data.Pair(str(self.currency2) + "_" +
+                                       str(self.currency1))
+
+    @traced
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
+        if max_notional is not None or max_levels is not None:
+            # the whole book is always fetched; only build what's needed
+            depth = self.getDepth(lazy=True)
+            return self._truncateDepth(depth, max_notional, max_levels, lazy)
+        data = self._publicCall("depth", getattr, self.pair, "orderbook")
 
-        ret = {}
+        ret = Depth(self, None, None)
+        timestamp = datetime.datetime.now()     # shared by the whole book
+        c1, c2 = self.currency1, self.currency2
         for typ in ('bids', 'asks'):
-            depth = []
-            ret[typ]=depth
-            for o in data[typ]:
+            order_type = (typ == 'bids' and Order.BID) or Order.ASK
+            def make(o, order_type=order_type):
                 rate = Decimal(o[0])
                 amount = Decimal(o[1])
-                from_amount = Amount(rate * amount, self.currency1)
-                price = self.xchg_factory(rate)
-                order_type = (typ == 'bids' and Order.BID) or Order.ASK
-                depth.append(Order(self, None, order_type, from_amount, price))
-        return ret
+                from_amount = Amount.fast(rate * amount, c1)
+                price = ExchangeRate.fast(c2, c1, rate)
+                return Order.from_trusted(self, timestamp, order_type,
+                                          from_amount, price)
+            if lazy:
+                # vircurex doesn't guarantee the order of the levels
+                if typ == 'bids':
+                    key = lambda o: -Decimal(o[0])
+                else:
+                    key = lambda o: Decimal(o[0])
+                ret[typ] = LazyOrders(data[typ], make, key, pairs=True)
+            else:
+                ret[typ] = map(make, data[typ])
+        return self._observeDepth(ret)
 
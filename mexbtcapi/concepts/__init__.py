@@ -1,3 +1,7 @@
 import logging
 
+# the named currencies get their classes (FiatCurrency, CryptoCurrency)
+# before anything creates them by name
+import currencies
+
 logging.getLogger(__name__)
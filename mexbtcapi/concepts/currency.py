@@ -1,5 +1,7 @@
 from decimal import Decimal
 import logging
+import threading
+from mexbtcapi.util.slots import Slotted
 
 
 logger = logging.getLogger(__name__)
@@ -16,10 +18,48 @@ def check_number_for_decimal_conversion(number):
 
 
 class Currency(object):
-    """A currency (USD, EUR, ...)"""
+    """A currency (USD, EUR, ...)
+
+    Currencies are interned by name: Currency("USD") always returns the
+    same instance (mexbtcapi.concepts.currencies.USD), even through
+    copying and pickling. Equality and hashing are therefore by identity,
+    which is the cheapest check possible.
+
+    The instance keeps the most specific class it was asked for:
+    Currency("BTC") is the CryptoCurrency BTC, and a currency first
+    created as a plain Currency becomes a CryptoCurrency when created as
+    one. Asking for a currency as an unrelated class raises TypeError.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __new__(cls, name):
+        currency = Currency._registry.get(name)
+        if currency is None or not isinstance(currency, cls):
+            with Currency._registry_lock:
+                currency = Currency._registry.get(name)
+                if currency is None:
+                    currency = super(Currency, cls).__new__(cls)
+                    currency.name = name
+                    Currency._registry[name] = currency
+                elif not isinstance(currency, cls):
+                    if not issubclass(cls, currency.__class__):
+                        raise TypeError("{0} is a {1}, not a {2}".format(
+                            name, currency.__class__.__name__, cls.__name__))
+                    currency.__class__ = cls
+        return currency
 
     def __init__(self, name):
-        self.name = name
+        pass    # initialized once, in __new__
+
+    def __reduce__(self):
+        return (self.__class__, (self.name,))
+
+    @staticmethod
+    def registered():
+        """returns all the currencies created so far"""
+        return Currency._registry.values()
 
     def __repr__(self):
         return "<Currency({0})>".format(self.name)
@@ -57,8 +97,9 @@ class BadCurrency( Exception ):
         s= "A ExchangeRate of {0} cannot handle {1}"
         return s.format(self.er, self.oc)
 
-class ExchangeRate(object):
+class ExchangeRate(Slotted):
     """The proportion between two currencies' values"""
+    __slots__ = ('_c', '_er')
 
     def __init__(self, c1, c2, exchange_rate):
         '''c2 = exchange_rate * c1'''
@@ -68,19 +109,29 @@ class ExchangeRate(object):
         self._c= (c1,c2)
         self._er = Decimal(exchange_rate)
 
+    @classmethod
+    def fast(cls, c1, c2, exchange_rate):
+        '''builds an ExchangeRate without any checks: c1 and c2 must be
+        different Currencies, and exchange_rate a Decimal. For adapters
+        building many rates from data they already parsed'''
+        er = object.__new__(cls)
+        er._c = (c1, c2)
+        er._er = exchange_rate
+        return er
+
     def convert(self, amount, currency=None):
         '''if currency is not specified, converts amount to the other
         currency of this ExchangeRate. Otherwise, converts (if needed) 
         to the specified one'''
-        if currency==amount.currency:
+        if currency is amount.currency:
             return amount
         assert isinstance(amount, Amount)
         i= self._isFirst( amount.currency)
         c= self._c[1 if i else 0]
-        if currency and c!=currency:
+        if currency and c is not currency:
             i= not(i)
         er= self._er if i else 1 /  self._er
-        if currency and c!=currency:
+        if currency and c is not currency:
             raise BadCurrency(self, currency)
         return Amount(amount.value * er, c)
     
@@ -110,9 +161,9 @@ class ExchangeRate(object):
 
     def _isFirst(self, currency):
         '''returns if currency is the first'''
-        if self._c[0] == currency:
+        if self._c[0] is currency:
             return True
-        elif self._c[1] == currency:
+        elif self._c[1] is currency:
             return False
         else:
             raise BadCurrency(self, currency)
@@ -140,6 +191,16 @@ class ExchangeRate(object):
         if self._c[0]!=other._c[0] or self._c[1]!=other._c[1]:
             raise e
         return cmp(self._er, other._er)
+
+    def __eq__(self, other):
+        return isinstance(other, ExchangeRate) and self._c == other._c and \
+            self._er == other._er
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._c, self._er))
         
 
     def __repr__(self):
@@ -155,33 +216,24 @@ class ExchangeRate(object):
         # returns a copy of this ExchangeRate
         return ExchangeRate(self._c[0], self._c[1], self._er)
 
-    def __iadd__(self, other):
+    # there is no __iadd__ (nor __isub__): a += b makes a new ExchangeRate,
+    # so the one hashed into a dictionary never changes
+
+    def __add__(self, other):
         if isinstance(other, ExchangeRate):
             if self._c!=other._c:
                 raise ValueError("Can't sum two ExchangeRate with " + \
                              "different currencies")
-            self._er += other._er
+            return ExchangeRate.fast(self._c[0], self._c[1],
+                                     self._er + other._er)
         else:
             raise ValueError("Can't sum ExchangeRate to ", type(other))
-        return self
-
-    def __add__(self, other):
-        a = self.clone()
-        a += other
-        return a
 
     def __neg__(self):
-        a = self.clone()
-        a._er = -a._er
-        return a
-
-    def __isub__(self, other):
-        self += -other
-        return self
+        return ExchangeRate.fast(self._c[0], self._c[1], -self._er)
 
     def __sub__(self, other):
-        a = self.clone() + (-other)
-        return a
+        return self + (-other)
 
     def __mul__(self, other):
         if isinstance(other, Amount):
@@ -197,8 +249,9 @@ class ExchangeRate(object):
         else:
             raise Exception("Can only multiply currency that reduce to a simple C1/C2 exchange rate")
 
-class Amount(object):
+class Amount(Slotted):
     """An amount of a given currency"""
+    __slots__ = ('value', 'currency')
 
     def __init__(self, value, currency):
         check_number_for_decimal_conversion(value)
@@ -208,6 +261,14 @@ class Amount(object):
             raise ValueError("Can't convert {0} to decimal".format(value))
         self.currency = currency
 
+    @classmethod
+    def fast(cls, value, currency):
+        '''builds an Amount without any checks: value must be a Decimal'''
+        a = object.__new__(cls)
+        a.value = value
+        a.currency = currency
+        return a
+
     def convert(self, currencyequivalence, to_currency):
         if self.currency != to_currency:
             currencyequivalence.convert(self)
@@ -222,50 +283,44 @@ class Amount(object):
     def __str__(self):
         return "{:.2f} {}".format(self.value, self.currency)
 
-    def __iadd__(self, other):
+    # there is no __iadd__ (nor __isub__, __imul__): a += b makes a new
+    # Amount, so the one hashed into a dictionary never changes
+
+    def __add__(self, other):
         if type(other) in (int, float) or isinstance(other, Decimal):
-            self.value += other
+            return Amount.fast(self.value + other, self.currency)
         elif isinstance(other, Amount):
-            if self.currency != other.currency:
+            if self.currency is not other.currency:
                 raise ValueError("Can't sum two amounts in " + \
                                  "different currencies")
-            self.value += other.value
+            return Amount.fast(self.value + other.value, self.currency)
         else:
             raise ValueError("Can't sum Amount to ", type(other))
-        return self
-
-    def __add__(self, other):
-        a = self.clone()
-        a += other
-        return a
 
     def __neg__(self):
-        a = self.clone()
-        a.value = -a.value
-        return a
-
-    def __isub__(self, other):
-        self += -other
-        return self
+        return Amount.fast(-self.value, self.currency)
 
     def __sub__(self, other):
-        a = self.clone() + (-other)
-        return a
+        return self + (-other)
 
-    def __imul__(self, other):
+    def __mul__(self, other):
         if type(other) in (int, float) or isinstance(other, Decimal):
-            self.value *= other
+            return Amount.fast(self.value * other, self.currency)
         else:
             raise ValueError("Can't multiply Amount to ", type(other))
-        return self
-
-    def __mul__(self, other):
-        a = self.clone()
-        a *= other
-        return a
 
     def __cmp__(self, other):
-        if not isinstance(other, Amount) or other.currency != self.currency:
+        if not isinstance(other, Amount) or other.currency is not self.currency:
             raise ValueError("can't compare the two amounts",
                              str(self), str(other))
         return cmp(self.value, other.value)
+
+    def __eq__(self, other):
+        return isinstance(other, Amount) and \
+            self.currency is other.currency and self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.value, self.currency))
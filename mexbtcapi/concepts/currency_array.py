@@ -0,0 +1,357 @@
+"""Vectors of amounts and exchange rates, backed by numpy arrays.
+
+An AmountArray holds many values of one currency; a RateArray holds many
+rates between one pair of currencies. Currencies are checked once per
+operation, not once per element, and the arithmetic runs in numpy.
+
+Values are stored as float64, which is fine for analytics (depth charts,
+portfolio revaluation, ...) but, as explained in add_market.md, not for
+accounting: use Amount or FixedAmount for that.
+
+Depths and trades can also be exported whole, as numpy structured
+arrays (see BOOK_DTYPE) or pandas DataFrames, without building an Amount
+per level.
+
+numpy is an optional dependency, only needed by this module; pandas is
+only needed by to_frame.
+"""
+
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate, \
+    BadCurrency
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("mexbtcapi.concepts.currency_array needs numpy. "
+                          "Install it with:\n pip install numpy")
+
+
+def _require_pandas():
+    if pandas is None:
+        raise ImportError("DataFrames need pandas. Install it with:\n "
+                          "pip install pandas")
+
+
+def _to_decimal(x):
+    return Decimal(repr(float(x)))
+
+
+class AmountArray(object):
+    """Many amounts of the same currency"""
+    __slots__ = ('values', 'currency')
+    __hash__ = None     # comparisons are elementwise
+
+    def __init__(self, values, currency):
+        _require_numpy()
+        assert isinstance(currency, Currency)
+        self.values = numpy.asarray(values, dtype=numpy.float64)
+        self.currency = currency
+
+    @staticmethod
+    def from_amounts(amounts, currency=None):
+        """builds an AmountArray from a sequence of Amount, all of the
+        same currency. currency must be given if amounts may be empty"""
+        _require_numpy()
+        amounts = list(amounts)
+        if currency is None:
+            currency = amounts[0].currency
+        if any(a.currency is not currency for a in amounts):
+            raise ValueError("Can't build an AmountArray from amounts in " +
+                             "different currencies")
+        values = numpy.fromiter((a.value for a in amounts), numpy.float64,
+                                len(amounts))
+        return AmountArray(values, currency)
+
+    def to_amounts(self):
+        return [Amount(_to_decimal(v), self.currency) for v in self.values]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        v = self.values[i]
+        if isinstance(v, numpy.ndarray):
+            return AmountArray(v, self.currency)
+        return Amount(_to_decimal(v), self.currency)
+
+    def __iter__(self):
+        return iter(self.to_amounts())
+
+    def sum(self):
+        return Amount(_to_decimal(self.values.sum()), self.currency)
+
+    def cumsum(self):
+        return AmountArray(self.values.cumsum(), self.currency)
+
+    def convert(self, exchange_rate, currency=None):
+        """converts every amount to the other currency of exchange_rate,
+        an ExchangeRate or a RateArray of the same length"""
+        if isinstance(exchange_rate, RateArray):
+            return exchange_rate.convert(self, currency)
+        if currency is self.currency:
+            return self
+        factor = exchange_rate.convert(Amount(1, self.currency)).value
+        to_currency = exchange_rate.otherCurrency(self.currency)
+        if currency is not None and currency is not to_currency:
+            raise BadCurrency(exchange_rate, currency)
+        return AmountArray(self.values * float(factor), to_currency)
+
+    def _other(self, other):
+        """returns the values of other, checking its currency"""
+        if isinstance(other, (AmountArray, Amount)):
+            if other.currency is not self.currency:
+                raise ValueError("Can't operate amounts in different " +
+                                 "currencies")
+            return other.values if isinstance(other, AmountArray) \
+                else float(other.value)
+        raise ValueError("Can't operate AmountArray with ", type(other))
+
+    def __add__(self, other):
+        return AmountArray(self.values + self._other(other), self.currency)
+
+    def __sub__(self, other):
+        return AmountArray(self.values - self._other(other), self.currency)
+
+    def __neg__(self):
+        return AmountArray(-self.values, self.currency)
+
+    def __mul__(self, other):
+        if isinstance(other, Decimal):
+            other = float(other)
+        return AmountArray(self.values * other, self.currency)
+
+    __rmul__ = __mul__
+
+    def __lt__(self, other):
+        return self.values < self._other(other)
+
+    def __le__(self, other):
+        return self.values <= self._other(other)
+
+    def __gt__(self, other):
+        return self.values > self._other(other)
+
+    def __ge__(self, other):
+        return self.values >= self._other(other)
+
+    def __eq__(self, other):
+        return self.values == self._other(other)
+
+    def __ne__(self, other):
+        return self.values != self._other(other)
+
+    def __repr__(self):
+        return "<AmountArray({0} {1})>".format(self.values, self.currency)
+
+
+class RateArray(object):
+    """Many exchange rates between the same two currencies:
+    c2 = rates * c1, elementwise"""
+    __slots__ = ('rates', 'c1', 'c2')
+    __hash__ = None
+
+    def __init__(self, c1, c2, rates):
+        _require_numpy()
+        assert c1 is not c2
+        self.c1, self.c2 = c1, c2
+        self.rates = numpy.asarray(rates, dtype=numpy.float64)
+
+    @staticmethod
+    def from_exchange_rates(exchange_rates, c1=None, c2=None):
+        """builds a RateArray from a sequence of ExchangeRate, all between
+        the same currencies (in either order). The currencies of the first
+        one are used, unless c1 and c2 are given"""
+        _require_numpy()
+        exchange_rates = list(exchange_rates)
+        if c1 is None:
+            c1, c2 = exchange_rates[0]._c
+        direct, inverse = (c1, c2), (c2, c1)
+        rates = numpy.empty(len(exchange_rates), numpy.float64)
+        for i, er in enumerate(exchange_rates):
+            if er._c == direct:
+                rates[i] = er._er
+            elif er._c == inverse:
+                rates[i] = 1 / er._er
+            else:
+                raise BadCurrency(er, c1)
+        return RateArray(c1, c2, rates)
+
+    def to_exchange_rates(self):
+        return [ExchangeRate(self.c1, self.c2, _to_decimal(r))
+                for r in self.rates]
+
+    def __len__(self):
+        return len(self.rates)
+
+    def __getitem__(self, i):
+        r = self.rates[i]
+        if isinstance(r, numpy.ndarray):
+            return RateArray(self.c1, self.c2, r)
+        return ExchangeRate(self.c1, self.c2, _to_decimal(r))
+
+    def reverse(self):
+        '''returns a RateArray with swapped currencies order'''
+        return RateArray(self.c2, self.c1, 1 / self.rates)
+
+    def per(self, currency):
+        '''returns the rates with currency as the denominator, as a plain
+        numpy array - e.g. the prices, in USD, of a USD/BTC RateArray'''
+        if currency is self.c1:
+            return self.rates
+        if currency is self.c2:
+            return 1 / self.rates
+        raise BadCurrency(self, currency)
+
+    def convert(self, amounts, currency=None):
+        """converts an AmountArray (or an Amount, for every rate) to the
+        other currency of these rates"""
+        if isinstance(amounts, Amount):
+            amounts = AmountArray(numpy.repeat(float(amounts.value),
+                                  len(self)), amounts.currency)
+        if currency is amounts.currency:
+            return amounts
+        if amounts.currency is self.c1:
+            result = AmountArray(amounts.values * self.rates, self.c2)
+        elif amounts.currency is self.c2:
+            result = AmountArray(amounts.values / self.rates, self.c1)
+        else:
+            raise BadCurrency(self, amounts.currency)
+        if currency is not None and currency is not result.currency:
+            raise BadCurrency(self, currency)
+        return result
+
+    def _other(self, other):
+        if isinstance(other, RateArray):
+            if (other.c1, other.c2) != (self.c1, self.c2):
+                raise ValueError("can't compare rates of different currencies")
+            return other.rates
+        if isinstance(other, ExchangeRate):
+            if set(other._c) != set((self.c1, self.c2)):
+                raise ValueError("can't compare rates of different currencies")
+            return float(other.per(self.c1)._er)
+        raise ValueError("can't compare RateArray with ", type(other))
+
+    def __lt__(self, other):
+        return self.rates < self._other(other)
+
+    def __le__(self, other):
+        return self.rates <= self._other(other)
+
+    def __gt__(self, other):
+        return self.rates > self._other(other)
+
+    def __ge__(self, other):
+        return self.rates >= self._other(other)
+
+    def __repr__(self):
+        return "<RateArray({0} {1}/{2})>".format(self.rates, self.c2, self.c1)
+
+
+# ---- depth and trades -------------------------------------------------
+
+# price: of the item (currency2) in currency1; size: in currency2;
+# cumulative: size of this level and the ones before it (on its side);
+# side: 'ask', 'bid', or '' for trades
+BOOK_DTYPE = [('price', 'f8'), ('size', 'f8'), ('cumulative', 'f8'),
+              ('side', 'S3'), ('venue', 'S16'), ('timestamp', 'M8[us]')]
+
+_SIDES = {'ASK': 'ask', 'BID': 'bid'}
+
+
+def _book_array(prices, sizes, side, venue, timestamps):
+    a = numpy.empty(len(prices), dtype=BOOK_DTYPE)
+    a['price'] = prices
+    a['size'] = sizes
+    numpy.cumsum(a['size'], out=a['cumulative'])
+    a['side'] = side
+    a['venue'] = venue
+    a['timestamp'] = timestamps
+    return a
+
+
+def _price_and_size(market, rate, amount):
+    price = float(rate._er)
+    if rate._c[0] is not market.currency2:
+        price = 1 / price
+    size = float(amount.value)
+    if amount.currency is not market.currency2:
+        size /= price
+    return price, size
+
+
+def orders_array(orders):
+    """one side of a depth (a list of Orders or a LazyOrders) as an array
+    of BOOK_DTYPE, best price first.
+
+    A LazyOrders whose raw levels are (price, size) pairs is read straight
+    from them, without building its Orders (but the first)"""
+    _require_numpy()
+    if not len(orders):
+        return numpy.empty(0, dtype=BOOK_DTYPE)
+    first = orders[0]
+    market = first.market
+    side = _SIDES.get(first.order_type, '')
+    if getattr(orders, 'pairs', False):
+        # no copy if the levels already are an array of floats
+        levels = numpy.asarray(orders.levels, dtype=numpy.float64)
+        prices, sizes = levels[:, 0], levels[:, 1]
+        # the levels of a side are fetched at once, sharing a timestamp
+        timestamps = numpy.datetime64(first.timestamp, 'us')
+        if orders.key is None:      # already best first
+            return _book_array(prices, sizes, side, market.name, timestamps)
+    else:
+        n = len(orders)
+        prices = numpy.empty(n, numpy.float64)
+        sizes = numpy.empty(n, numpy.float64)
+        timestamps = numpy.empty(n, 'M8[us]')
+        for i, o in enumerate(orders):
+            prices[i], sizes[i] = _price_and_size(market, o.exchange_rate,
+                                                  o.from_amount)
+            timestamps[i] = o.timestamp
+    i = numpy.argsort(-prices if side == 'bid' else prices, kind='mergesort')
+    if timestamps.ndim:
+        timestamps = timestamps[i]
+    return _book_array(prices[i], sizes[i], side, market.name, timestamps)
+
+
+def depth_array(depth):
+    """a depth (as returned by Market.getDepth) as an array of BOOK_DTYPE:
+    the asks, then the bids, each best price first"""
+    _require_numpy()
+    return numpy.concatenate([orders_array(depth['asks']),
+                              orders_array(depth['bids'])])
+
+
+def trades_array(trades):
+    """a sequence of Trades as an array of BOOK_DTYPE, in the same order.
+    Trades have no side"""
+    _require_numpy()
+    n = len(trades)
+    prices = numpy.empty(n, numpy.float64)
+    sizes = numpy.empty(n, numpy.float64)
+    timestamps = numpy.empty(n, 'M8[us]')
+    venues = numpy.empty(n, 'S16')
+    for i, t in enumerate(trades):
+        prices[i], sizes[i] = _price_and_size(t.market, t.exchange_rate,
+                                              t.from_amount)
+        timestamps[i] = t.timestamp
+        venues[i] = t.market.name
+    return _book_array(prices, sizes, '', venues, timestamps)
+
+
+def to_frame(array):
+    """a structured array (e.g. of BOOK_DTYPE) as a pandas DataFrame"""
+    _require_pandas()
+    return pandas.DataFrame(array)
@@ -0,0 +1,114 @@
+"""Lazy views over the raw levels of a depth book.
+
+A LazyOrders holds the levels of one side of a book as the exchange sent
+them and builds the Order of each level only when it's first read, best
+price first. Consumers that stop early (simulateOrder, top of book) never
+pay for the tail of the book.
+
+Levels that the exchange already sends best first are read in order. For
+the others, a heap of their prices is built (which is linear) and popped
+as the view is read, so only the levels read are sorted.
+
+A Depth is what Market.getDepth returns: a dictionary with the 'asks'
+and the 'bids' of a market, which can be exported to numpy and pandas.
+"""
+
+import heapq
+
+import currency_array
+
+
+class LazyOrders(object):
+    """One side of a depth book, as a read-only sequence of Orders sorted
+    best price first.
+
+    levels: the raw levels
+    make: function that builds the Order of a raw level
+    key: function of a raw level that sorts the levels best first; only
+    needed if levels aren't already sorted that way
+    pairs: True if each raw level is a (price, size) pair of numbers (or
+    numeric strings), the price in currency1 and the size in currency2 of
+    the market. Exports then read the levels without building Orders
+    """
+
+    def __init__(self, levels, make, key=None, pairs=False):
+        self.levels = levels
+        self.make = make
+        self.key = key
+        self.pairs = pairs
+        self.orders = []        # the levels built so far, best first
+        self._heap = None
+        if key is not None:
+            self._heap = [(key(l), i) for i, l in enumerate(levels)]
+            heapq.heapify(self._heap)
+
+    def _next(self):
+        """builds the next level, returning False if there's none left"""
+        n = len(self.orders)
+        if n == len(self.levels):
+            return False
+        if self._heap is None:
+            level = self.levels[n]
+        else:
+            level = self.levels[heapq.heappop(self._heap)[1]]
+        self.orders.append(self.make(level))
+        return True
+
+    def __iter__(self):
+        i = 0
+        while i < len(self.orders) or self._next():
+            yield self.orders[i]
+            i += 1
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __nonzero__(self):
+        return len(self.levels) > 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        while len(self.orders) <= i:
+            if not self._next():
+                raise IndexError("LazyOrders index out of range")
+        return self.orders[i]
+
+    def materialize(self):
+        """builds every level, returning the list of Orders"""
+        while self._next():
+            pass
+        return self.orders
+
+    def to_numpy(self):
+        """these orders as a numpy structured array; see
+        currency_array.orders_array"""
+        return currency_array.orders_array(self)
+
+    def to_frame(self):
+        """these orders as a pandas DataFrame"""
+        return currency_array.to_frame(self.to_numpy())
+
+    def __repr__(self):
+        return "<LazyOrders({0} of {1} levels built)>".format(
+            len(self.orders), len(self.levels))
+
+
+class Depth(dict):
+    """The asks and the bids of a market, each a list of Orders or a
+    LazyOrders"""
+
+    def __init__(self, market, asks, bids):
+        dict.__init__(self, asks=asks, bids=bids)
+        self.market = market
+
+    def to_numpy(self):
+        """the asks, then the bids, as a numpy structured array; see
+        currency_array.depth_array"""
+        return currency_array.depth_array(self)
+
+    def to_frame(self):
+        """the asks, then the bids, as a pandas DataFrame"""
+        return currency_array.to_frame(self.to_numpy())
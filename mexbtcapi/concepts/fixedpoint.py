@@ -0,0 +1,211 @@
+"""Compact, integer-only counterparts of Amount and ExchangeRate.
+
+A FixedAmount holds an integer number of minor units of its currency
+(satoshis for BTC, cents for USD, ...), as given by the currency's scale.
+A FixedExchangeRate holds its rate as an integer number of
+1/10**RATE_SCALE. All the arithmetic is done on integers; Decimal is
+only used when converting from and to Amount and ExchangeRate, and
+those conversions are exact (or raise ValueError).
+"""
+
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount, ExchangeRate, BadCurrency
+from mexbtcapi.util.slots import Slotted
+
+
+DEFAULT_SCALE = 8
+RATE_SCALE = 8
+
+# number of decimal places of the minor unit of each currency
+SCALES = {
+    'BTC': 8, 'LTC': 8, 'PPC': 6, 'NMC': 8, 'NVC': 6, 'TRC': 8, 'FTC': 8,
+    'XRP': 6,
+    'USD': 2, 'EUR': 2, 'GBP': 2, 'CHF': 2, 'CAD': 2, 'AUD': 2, 'RUR': 2,
+    'RUB': 2, 'CNY': 2, 'PLN': 2, 'SEK': 2, 'NOK': 2, 'DKK': 2, 'NZD': 2,
+    'JPY': 0, 'KRW': 0,
+}
+
+
+def register_scale(currency, places):
+    """sets the number of decimal places of the minor unit of currency"""
+    SCALES[str(currency)] = places
+    _FACTORS.clear()
+
+
+def scale(currency):
+    return SCALES.get(currency.name, DEFAULT_SCALE)
+
+
+_FACTORS = {}   # currency name -> 10 ** scale
+
+
+def _factor(currency):
+    f = _FACTORS.get(currency.name)
+    if f is None:
+        f = _FACTORS[currency.name] = 10 ** scale(currency)
+    return f
+
+
+def _divide(n, d):
+    """n / d, rounded half to even, for integers"""
+    q, r = divmod(n, d)
+    twice = 2 * r
+    if twice > d or (twice == d and q % 2):
+        q += 1
+    return q
+
+
+def _to_units(value, places):
+    """converts a Decimal to an integer number of 10**-places, exactly"""
+    value = Decimal(value)
+    units = value.scaleb(places)
+    if units != units.to_integral_value():
+        raise ValueError("{0} has more than {1} decimal places".format(
+            value, places))
+    return int(units)
+
+
+class FixedAmount(Slotted):
+    """An amount of a given currency, as an integer of minor units"""
+    __slots__ = ('units', 'currency')
+
+    def __init__(self, units, currency):
+        self.units = units
+        self.currency = currency
+
+    @staticmethod
+    def from_decimal(value, currency):
+        return FixedAmount(_to_units(value, scale(currency)), currency)
+
+    @staticmethod
+    def from_amount(amount):
+        return FixedAmount.from_decimal(amount.value, amount.currency)
+
+    @property
+    def value(self):
+        return Decimal(self.units).scaleb(-scale(self.currency))
+
+    def to_amount(self):
+        return Amount(self.value, self.currency)
+
+    def _check(self, other):
+        if not isinstance(other, FixedAmount):
+            raise ValueError("Can't operate FixedAmount with ", type(other))
+        if self.currency is not other.currency:
+            raise ValueError("Can't operate two amounts in " + \
+                             "different currencies")
+
+    def __add__(self, other):
+        self._check(other)
+        return FixedAmount(self.units + other.units, self.currency)
+
+    def __sub__(self, other):
+        self._check(other)
+        return FixedAmount(self.units - other.units, self.currency)
+
+    def __neg__(self):
+        return FixedAmount(-self.units, self.currency)
+
+    def __mul__(self, other):
+        if type(other) not in (int, long):
+            raise ValueError("Can only multiply a FixedAmount by an " + \
+                             "integer; use a FixedExchangeRate instead")
+        return FixedAmount(self.units * other, self.currency)
+
+    __rmul__ = __mul__
+
+    def __cmp__(self, other):
+        self._check(other)
+        return cmp(self.units, other.units)
+
+    def __eq__(self, other):
+        return isinstance(other, FixedAmount) and \
+            self.currency is other.currency and self.units == other.units
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.units, self.currency))
+
+    def __nonzero__(self):
+        return self.units != 0
+
+    def __repr__(self):
+        return "<FixedAmount({0} {1})>".format(self.value, self.currency)
+
+    def __str__(self):
+        return "{:.2f} {}".format(self.value, self.currency)
+
+
+class FixedExchangeRate(Slotted):
+    """The proportion between two currencies' values:
+    c2 = (units / 10**RATE_SCALE) * c1"""
+    __slots__ = ('c1', 'c2', 'units')
+
+    def __init__(self, c1, c2, units):
+        self.c1 = c1
+        self.c2 = c2
+        self.units = units
+
+    @staticmethod
+    def from_decimal(c1, c2, rate):
+        return FixedExchangeRate(c1, c2, _to_units(rate, RATE_SCALE))
+
+    @staticmethod
+    def from_exchange_rate(exchange_rate):
+        c1, c2 = exchange_rate._c
+        return FixedExchangeRate.from_decimal(c1, c2, exchange_rate._er)
+
+    @property
+    def rate(self):
+        return Decimal(self.units).scaleb(-RATE_SCALE)
+
+    def to_exchange_rate(self):
+        return ExchangeRate(self.c1, self.c2, self.rate)
+
+    def convert(self, amount):
+        """converts a FixedAmount to the other currency of this rate,
+        rounding to the nearest minor unit of that currency"""
+        c = amount.currency
+        if c is self.c1:
+            return FixedAmount(_divide(
+                amount.units * self.units * _factor(self.c2),
+                _factor(self.c1) * 10 ** RATE_SCALE), self.c2)
+        if c is self.c2:
+            return FixedAmount(_divide(
+                amount.units * 10 ** RATE_SCALE * _factor(self.c1),
+                _factor(self.c2) * self.units), self.c1)
+        raise BadCurrency(self, c)
+
+    def reverse(self):
+        '''returns a FixedExchangeRate with swapped currencies order, and
+        the rate rounded to RATE_SCALE places'''
+        return FixedExchangeRate(self.c2, self.c1,
+                                 _divide(10 ** (2 * RATE_SCALE), self.units))
+
+    def __cmp__(self, other):
+        if not isinstance(other, FixedExchangeRate) or \
+                (self.c1, self.c2) != (other.c1, other.c2):
+            raise ValueError("can't compare the two values:", str(self),
+                             str(other))
+        return cmp(self.units, other.units)
+
+    def __eq__(self, other):
+        return isinstance(other, FixedExchangeRate) and \
+            self.c1 is other.c1 and self.c2 is other.c2 and \
+            self.units == other.units
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.c1, self.c2, self.units))
+
+    def __repr__(self):
+        return "<FixedExchangeRate({:.2f} {}/{})>".format(self.rate,
+                                                          self.c2, self.c1)
+
+    def __str__(self):
+        return "{:.2f} {}/{}".format(self.rate, self.c2, self.c1)
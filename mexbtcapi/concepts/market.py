@@ -2,13 +2,27 @@ from currency import ExchangeRate, Amount
 from datetime import datetime, timedelta
 from decimal import Decimal
 
+from depth import Depth, LazyOrders
+import currency_array
 from mexbtcapi.util.comp import comp, dcomp
+from mexbtcapi.util.cache import create_cache
+from mexbtcapi.util.hedge import call_public
+from mexbtcapi.util.metrics import REGISTRY, timed
+from mexbtcapi.util.tracing import phase, traced
+from mexbtcapi.util.slots import Slotted
 
+BOOK_LEVELS = REGISTRY.gauge("mexbtcapi_book_levels",
+    "Levels of each side of the last depth fetched",
+    ("exchange", "pair", "side"))
+SIMULATE_ORDER = REGISTRY.histogram("mexbtcapi_simulate_order_seconds",
+    "Duration of Market.simulateOrder", ("exchange", "pair"))
 
-class Trade(object):
+
+class Trade(Slotted):
     """Represents an exchange of two currency amounts.
     May include the entities between which the trade is made
     """
+    __slots__ = ('market', 'timestamp', 'from_amount', 'exchange_rate')
 
     def __init__(self, market, timestamp, from_amount, exchange_rate):
         assert isinstance(market, Market)  # must not be null
@@ -21,6 +35,17 @@ class Trade(object):
         self.from_amount = from_amount
         self.exchange_rate = exchange_rate
 
+    @classmethod
+    def from_trusted(cls, market, timestamp, from_amount, exchange_rate):
+        """builds a Trade without checking its arguments, which must be
+        what the constructor expects"""
+        t = object.__new__(cls)
+        t.market = market
+        t.timestamp = timestamp
+        t.from_amount = from_amount
+        t.exchange_rate = exchange_rate
+        return t
+
     @property
     def to_amount(self):
         return self.exchange_rate.convert(self.from_amount)
@@ -33,7 +58,20 @@ class Trade(object):
                     self.from_amount, self.exchange_rate)
 
 
-class Order(object):
+class TradeList(list):
+    """A list of Trades, which can be exported to numpy and pandas"""
+
+    def to_numpy(self):
+        """these trades as a numpy structured array; see
+        currency_array.trades_array"""
+        return currency_array.trades_array(self)
+
+    def to_frame(self):
+        """these trades as a pandas DataFrame"""
+        return currency_array.to_frame(self.to_numpy())
+
+
+class Order(Slotted):
     """Represents an order to buy or sell a number of from_amount for
     exchange_rate.
 
@@ -46,6 +84,9 @@ class Order(object):
     MARKET_BUY = 'MARKET_BUY'
     MARKET_SELL = 'MARKET_SELL'
 
+    __slots__ = ('market', 'timestamp', 'order_type', 'from_amount',
+                 'exchange_rate', 'properties', 'entity')
+
     def __init__(self, market, timestamp, order_type, from_amount,
                  exchange_rate, properties="", entity=None):
         assert isinstance(market, Market)  # must not be null
@@ -63,6 +104,23 @@ class Order(object):
         self.exchange_rate = exchange_rate # or limit in case of ask/bid orders
         self.properties = properties
         self.entity = entity
+
+    @classmethod
+    def from_trusted(cls, market, timestamp, order_type, from_amount,
+                     exchange_rate, properties="", entity=None):
+        """builds an Order without checking its arguments, which must be
+        what the constructor expects (timestamp can't be None). For
+        adapters building many orders, e.g. a whole book, sharing a
+        timestamp"""
+        o = object.__new__(cls)
+        o.market = market
+        o.timestamp = timestamp
+        o.order_type = order_type
+        o.from_amount = from_amount
+        o.exchange_rate = exchange_rate
+        o.properties = properties
+        o.entity = entity
+        return o
     
     def expense(self):
         """
@@ -104,6 +162,13 @@ class Market(object):
         '''raised when there's something wrong with an order, in this
         market's context'''
 
+    # milliseconds a Quote is reused for by getQuote (0 to never reuse it)
+    QUOTE_TIMEOUT = 500
+
+    # whether getDepth takes lazy, max_notional and max_levels. Markets
+    # written before those were added don't, and get the whole book cut
+    DEPTH_LIMITS = False
+
     def __init__(self, market_name, buy_currency, sell_currency):
         """
         Currency1 is the "buy" currency, i.e. the currency used to 
@@ -113,18 +178,136 @@ class Market(object):
         self.name = market_name
         self.currency1 = buy_currency
         self.currency2 = sell_currency
+        self._quote_cache = create_cache(self.QUOTE_TIMEOUT, serialize=False)
+        self.hedging = None
 
     def getTicker(self):
         """Returns the most recent ticker"""
         raise NotImplementedError()
 
-    def getDepth(self):
+    @traced
+    def getQuote(self):
+        """Returns the current Quote: the best bid and ask. Quotes are
+        cached for QUOTE_TIMEOUT milliseconds"""
+        if not self.QUOTE_TIMEOUT:
+            return self._fetchQuote()
+        return self._quote_cache.call(self._fetchQuote, (),
+                                      key_override="quote")
+
+    def _fetchQuote(self):
+        """
+        Fetches the Quote with the cheapest request the exchange offers.
+        By default, uses the top level of the depth book
+        """
+        return Quote.fromDepth(self, self._limitedDepth(max_levels=1))
+
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
         """
         Returns the depth book as a dictionary with two keys: 'asks', 'bids'. Each containing 
         a list of orders representing each
+
+        If lazy, each side may instead be a mexbtcapi.concepts.depth.LazyOrders,
+        which builds its orders as they're read, best price first
+
+        max_notional: an Amount (of either currency of the market). Each side
+        only needs as many levels, best first, as it takes to cover it
+        max_levels: each side has at most this many levels, best first
+
+        Markets whose exchange can limit the depth it sends use them to
+        fetch less (see _progressiveDepth). Implementations set
+        DEPTH_LIMITS
         """
         raise NotImplementedError()
 
+    def _limitedDepth(self, max_notional=None, max_levels=None):
+        """getDepth(lazy=True, max_notional=..., max_levels=...), also for
+        markets whose getDepth takes no arguments: their whole book is
+        fetched and cut here"""
+        if self.DEPTH_LIMITS:
+            return self.getDepth(lazy=True, max_notional=max_notional,
+                                 max_levels=max_levels)
+        return self._truncateDepth(self.getDepth(), max_notional, max_levels,
+                                   lazy=True)
+
+    def _sortedSide(self, orders, order_type):
+        """orders of one side of the book, best price first"""
+        if isinstance(orders, LazyOrders):
+            return orders
+        if order_type == Order.BID:
+            return sorted(orders, dcomp(self.currency2))
+        return sorted(orders, comp(self.currency2))
+
+    def _depthCovers(self, orders, amount):
+        """whether orders (best first) add up to at least amount"""
+        total = Amount(0, amount.currency)
+        for o in orders:
+            total += o.exchange_rate.convert(o.from_amount, amount.currency)
+            if total >= amount:
+                return True
+        return False
+
+    def _observeDepth(self, depth):
+        """records the size of each side of depth, just fetched from the
+        exchange. Returns depth"""
+        pair = "{0}/{1}".format(self.currency2, self.currency1)
+        for side in ('asks', 'bids'):
+            BOOK_LEVELS.set(len(depth[side]), (self.name, pair, side))
+        return depth
+
+    def _truncateDepth(self, depth, max_notional=None, max_levels=None,
+                       lazy=False):
+        """cuts each side of depth (as returned by getDepth(lazy=True)) to
+        max_notional and max_levels; see getDepth"""
+        if max_notional is None and max_levels is None:
+            if lazy:
+                return depth
+            return Depth(self, list(depth['asks']), list(depth['bids']))
+        ret = Depth(self, None, None)
+        for typ, order_type in (('asks', Order.ASK), ('bids', Order.BID)):
+            side, total = [], None
+            if max_notional is not None:
+                total = Amount(0, max_notional.currency)
+            for o in self._sortedSide(depth[typ], order_type):
+                if max_levels is not None and len(side) >= max_levels:
+                    break
+                if total is not None and total >= max_notional:
+                    break
+                side.append(o)
+                if total is not None:
+                    total += o.exchange_rate.convert(o.from_amount,
+                                                     max_notional.currency)
+            ret[typ] = side
+        return ret
+
+    def _progressiveDepth(self, fetch, max_notional=None, max_levels=None,
+                          lazy=False, initial=10, limit=None):
+        """
+        getDepth for exchanges that can limit the number of levels they
+        send. fetch(n) returns the depth (as getDepth(lazy=True) would)
+        with at most n levels per side.
+
+        Starts with initial levels and doubles them until max_notional is
+        covered on both sides, or the book has no more levels, or
+        max_levels (or the exchange's own limit) is reached
+        """
+        caps = [x for x in (max_levels, limit) if x is not None]
+        cap = min(caps) if caps else None   # None: the whole book
+        if max_notional is None:
+            return self._truncateDepth(fetch(cap), None, max_levels, lazy)
+        n = initial if cap is None else min(initial, cap)
+        while True:
+            depth = fetch(n)
+            if cap is not None and n >= cap:
+                break
+            # a side with fewer than n levels is the whole book
+            if all(len(side) < n or self._depthCovers(side, max_notional)
+                   for side in depth.values()):
+                break
+            n = n * 2 if cap is None else min(n * 2, cap)
+        return self._truncateDepth(depth, max_notional, max_levels, lazy)
+
+    @timed(SIMULATE_ORDER)
+    @traced
     def simulateOrder(self, order):
         """
         Simulates an order if given right now. Returns a tupple of the currency used
@@ -146,7 +329,8 @@ class Market(object):
         # this is a fairly generic implementation. It should work for
         # all markets that implement "getDepth" properly
 
-        depth = self.getDepth()
+        # only fetch as deep as the order can go
+        depth = self._limitedDepth(max_notional=order.from_amount)
         # There are 4 possibilities for bid/ask orders:
         # 1. bid is given in C1 => e.g. buy 100 USD of BTC limit 150 => take 100 USD and spend them until limit is reached
         # 2. bid is given in C2 => e.g. buy 1 BTC, limit 150 => buy AT MOST 1 BTC with - spend USD until 1 BTC is reached or limit
@@ -173,8 +357,11 @@ class Market(object):
         bucket = order.from_amount.clone() # starting with a full amount of currency and subtracting as we go...
 
         # If we are buying we need to look at the sorted asks, and vice versa
-        dp = (order.order_type in [Order.BID, Order.MARKET_BUY] and sorted(depth['asks'], comp(self.currency2)) \
-                or sorted(depth['bids'], dcomp(self.currency2)))
+        # (a LazyOrders is already sorted, and only builds the levels we read)
+        if order.order_type in [Order.BID, Order.MARKET_BUY]:
+            dp = self._sortedSide(depth['asks'], Order.ASK)
+        else:
+            dp = self._sortedSide(depth['bids'], Order.BID)
         total_transacted = Amount(0, sim_c)
 
         for d in dp:
@@ -195,6 +382,35 @@ class Market(object):
         """Returns all completed trades"""
         raise NotImplementedError()
 
+    def hookTransport(self, hook):
+        """
+        Routes the raw exchange responses this market receives through
+        hook - a mexbtcapi.util.record Recorder (to record them) or
+        Player (to replay them instead of contacting the exchange)
+        """
+        raise NotImplementedError()
+
+    def unhookTransport(self):
+        """Undoes hookTransport: this market contacts the exchange again"""
+        raise NotImplementedError()
+
+    def setHedging(self, policy):
+        """
+        Hedges the idempotent public requests (depth, ticker, trades...)
+        of this market with policy, a mexbtcapi.util.hedge.HedgingPolicy.
+        None stops hedging
+        """
+        self.hedging = policy
+
+    def _publicCall(self, kind, f, *args, **kwargs):
+        """
+        Makes an idempotent public request f(*args, **kwargs) of kind
+        (e.g. 'depth'): through the exchange's circuit breaker and, if
+        setHedging was used, hedged
+        """
+        with phase("call", self.name):
+            return call_public(self.name, kind, f, args, kwargs, self.hedging)
+
     def _orderSanityCheck(self, order):
         '''checks if an order is adequate in this market'''
         er= order.exchange_rate
@@ -260,7 +476,45 @@ class ActiveParticipant(Participant):
         raise NotImplementedError()
 
 
-class Ticker(object):
+class Quote(Slotted):
+    """The top of a market's book.
+
+    bid, ask: ExchangeRate of the best bid and ask (None if that side of
+    the book is empty)
+    bid_size, ask_size: Amount of the item available at bid and ask (None
+    if the exchange doesn't tell)
+    timestamp: when the quote was valid. This is the server time, if
+    available.
+    """
+    __slots__ = ('market', 'timestamp', 'bid', 'ask', 'bid_size', 'ask_size')
+
+    def __init__(self, market, timestamp, bid, ask, bid_size=None,
+                 ask_size=None):
+        assert isinstance(market, Market)
+        assert isinstance(timestamp, datetime)
+        self.market, self.timestamp = market, timestamp
+        self.bid, self.ask = bid, ask
+        self.bid_size, self.ask_size = bid_size, ask_size
+
+    @staticmethod
+    def fromDepth(market, depth, timestamp=None):
+        """builds the Quote of depth, as returned by market.getDepth"""
+        def top(typ, order_type):
+            for o in market._sortedSide(depth[typ], order_type):
+                size = o.exchange_rate.convert(o.from_amount, market.currency2)
+                return o.exchange_rate, size
+            return None, None
+        bid, bid_size = top('bids', Order.BID)
+        ask, ask_size = top('asks', Order.ASK)
+        return Quote(market, timestamp or datetime.now(), bid, ask,
+                     bid_size, ask_size)
+
+    def __repr__(self):
+        return "<Quote({0}, {1}, {2} x {3}, {4} x {5})>".format(self.market,
+            self.timestamp, self.bid, self.bid_size, self.ask, self.ask_size)
+
+
+class Ticker(Slotted):
     """Ticker datapoint
     """
 
@@ -270,6 +524,8 @@ class Ticker(object):
     TIME_PERIOD = timedelta(days=1)
     RATE_FIELDS= ('high', 'low', 'average', 'last', 'sell', 'buy')
 
+    __slots__ = ('market', 'time', 'volume') + RATE_FIELDS
+
     def __init__(self, market, time, high=None, low=None, average=None,
                     last=None, sell=None, buy=None, volume=None):
         """
@@ -288,6 +544,17 @@ class Ticker(object):
         self.high, self.low, self.average, self.last, self.sell, self.buy = \
             high, low, average, last, sell, buy
 
+    @classmethod
+    def from_trusted(cls, market, time, high=None, low=None, average=None,
+                     last=None, sell=None, buy=None, volume=None):
+        """builds a Ticker without checking its arguments, which must be
+        what the constructor expects"""
+        t = object.__new__(cls)
+        t.market, t.time, t.volume = market, time, volume
+        t.high, t.low, t.average, t.last, t.sell, t.buy = \
+            high, low, average, last, sell, buy
+        return t
+
     def __repr__(self):
         return \
             "<Ticker({0}, {1}, {2}, {3}, {4}, {5}, {6}, {7}, {8})" \
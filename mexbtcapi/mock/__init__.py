@@ -0,0 +1,5 @@
+"""A local stand-in for the exchanges (server) and a load test of the
+adapters against it (loadtest)."""
+
+from mexbtcapi.mock.server import Faults, MockExchange, RecordedBook, \
+    SyntheticBook
@@ -0,0 +1,260 @@
+"""Load tests the BTC-e adapter against a MockExchange.
+
+N client threads call the real BTCeMarket (or TradeAPI) code for a
+while; the throughput, the errors and the latency percentiles of the
+calls are reported.
+
+usage:
+    python -m mexbtcapi.mock.loadtest -c 16 -d 10 depth quote trade
+    python -m mexbtcapi.mock.loadtest --latency 0.05 --errors 0.01 depth
+    python -m mexbtcapi.mock.loadtest --host 127.0.0.1:8080 depth
+
+By default every call reaches the server: the rate limits, the pair
+batcher and the quote cache are turned off (--limits and --cache keep
+them).
+"""
+
+import argparse
+import collections
+import httplib
+import itertools
+import random
+import re
+import threading
+import time
+
+from mexbtcapi.concepts.currencies import USD, BTC
+from mexbtcapi.mock.server import Faults, MockExchange, SyntheticBook
+
+
+def _btce():
+    from mexbtcapi.api.btce import common, high_level, trade
+    return common, high_level, trade
+
+
+# ---- scenarios: f(client) makes one call -------------------------------
+
+def _depth(client):
+    client.market.getDepth()
+
+
+def _quote(client):
+    client.market.getQuote()
+
+
+def _trades(client):
+    client.market.getTrades()
+
+
+def _trade(client):
+    # a bid well under the book, cancelled right away: two calls, so
+    # funds don't run out
+    info = client.api.trade("btc_usd", "buy", 1, 0.1)
+    client.api.cancelOrder(info.order_id)
+
+
+SCENARIOS = collections.OrderedDict([
+    ("depth", _depth), ("quote", _quote), ("trades", _trades),
+    ("trade", _trade)])
+
+
+class Client(object):
+    def __init__(self, market, api):
+        self.market = market
+        self.api = api
+
+
+class Result(object):
+    """the calls of a scenario: their latencies (seconds) and errors (by
+    exception class)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, latency, error=None):
+        with self.lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                self.errors[error.__class__.__name__] += 1
+
+    def percentile(self, p):
+        """the p-th percentile (0-100) of the latencies, None if there are
+        none"""
+        l = sorted(self.latencies)
+        if not l:
+            return None
+        return l[min(len(l) - 1, int(len(l) * p / 100.0))]
+
+    def report(self, duration):
+        ms = lambda s: "-" if s is None else "%.1f" % (s * 1000)
+        calls = len(self.latencies) + sum(self.errors.values())
+        line = "{0:<8} {1:>7} {2:>9.1f} {3:>7} {4:>7} {5:>7} {6:>7} {7:>6}" \
+            .format(self.name, calls, calls / duration,
+                    ms(self.percentile(50)), ms(self.percentile(90)),
+                    ms(self.percentile(99)),
+                    ms(max(self.latencies) if self.latencies else None),
+                    sum(self.errors.values()))
+        for error, n in self.errors.most_common():
+            line += "\n         {0}: {1}".format(error, n)
+        return line
+
+
+HEADER = "{0:<8} {1:>7} {2:>9} {3:>7} {4:>7} {5:>7} {6:>7} {7:>6}".format(
+    "", "calls", "calls/s", "p50 ms", "p90 ms", "p99 ms", "max ms", "errors")
+
+
+def _sync_nonce(api, tries=5):
+    """sets the nonce of api (a TradeAPI) to the next one its key accepts.
+    A request with nonce 1 either succeeds (a new key) or is refused with
+    the last nonce the exchange saw. Other errors (e.g. injected faults)
+    are retried"""
+    for _ in xrange(tries):
+        api.nonce = 1
+        try:
+            api.getInfo()
+            return
+        except Exception, e:
+            last = re.search(r"on key:(\d+)", str(e))
+            if last is not None:
+                api.nonce = int(last.group(1)) + 1
+                return
+    raise e
+
+
+def run(domain, scenarios, clients=8, duration=10.0, keys=None,
+        limits=False, cache=False, pool_size=None, secure=False):
+    """
+    Runs clients threads against the BTC-e API at domain for duration
+    seconds, each calling the scenarios (names of SCENARIOS) in turn.
+    keys: (key, secret) of the trade scenario, given to the clients in
+    turn. The clients sharing a key share its TradeAPI (and nonces).
+    Returns a Result for each scenario.
+    """
+    if "trade" in scenarios and not keys:
+        raise ValueError("the trade scenario needs keys")
+    common, high_level, trade = _btce()
+    saved = (common.btce_domain, common.pool.connection_class,
+             common.pool.size, high_level.batcher.timeout,
+             common.scheduler.enabled)
+    try:
+        common.setEndpoint(domain, httplib.HTTPSConnection if secure
+                           else httplib.HTTPConnection)
+        if pool_size is not None:
+            common.pool.size = pool_size
+        if not limits:
+            common.scheduler.enabled = False
+        if not cache:
+            high_level.batcher.timeout = 0
+        return _run(common, high_level, trade, scenarios, clients, duration,
+                    keys, cache)
+    finally:
+        domain, connection_class, size, timeout, enabled = saved
+        common.setEndpoint(domain, connection_class)
+        common.pool.size = size
+        high_level.batcher.timeout = timeout
+        common.scheduler.enabled = enabled
+
+
+def _run(common, high_level, trade, scenarios, clients, duration, keys,
+         cache):
+    market = high_level.BTCeMarket(USD, BTC)
+    if not cache:
+        market.QUOTE_TIMEOUT = 0
+    results = collections.OrderedDict((name, Result(name))
+                                      for name in scenarios)
+    keys = keys or [(None, None)] * clients
+    # one TradeAPI per key: clients sharing a key share its nonces
+    apis = {}
+    for key, secret in keys:
+        if key and key not in apis:
+            apis[key] = trade.TradeAPI(key, secret)
+            _sync_nonce(apis[key])
+    stop = time.time() + duration
+
+    def work(client, offset):
+        names = itertools.cycle(scenarios)
+        for _ in xrange(offset):
+            next(names)
+        while time.time() < stop:
+            name = next(names)
+            start = time.time()
+            try:
+                SCENARIOS[name](client)
+            except Exception, e:
+                results[name].add(time.time() - start, e)
+            else:
+                results[name].add(time.time() - start)
+
+    threads = []
+    for i in xrange(clients):
+        key = keys[i % len(keys)][0]
+        client = Client(market, apis.get(key))
+        threads.append(threading.Thread(target=work, args=(client, i)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load tests the BTC-e adapter against a mock exchange")
+    parser.add_argument("scenarios", nargs="*", default=["depth"],
+                        choices=SCENARIOS.keys())
+    parser.add_argument("-c", "--clients", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="seconds")
+    parser.add_argument("--host", help="host:port of a running mock "
+                        "exchange (by default, one is started)")
+    parser.add_argument("--key", action="append", default=[],
+                        help="a /tapi key of --host, as key:secret")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--errors", type=float, default=0.0,
+                        help="fraction of requests answered with an error")
+    parser.add_argument("--drops", type=float, default=0.0,
+                        help="fraction of connections dropped")
+    parser.add_argument("--levels", type=int, default=50,
+                        help="levels of each side of the synthetic book")
+    parser.add_argument("--pool", type=int,
+                        help="keep-alive connections kept per client process")
+    parser.add_argument("--limits", action="store_true",
+                        help="keep the exchange's rate limits")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the pair batcher and quote cache")
+    args = parser.parse_args()
+
+    exchange = None
+    keys = [tuple(k.split(':', 1)) for k in args.key]
+    if args.host is None:
+        keys = [("key%d" % i, "secret%d" % random.getrandbits(32))
+                for i in xrange(args.clients)]
+        exchange = MockExchange(
+            books={'btc_usd': SyntheticBook(levels=args.levels)},
+            keys=dict(keys),
+            faults=Faults(args.latency, args.jitter, args.errors,
+                          args.drops)).start()
+    domain = args.host or exchange.domain
+    pool = args.pool if args.pool is not None else args.clients
+
+    try:
+        results = run(domain, args.scenarios, args.clients, args.duration,
+                      keys, args.limits, args.cache, pool)
+    finally:
+        if exchange is not None:
+            exchange.stop()
+    print "{0} clients, {1}s against {2}".format(args.clients,
+                                                 args.duration, domain)
+    print HEADER
+    for result in results.values():
+        print result.report(args.duration)
+
+
+if __name__ == "__main__":
+    main()
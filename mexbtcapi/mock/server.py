@@ -0,0 +1,449 @@
+"""A local stand-in for the exchanges, to exercise the adapters (and load
+test them) without touching the real APIs.
+
+MockExchange speaks:
+
+    BTC-e       /api/2/<pair>/depth, /api/2/<pair>/trades,
+                /api/3/depth/<pairs>, /api/3/trades/<pairs> (?limit=N),
+                /tapi: getInfo, Trade, CancelOrder, OrderList,
+                TradeHistory, checking the Key and Sign (HMAC-SHA512)
+                headers and that nonces increase (up to 4294967294)
+    Bitstamp    /api/order_book/, /api/ticker/
+    Bitfinex    /v1/book/<symbol> (?limit_asks=N&limit_bids=N)
+
+The books are synthetic (SyntheticBook) or replayed from backtest
+Snapshots (RecordedBook). Faults adds latency and errors to every
+request.
+
+    exchange = MockExchange(keys={"key": "secret"}).start()
+    common.setEndpoint(exchange.domain, httplib.HTTPConnection)
+    ...
+    exchange.stop()
+
+It can also be run on its own: python -m mexbtcapi.mock.server --port 8080
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+import urlparse
+from decimal import Decimal
+
+
+# BTC-e's largest nonce, and the levels /api/3/depth returns by default
+MAX_NONCE = 4294967294
+V3_DEPTH_LIMIT = 150
+
+
+class SyntheticBook(object):
+    """A book of levels levels a side around a mid price that walks
+    randomly (by up to volatility per request). Sizes are random, around
+    size"""
+
+    def __init__(self, mid=100.0, levels=50, tick=0.01, spread=0.1,
+                 size=1.0, volatility=0.05, seed=None):
+        self.mid = mid
+        self.levels = levels
+        self.tick = tick
+        self.spread = spread
+        self.size = size
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def book(self):
+        """returns (asks, bids): lists of [price, size], best first"""
+        with self.lock:
+            r = self.random
+            self.mid = max(self.mid + r.uniform(-1, 1) * self.volatility,
+                           self.spread + self.tick * self.levels)
+            mid = self.mid
+            sizes = [round(r.uniform(0.1, 2) * self.size, 8)
+                     for _ in xrange(2 * self.levels)]
+        half = self.spread / 2
+        asks = [[round(mid + half + i * self.tick, 8), sizes[i]]
+                for i in xrange(self.levels)]
+        bids = [[round(mid - half - i * self.tick, 8), sizes[self.levels + i]]
+                for i in xrange(self.levels)]
+        return asks, bids
+
+
+class RecordedBook(object):
+    """Serves the books of backtest Snapshots (e.g. from
+    util.backtest.load_snapshots), one per request, starting over after
+    the last"""
+
+    def __init__(self, snapshots):
+        self.snapshots = itertools.cycle(snapshots)
+        self.lock = threading.Lock()
+
+    def book(self):
+        with self.lock:
+            s = next(self.snapshots)
+        level = lambda (p, v): [float(p), float(v)]
+        asks = sorted(map(level, s.asks))
+        bids = sorted(map(level, s.bids), reverse=True)
+        return asks, bids
+
+
+class Faults(object):
+    """
+    latency: seconds added to every request, plus up to jitter more
+    error_rate: fraction of the requests answered with an HTTP error
+    drop_rate: fraction of the requests whose connection is closed
+    without an answer
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 drop_rate=0.0, status=502):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.status = status
+
+
+class Account(object):
+    """The funds and orders of a /tapi key. Orders that cross the top of
+    the book fill at once; the others stay open until cancelled"""
+
+    def __init__(self, secret, funds=None):
+        self.secret = secret
+        self.nonce = 0
+        self.funds = dict(funds or {'usd': 10000.0, 'btc': 100.0})
+        self.orders = {}
+        self.trades = {}
+        self.lock = threading.Lock()
+
+
+class APIError(Exception):
+    """answered as {"success": 0, "error": message}"""
+
+
+class MockExchange(object):
+    """
+    books: pair (e.g. 'btc_usd') -> SyntheticBook or RecordedBook. Pairs
+    without one get a SyntheticBook when first requested
+    keys: /tapi key -> secret
+    faults: a Faults
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, books=None, keys=None,
+                 faults=None):
+        self.books = dict(books or {})
+        self.accounts = dict((k, Account(s)) for k, s in (keys or {}).items())
+        self.faults = faults or Faults()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.requests = 0
+
+        class Handler(_Handler):
+            exchange = self
+        self.server = _Server((host, port), Handler)
+        self.thread = None
+
+    @property
+    def domain(self):
+        """host:port of the server"""
+        return "{0}:{1}".format(*self.server.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def addKey(self, key, secret, funds=None):
+        with self.lock:
+            self.accounts[key] = Account(secret, funds)
+
+    def book(self, pair):
+        with self.lock:
+            if pair not in self.books:
+                self.books[pair] = SyntheticBook()
+            source = self.books[pair]
+        return source.book()
+
+    # ---- BTC-e public ----
+
+    def btceDepth(self, pair, limit=None):
+        asks, bids = self.book(pair)
+        return {'asks': asks[:limit], 'bids': bids[:limit]}
+
+    def btceTrades(self, pair, limit=None, v3=False):
+        asks, bids = self.book(pair)
+        now = int(time.time())
+        trades = []
+        for i in xrange(limit or 150):
+            buy = i % 2 == 0
+            price, amount = (asks if buy else bids)[0]
+            trade = {'price': price, 'amount': amount, 'tid': next(self.ids)}
+            if v3:
+                trade.update(type='bid' if buy else 'ask', timestamp=now)
+            else:
+                trade.update(trade_type='bid' if buy else 'ask', date=now,
+                             price_currency=pair.split('_')[1].upper(),
+                             item=pair.split('_')[0].upper())
+            trades.append(trade)
+        return trades
+
+    # ---- BTC-e /tapi ----
+
+    def tapi(self, key, sign, body):
+        account = self.accounts.get(key)
+        if account is None:
+            raise APIError("invalid api key")
+        expected = hmac.new(account.secret, body, hashlib.sha512).hexdigest()
+        if not hmac.compare_digest(expected, sign or ''):
+            raise APIError("invalid sign")
+        params = dict(urlparse.parse_qsl(body))
+        with account.lock:
+            try:
+                nonce = int(params.get('nonce'))
+            except (TypeError, ValueError):
+                raise APIError("invalid nonce parameter")
+            if not 0 < nonce <= MAX_NONCE:
+                raise APIError("invalid nonce parameter")
+            if nonce <= account.nonce:
+                raise APIError("invalid nonce parameter; on key:{0}, you "
+                               "sent:{1}".format(account.nonce, nonce))
+            account.nonce = nonce
+            method = getattr(self, '_tapi' + params.get('method', ''), None)
+            if method is None:
+                raise APIError("invalid method")
+            return method(account, params)
+
+    def _tapigetInfo(self, account, params):
+        return {'funds': dict(account.funds), 'open_orders':
+                len(account.orders), 'transaction_count': len(account.trades),
+                'server_time': int(time.time()),
+                'rights': {'info': 1, 'trade': 1, 'withdraw': 0}}
+
+    def _tapiTrade(self, account, params):
+        pair, typ = params['pair'], params['type']
+        rate, amount = float(params['rate']), float(params['amount'])
+        item, currency = pair.split('_')
+        if typ == 'buy' and account.funds.get(currency, 0) < rate * amount \
+                or typ == 'sell' and account.funds.get(item, 0) < amount:
+            raise APIError("It is not enough {0} in the account for "
+                           "{1}".format(currency if typ == 'buy' else item,
+                                        typ))
+        asks, bids = self.book(pair)
+        crosses = asks and rate >= asks[0][0] if typ == 'buy' \
+            else bids and rate <= bids[0][0]
+        oid = next(self.ids)
+        if typ == 'buy':
+            account.funds[currency] -= rate * amount
+        else:
+            account.funds[item] -= amount
+        if crosses:
+            if typ == 'buy':
+                account.funds[item] = account.funds.get(item, 0) + amount
+            else:
+                account.funds[currency] = \
+                    account.funds.get(currency, 0) + rate * amount
+            account.trades[oid] = {'pair': pair, 'type': typ,
+                'amount': amount, 'rate': rate, 'order_id': oid,
+                'is_your_order': 1, 'timestamp': int(time.time())}
+            received, remains, oid = amount, 0, 0
+        else:
+            account.orders[oid] = {'pair': pair, 'type': typ,
+                'amount': amount, 'rate': rate, 'status': 0,
+                'timestamp_created': int(time.time())}
+            received, remains = 0, amount
+        return {'received': received, 'remains': remains, 'order_id': oid,
+                'funds': dict(account.funds)}
+
+    def _tapiCancelOrder(self, account, params):
+        oid = int(params.get('order_id', 0))
+        order = account.orders.pop(oid, None)
+        if order is None:
+            raise APIError("bad status")
+        item, currency = order['pair'].split('_')
+        if order['type'] == 'buy':
+            account.funds[currency] += order['rate'] * order['amount']
+        else:
+            account.funds[item] += order['amount']
+        return {'order_id': oid, 'funds': dict(account.funds)}
+
+    def _tapiOrderList(self, account, params):
+        orders = dict((str(k), v) for k, v in account.orders.items()
+                      if params.get('pair') in (None, v['pair']))
+        if not orders:
+            raise APIError("no orders")
+        return orders
+
+    def _tapiTradeHistory(self, account, params):
+        trades = dict((str(k), v) for k, v in account.trades.items()
+                      if params.get('pair') in (None, v['pair']))
+        if not trades:
+            raise APIError("no trades")
+        return trades
+
+    # ---- Bitstamp and Bitfinex ----
+
+    def bitstampOrderBook(self):
+        asks, bids = self.book('btc_usd')
+        text = lambda levels: [[str(p), str(v)] for p, v in levels]
+        return {'timestamp': str(int(time.time())), 'asks': text(asks),
+                'bids': text(bids)}
+
+    def bitstampTicker(self):
+        asks, bids = self.book('btc_usd')
+        return {'bid': str(bids[0][0]), 'ask': str(asks[0][0]),
+                'last': str(bids[0][0]), 'high': str(asks[-1][0]),
+                'low': str(bids[-1][0]), 'volume': "1000.0",
+                'timestamp': str(int(time.time()))}
+
+    def bitfinexBook(self, symbol, limit_asks=None, limit_bids=None):
+        pair = "{0}_{1}".format(symbol[:3], symbol[3:])
+        asks, bids = self.book(pair)
+        now = "%.1f" % time.time()
+        level = lambda (p, v): {'price': str(p), 'amount': str(v),
+                                'timestamp': now}
+        return {'asks': map(level, asks[:limit_asks]),
+                'bids': map(level, bids[:limit_bids])}
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _int(query, name):
+    value = query.get(name)
+    return int(value[0]) if value else None
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive, like the exchanges
+    # send each answer in one write, or delayed ACKs add 40ms to them
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    exchange = None
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fault(self):
+        """applies the exchange's Faults; returns True if the request
+        was already answered (or dropped)"""
+        faults = self.exchange.faults
+        delay = faults.latency + random.uniform(0, faults.jitter)
+        if delay:
+            time.sleep(delay)
+        r = random.random()
+        if r < faults.drop_rate:
+            self.close_connection = 1
+            return True
+        if r < faults.drop_rate + faults.error_rate:
+            self._answer(faults.status, {'error': 'injected error'})
+            return True
+        return False
+
+    def _route(self, body=None):
+        url = urlparse.urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        query = urlparse.parse_qs(url.query)
+        ex = self.exchange
+        if parts == ['tapi']:
+            try:
+                result = ex.tapi(self.headers.get('Key'),
+                                 self.headers.get('Sign'), body or '')
+            except APIError, e:
+                return {'success': 0, 'error': str(e)}
+            return {'success': 1, 'return': result}
+        if len(parts) == 4 and parts[:2] == ['api', '2']:
+            if parts[3] == 'depth':
+                return ex.btceDepth(parts[2])
+            if parts[3] == 'trades':
+                return ex.btceTrades(parts[2])
+        if len(parts) == 4 and parts[:2] == ['api', '3']:
+            limit = _int(query, 'limit')
+            pairs = parts[3].split('-')
+            if parts[2] == 'depth':
+                if limit is None:
+                    limit = V3_DEPTH_LIMIT
+                return dict((p, ex.btceDepth(p, limit)) for p in pairs)
+            if parts[2] == 'trades':
+                return dict((p, ex.btceTrades(p, limit, True)) for p in pairs)
+        if parts == ['api', 'order_book']:
+            return ex.bitstampOrderBook()
+        if parts == ['api', 'ticker']:
+            return ex.bitstampTicker()
+        if len(parts) == 3 and parts[:2] == ['v1', 'book']:
+            return ex.bitfinexBook(parts[2], _int(query, 'limit_asks'),
+                                   _int(query, 'limit_bids'))
+        return None
+
+    def _handle(self, body=None):
+        with self.exchange.lock:
+            self.exchange.requests += 1
+        if self._fault():
+            return
+        result = self._route(body)
+        if result is None:
+            self._answer(404, {'error': 'not found'})
+        else:
+            self._answer(200, result)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._handle(self.rfile.read(length))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs a mock exchange (BTC-e, Bitstamp and Bitfinex)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--key", action="append", default=[],
+                        help="a /tapi key, as key:secret")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--errors", type=float, default=0.0,
+                        help="fraction of requests answered with an error")
+    parser.add_argument("--drops", type=float, default=0.0,
+                        help="fraction of connections dropped")
+    parser.add_argument("--snapshots",
+                        help="serve btc_usd from these backtest snapshots")
+    args = parser.parse_args()
+
+    books = {}
+    if args.snapshots:
+        from mexbtcapi.util.backtest import load_snapshots
+        books['btc_usd'] = RecordedBook(load_snapshots(args.snapshots))
+    keys = dict(k.split(':', 1) for k in args.key)
+    faults = Faults(args.latency, args.jitter, args.errors, args.drops)
+    exchange = MockExchange(args.host, args.port, books, keys, faults)
+    print "Serving on", exchange.domain
+    try:
+        exchange.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Incremental detection of triangular and cross-exchange arbitrage.
+
+An ArbitrageScanner keeps a graph whose nodes are currencies and whose
+edges are the executable top-of-book rates of its markets (selling the
+item at the bid, buying it at the ask), weighted by their logarithm. The
+cycles of the graph (up to max_length edges, never using a market twice)
+are enumerated once, when markets are added, and indexed by edge; a quote
+update only re-checks the cycles that go through the updated edges.
+
+A cycle is an opportunity when the sum of its log-rates is positive; its
+executable size is limited by the volume available at each leg.
+"""
+
+import math
+import threading
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount
+
+
+class Edge(object):
+    """Exchanging from_currency for to_currency at market.
+
+    rate: how much to_currency one from_currency gets
+    size: how much from_currency can be exchanged at that rate (None if
+    unknown)
+    """
+    __slots__ = ('market', 'from_currency', 'to_currency', 'rate', 'log',
+                 'size')
+
+    def __init__(self, market, from_currency, to_currency):
+        self.market = market
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+        self.rate = None
+        self.log = None
+        self.size = None
+
+    def __repr__(self):
+        return "<Edge({0}: {1} -> {2} @ {3})>".format(self.market,
+            self.from_currency, self.to_currency, self.rate)
+
+
+class Cycle(object):
+    """A sequence of edges that ends in the currency it starts with"""
+    __slots__ = ('edges',)
+
+    def __init__(self, edges):
+        self.edges = tuple(edges)
+
+    def log_rate(self):
+        """returns None if some edge has no rate yet"""
+        total = 0.0
+        for e in self.edges:
+            if e.log is None:
+                return None
+            total += e.log
+        return total
+
+    def rate(self):
+        r = Decimal(1)
+        for e in self.edges:
+            r *= e.rate
+        return r
+
+    def size(self):
+        """the largest Amount of the starting currency that can go through
+        every leg at its quoted rate, or None if unknown"""
+        limit, carried = None, Decimal(1)
+        for e in self.edges:
+            if e.size is not None:
+                leg = e.size / carried
+                limit = leg if limit is None else min(limit, leg)
+            carried *= e.rate
+        if limit is None:
+            return None
+        return Amount(limit, self.edges[0].from_currency)
+
+    def __repr__(self):
+        return "<Cycle({0})>".format(", ".join("{0}:{1}->{2}".format(
+            e.market, e.from_currency, e.to_currency) for e in self.edges))
+
+
+class Opportunity(object):
+    __slots__ = ('cycle', 'rate', 'size', 'profit')
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        self.rate = cycle.rate()
+        self.size = cycle.size()
+        self.profit = None if self.size is None else \
+            Amount(self.size.value * (self.rate - 1), self.size.currency)
+
+    def __repr__(self):
+        return "<Opportunity({0}, x{1:.5f}, size {2}, profit {3})>".format(
+            self.cycle, self.rate, self.size, self.profit)
+
+
+class ArbitrageScanner(object):
+    """
+    max_length: longest cycle considered (3 covers triangles; 2 covers
+    the same pair on two exchanges)
+    min_profit: smallest relative gain (0.001 is 0.1%) worth reporting
+    """
+
+    def __init__(self, max_length=3, min_profit=Decimal('0.001')):
+        self.max_length = max_length
+        self.min_log = math.log(1 + float(min_profit))
+        self.lock = threading.Lock()
+        self.edges = {}         # (market, from, to) -> Edge
+        self.out = {}           # currency -> list of Edge
+        self.cycles = {}        # Edge -> list of Cycle through it
+        self.opportunities = {} # Cycle -> Opportunity, currently open
+
+    def addMarket(self, market):
+        """adds both directions of market, enumerating the new cycles"""
+        with self.lock:
+            c1, c2 = market.currency1, market.currency2
+            for a, b in ((c2, c1), (c1, c2)):
+                if (market, a, b) in self.edges:
+                    continue
+                edge = self.edges[(market, a, b)] = Edge(market, a, b)
+                self.out.setdefault(a, []).append(edge)
+                self.cycles[edge] = []
+                for path in self._paths(b, a, set([a, b]), set([market]),
+                                        self.max_length - 1):
+                    cycle = Cycle((edge,) + path)
+                    for e in cycle.edges:
+                        self.cycles[e].append(cycle)
+
+    def _paths(self, start, end, visited, markets, length):
+        """yields the tuples of edges from start to end"""
+        if length <= 0:
+            return
+        for e in self.out.get(start, ()):
+            if e.market in markets:
+                continue
+            if e.to_currency is end:
+                yield (e,)
+            elif e.to_currency not in visited and length > 1:
+                visited.add(e.to_currency)
+                markets.add(e.market)
+                for p in self._paths(e.to_currency, end, visited, markets,
+                                     length - 1):
+                    yield (e,) + p
+                visited.discard(e.to_currency)
+                markets.discard(e.market)
+
+    def _set(self, edge, rate, size):
+        edge.rate = rate
+        edge.log = math.log(rate) if rate > 0 else None
+        edge.size = size
+
+    def setQuote(self, market, bid, ask, bid_size=None, ask_size=None):
+        """bid, ask: ExchangeRate of market's item (currency2) in its buy
+        currency (currency1). bid_size, ask_size: Amount of the item
+        available at those rates. Returns the opportunities among the
+        cycles this update affects"""
+        c1, c2 = market.currency1, market.currency2
+        one = Amount(1, c2)
+        touched = []
+        with self.lock:
+            if (market, c2, c1) not in self.edges:
+                raise KeyError("Unknown market {0}, use addMarket".format(
+                    market))
+            if bid is not None:
+                edge = self.edges[(market, c2, c1)]
+                size = None if bid_size is None else \
+                    bid.convert(bid_size, c2).value
+                self._set(edge, bid.convert(one).value, size)
+                touched.append(edge)
+            if ask is not None:
+                edge = self.edges[(market, c1, c2)]
+                price = ask.convert(one).value
+                size = None if ask_size is None else \
+                    ask.convert(ask_size, c1).value
+                self._set(edge, 1 / price, size)
+                touched.append(edge)
+            return self._check(touched)
+
+    def ingestDepth(self, market, depth):
+        """uses the top of book of depth, as returned by market.getDepth"""
+        one = Amount(1, market.currency2)
+        price = lambda o: o.exchange_rate.convert(one).value
+        bids, asks = depth['bids'], depth['asks']
+        bid = max(bids, key=price) if bids else None
+        ask = min(asks, key=price) if asks else None
+        return self.setQuote(market,
+            bid and bid.exchange_rate, ask and ask.exchange_rate,
+            bid and bid.from_amount, ask and ask.from_amount)
+
+    def ingestQuote(self, market, quote):
+        """quote: as returned by market.getQuote"""
+        return self.setQuote(market, quote.bid, quote.ask, quote.bid_size,
+                             quote.ask_size)
+
+    def _check(self, edges):
+        seen = set()
+        found = []
+        for edge in edges:
+            for cycle in self.cycles[edge]:
+                if cycle in seen:
+                    continue
+                seen.add(cycle)
+                log = cycle.log_rate()
+                if log is not None and log > self.min_log:
+                    o = self.opportunities[cycle] = Opportunity(cycle)
+                    found.append(o)
+                else:
+                    self.opportunities.pop(cycle, None)
+        return found
+
+    def scan(self):
+        """re-checks every cycle, returning all the open opportunities"""
+        with self.lock:
+            self._check(self.edges.values())
+            return self.opportunities.values()
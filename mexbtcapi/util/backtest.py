@@ -0,0 +1,393 @@
+"""Backtesting of trading strategies over recorded depth snapshots.
+
+A Backtest feeds a sequence of Snapshots (depth + trades at a point in
+time) to a strategy callback. Orders the strategy places are filled with
+Market.simulateOrder against the first snapshot taken after the
+configured latency has elapsed.
+
+sweep() runs a strategy for every combination of parameters and date
+range on a process pool and merges the results.
+
+Snapshots are plain data (prices and volumes as strings) so that they
+can be stored, loaded and sent between processes cheaply:
+    save_snapshots(filename, snapshots) / load_snapshots(filename)
+    snapshots_from_recording(market, filename)  # from a util.record log
+"""
+
+import bisect
+import itertools
+import json
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate
+from mexbtcapi.concepts.depth import Depth, LazyOrders
+from mexbtcapi.concepts.market import Market, Order
+from mexbtcapi.util.record import Player, RecordingExhausted
+
+
+class Snapshot(object):
+    """The state of a market at a given time.
+
+    asks, bids: lists of (price, volume) pairs, volume being in the item
+    currency (currency2) of the market
+    trades: list of (datetime, price, volume) trades since last snapshot
+    """
+    __slots__ = ('timestamp', 'asks', 'bids', 'trades')
+
+    def __init__(self, timestamp, asks, bids, trades=()):
+        assert isinstance(timestamp, datetime)
+        self.timestamp = timestamp
+        self.asks = asks
+        self.bids = bids
+        self.trades = trades
+
+    def to_json(self):
+        epoch = lambda d: time.mktime(d.timetuple()) + d.microsecond / 1e6
+        return json.dumps({'t': epoch(self.timestamp),
+            'asks': [(str(p), str(v)) for p, v in self.asks],
+            'bids': [(str(p), str(v)) for p, v in self.bids],
+            'trades': [(epoch(t), str(p), str(v)) for t, p, v in self.trades]})
+
+    @staticmethod
+    def from_json(s):
+        d = json.loads(s)
+        trades = [(datetime.fromtimestamp(t), p, v) for t, p, v in d['trades']]
+        return Snapshot(datetime.fromtimestamp(d['t']), d['asks'], d['bids'],
+                        trades)
+
+    def __repr__(self):
+        return "<Snapshot({0}, {1} asks, {2} bids, {3} trades)>".format(
+            self.timestamp, len(self.asks), len(self.bids), len(self.trades))
+
+
+def save_snapshots(filename, snapshots):
+    with open(filename, "w") as f:
+        for s in snapshots:
+            f.write(s.to_json() + "\n")
+
+
+def load_snapshots(filename):
+    with open(filename, "r") as f:
+        return [Snapshot.from_json(l) for l in f if l.strip()]
+
+
+def snapshots_from_recording(market, filename):
+    """replays every depth response of market in a util.record log,
+    returning the corresponding Snapshots. If trades of market were
+    recorded too, each snapshot gets the trades made since the previous
+    one (trades after the last snapshot are dropped); otherwise the
+    snapshots have no trades. market contacts the exchange again after"""
+    player = Player(filename)
+    market.hookTransport(player)
+    unit = Amount(1, market.currency2)
+    price = lambda o: o.exchange_rate.convert(unit).value
+    volume = lambda o: o.exchange_rate.convert(o.from_amount,
+                                               market.currency2).value
+    levels = lambda orders: [(price(o), volume(o)) for o in orders]
+    snapshots = []
+    trades = set()
+    last = None
+    try:
+        while True:
+            try:
+                depth = market.getDepth()
+            except RecordingExhausted:
+                break
+            if snapshots and player.last_timestamp == last:
+                continue    # the adapter answered from a cache
+            last = player.last_timestamp
+            snapshots.append(Snapshot(
+                datetime.fromtimestamp(player.last_timestamp),
+                levels(depth['asks']), levels(depth['bids']), []))
+        while True:
+            try:
+                recorded = market.getTrades()
+            except (RecordingExhausted, NotImplementedError):
+                break
+            # successive responses overlap
+            trades.update((t.timestamp, price(t), volume(t))
+                          for t in recorded)
+    finally:
+        market.unhookTransport()
+        player.close()
+
+    times = [s.timestamp for s in snapshots]
+    for trade in sorted(trades):
+        i = bisect.bisect_left(times, trade[0])
+        if i < len(snapshots):
+            snapshots[i].trades.append(trade)
+    return snapshots
+
+
+class BacktestMarket(Market):
+    """A Market whose depth is the current Snapshot of a Backtest"""
+
+    # quotes follow the snapshots, not the wall clock
+    QUOTE_TIMEOUT = 0
+    DEPTH_LIMITS = True
+
+    def __init__(self, market_name, buy_currency, sell_currency):
+        super(BacktestMarket, self).__init__(market_name, buy_currency,
+                                             sell_currency)
+        self.snapshot = None
+
+    def _levelsToOrders(self, levels, order_type, lazy=False):
+        timestamp = self.snapshot.timestamp
+        c1, c2 = self.currency1, self.currency2
+        def make(level):
+            p, v = level
+            amount = Amount.fast(Decimal(v), c2)
+            price = ExchangeRate.fast(c2, c1, Decimal(p))
+            return Order.from_trusted(self, timestamp, order_type, amount,
+                                      price)
+        if lazy:
+            # snapshots keep the levels as the exchange sent them
+            if order_type == Order.BID:
+                key = lambda l: -Decimal(l[0])
+            else:
+                key = lambda l: Decimal(l[0])
+            return LazyOrders(levels, make, key, pairs=True)
+        return map(make, levels)
+
+    def getDepth(self, lazy=False, max_notional=None, max_levels=None):
+        if max_notional is not None or max_levels is not None:
+            return self._truncateDepth(self.getDepth(lazy=True), max_notional,
+                                       max_levels, lazy)
+        return Depth(self,
+            self._levelsToOrders(self.snapshot.asks, Order.ASK, lazy),
+            self._levelsToOrders(self.snapshot.bids, Order.BID, lazy))
+
+    def getTrades(self):
+        return self.snapshot.trades
+
+
+class Fill(object):
+    """The simulated execution of an order"""
+    __slots__ = ('timestamp', 'order', 'received', 'spent')
+
+    def __init__(self, timestamp, order, received, spent):
+        self.timestamp = timestamp
+        self.order = order
+        self.received = received
+        self.spent = spent
+
+    def __repr__(self):
+        return "<Fill({0}, {1} -> {2})>".format(self.timestamp, self.spent,
+                                                self.received)
+
+
+class BacktestContext(object):
+    """What a strategy callback gets to see and act upon"""
+
+    def __init__(self, backtest):
+        self._backtest = backtest
+        self.market = backtest.market
+        self.params = backtest.params
+        self.state = {}     # free for the strategy to use
+
+    @property
+    def time(self):
+        return self.market.snapshot.timestamp
+
+    @property
+    def snapshot(self):
+        return self.market.snapshot
+
+    @property
+    def balances(self):
+        return self._backtest.balances
+
+    @property
+    def fills(self):
+        return self._backtest.fills
+
+    def placeOrder(self, order):
+        """queues order for execution after the backtest latency"""
+        self._backtest.pending.append((self.time + self._backtest.latency,
+                                       order))
+
+
+class Backtest(object):
+    """Runs a strategy over a sequence of Snapshots.
+
+    strategy: called as strategy(context) for every snapshot
+    balances: dictionary of Currency to initial Amount
+    market: the BacktestMarket the snapshots are fed to
+    latency: time between placing an order and its execution
+    """
+
+    def __init__(self, snapshots, strategy, balances, market,
+                 latency=timedelta(0), params=None):
+        self.snapshots = snapshots
+        self.strategy = strategy
+        self.balances = dict((c, a.clone()) for c, a in balances.items())
+        self.initial_balances = balances
+        self.latency = latency
+        self.market = market
+        self.params = params or {}
+        self.pending = []
+        self.fills = []
+        self.rejected = []
+
+    def _execute(self, order):
+        spend_currency = order.from_amount.currency
+        available = self.balances.get(spend_currency)
+        if available is None or available.value < order.from_amount.value:
+            self.rejected.append(order)
+            return
+        order.market = self.market
+        received, spent = self.market.simulateOrder(order)
+        self.balances[spend_currency] -= spent
+        c = received.currency
+        self.balances[c] = self.balances.get(c, Amount(0, c)) + received
+        self.fills.append(Fill(self.market.snapshot.timestamp, order,
+                               received, spent))
+
+    def run(self):
+        context = BacktestContext(self)
+        for snapshot in self.snapshots:
+            self.market.snapshot = snapshot
+            due = [p for p in self.pending if p[0] <= snapshot.timestamp]
+            if due:
+                self.pending = [p for p in self.pending
+                                if p[0] > snapshot.timestamp]
+                for _, order in due:
+                    self._execute(order)
+            self.strategy(context)
+        return self.result()
+
+    def _mid(self):
+        s = self.market.snapshot
+        if s is None or not s.asks or not s.bids:
+            return None
+        best_ask = min(Decimal(p) for p, v in s.asks)
+        best_bid = max(Decimal(p) for p, v in s.bids)
+        return (best_ask + best_bid) / 2
+
+    def result(self):
+        """returns a BacktestResult of the backtest, valuing the final
+        balances at the mid price of the last snapshot"""
+        mid = self._mid()
+        value = None
+        if mid is not None:
+            c1, c2 = self.market.currency1, self.market.currency2
+            value = Decimal(0)
+            for c, a in self.balances.items():
+                initial = self.initial_balances.get(c)
+                delta = a.value - (initial.value if initial else 0)
+                if c == c1:
+                    value += delta
+                elif c == c2:
+                    value += delta * mid
+        start = self.snapshots[0].timestamp if self.snapshots else None
+        end = self.snapshots[-1].timestamp if self.snapshots else None
+        return BacktestResult(self.params, start, end,
+            dict((str(c), a.value) for c, a in self.balances.items()),
+            len(self.fills), len(self.rejected), value)
+
+
+class BacktestResult(object):
+    """The outcome of a Backtest, as plain (picklable) data.
+
+    pnl is expressed in the buy currency (currency1) of the market
+    """
+
+    def __init__(self, params, start, end, balances, fills, rejected, pnl):
+        self.params = params
+        self.start = start
+        self.end = end
+        self.balances = balances
+        self.fills = fills
+        self.rejected = rejected
+        self.pnl = pnl
+
+    def __repr__(self):
+        return "<BacktestResult({0}, {1} - {2}, {3} fills, pnl {4})>".format(
+            self.params, self.start, self.end, self.fills, self.pnl)
+
+
+def merge_results(results):
+    """merges the results of the same parameters over several date ranges
+    into one BacktestResult per parameter combination. Balances are not
+    merged, as they aren't continuous between ranges"""
+    merged = {}
+    for r in results:
+        k = tuple(sorted(r.params.items()))
+        m = merged.get(k)
+        if m is None:
+            merged[k] = BacktestResult(r.params, r.start, r.end, None,
+                                       r.fills, r.rejected, r.pnl)
+            continue
+        m.start = min(m.start, r.start) if m.start and r.start else \
+            m.start or r.start
+        m.end = max(m.end, r.end) if m.end and r.end else m.end or r.end
+        m.fills += r.fills
+        m.rejected += r.rejected
+        if m.pnl is None or r.pnl is None:
+            m.pnl = None
+        else:
+            m.pnl += r.pnl
+    return merged.values()
+
+
+def _slice(snapshots, start, end):
+    timestamps = [s.timestamp for s in snapshots]
+    i = 0 if start is None else bisect.bisect_left(timestamps, start)
+    j = len(snapshots) if end is None else bisect.bisect_left(timestamps, end)
+    return snapshots[i:j]
+
+
+_worker_snapshots = {}  # per-process cache of loaded snapshot files
+
+
+def _run_job(job):
+    (filename, strategy_factory, params, date_range, balances, latency,
+     market_args) = job
+    balances = dict((Currency(c), Amount(v, Currency(c)))
+                    for c, v in balances.items())
+    market_name, c1, c2 = market_args
+    snapshots = _worker_snapshots.get(filename)
+    if snapshots is None:
+        snapshots = _worker_snapshots[filename] = load_snapshots(filename)
+    market = BacktestMarket(market_name, Currency(c1), Currency(c2))
+    backtest = Backtest(_slice(snapshots, *date_range),
+                        strategy_factory(**params), balances, market,
+                        latency, params)
+    return backtest.run()
+
+
+def sweep(strategy_factory, param_grid, filename, balances, market_args,
+          date_ranges=((None, None),), latency=timedelta(0), processes=None,
+          merge=True):
+    """Backtests every parameter combination in param_grid (a dictionary of
+    parameter name to list of values) over every (start, end) date range,
+    sharding the work across a pool of processes.
+
+    strategy_factory: called as strategy_factory(**params), must return a
+    strategy callback. Must be picklable (a module level function)
+    filename: a snapshot file, as written by save_snapshots
+    market_args: (market_name, buy_currency, sell_currency)
+
+    Returns a list of BacktestResult, one per parameter combination if
+    merge, else one per combination and date range
+    """
+    balances = dict((str(c), str(a.value)) for c, a in balances.items())
+    market_args = (market_args[0], str(market_args[1]), str(market_args[2]))
+    names = sorted(param_grid)
+    combinations = [dict(zip(names, values)) for values in
+                    itertools.product(*[param_grid[n] for n in names])]
+    jobs = [(filename, strategy_factory, params, date_range, balances,
+             latency, market_args)
+            for params in combinations for date_range in date_ranges]
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, len(jobs) // (4 * (processes or
+                                              multiprocessing.cpu_count())))
+        results = pool.map(_run_job, jobs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return merge_results(results) if merge else results
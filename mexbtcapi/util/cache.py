@@ -1,5 +1,11 @@
 import datetime
 
+from mexbtcapi.util.metrics import REGISTRY
+
+HITS = REGISTRY.counter("mexbtcapi_cache_hits_total",
+                        "Cache calls answered from the cache", ("function",))
+MISSES = REGISTRY.counter("mexbtcapi_cache_misses_total",
+                          "Cache calls that called the function", ("function",))
 
 cache_storage = {}
 
@@ -33,10 +39,17 @@ class DictinaryCacheBackend(CacheBackend):
 
 
 class Cache:
-    def __init__(self, backend, timeout=1000):
+    def __init__(self, backend, timeout=1000, serialize=True):
+        """If serialize, values are stored in the backend as strings
+        (which suits external backends). Otherwise the objects themselves
+        are stored, and returned as they were cached.
+        serialize may also be an object with dumps and loads methods
+        (e.g. a mexbtcapi.util.codec.Codec), to store the values
+        encoded by it instead of str() of them"""
         assert isinstance(backend, CacheBackend)
         self.backend = backend
         self.timeout = timeout
+        self.serialize = serialize
 
     def call(self, f, args, key_override=None, timeout=None):
         """Caches a function call with given argument.
@@ -55,11 +68,19 @@ class Cache:
             return (key_override or f.__name__) + str(args)
 
         def value_to_str(datetime, v):
+            if not self.serialize:
+                return datetime, v
+            if hasattr(self.serialize, 'dumps'):
+                v = self.serialize.dumps(v)
             return datetime_to_str(datetime) + "|" + str(v)
 
         def str_to_value(s):
+            if not self.serialize:
+                return s
             i = s.index("|")
             d = str_to_datetime(s[:i])
+            if hasattr(self.serialize, 'loads'):
+                return d, self.serialize.loads(s[i + 1:])
             return d, s[i + 1:]
 
         timeout = timeout or self.timeout
@@ -73,18 +94,21 @@ class Cache:
             last_execution, value = str_to_value(cached_value)
             delta = now - last_execution
 
+        label = (key_override or f.__name__,)
         if not cached_value or delta > ms:
+            MISSES.inc(label)
             result = f(*args)
             self.backend.put(k, value_to_str(now, result))
         else:
+            HITS.inc(label)
             result = value
 
         return result
 
 
-def create_cache(timeout=1000):
+def create_cache(timeout=1000, serialize=True):
     """creates a cache with a DictionaryCacheBackend"""
-    return Cache(DictinaryCacheBackend(), timeout=timeout)
+    return Cache(DictinaryCacheBackend(), timeout=timeout, serialize=serialize)
 
 
 #demonstration
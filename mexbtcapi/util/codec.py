@@ -0,0 +1,394 @@
+"""Compact binary encoding of the concept objects.
+
+dumps() encodes an Order, Trade, Ticker, Quote, a depth (as returned by
+Market.getDepth) or a list of these; loads() decodes them. It's meant
+for sending them between processes, recording them to disk and keeping
+them in cache backends (a Codec can serialize a util.cache.Cache),
+where str() is lossy and pickle drags along the whole Market.
+
+Every encoding starts with a header (MAGIC, VERSION and the kind of
+object). Numbers are stored exactly: a Decimal is its exponent and its
+coefficient as an integer, or its text if the coefficient doesn't fit in
+64 bits. A currency is a byte (see CURRENCY_IDS) unless it's not in the
+table; then its name follows. Datetimes are microseconds from the epoch
+(they're naive: no timezone is added or assumed).
+
+A market is stored as its name and currencies. When decoding, it's
+either given, or looked up with a resolve function (by default
+mexbtcapi.api.get_market). Participants (Order.entity) aren't stored.
+"""
+
+import struct
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate
+from mexbtcapi.concepts.depth import Depth
+from mexbtcapi.concepts.market import Order, Quote, Ticker, Trade
+
+
+MAGIC = "MX"
+VERSION = 1
+
+# kinds of encoded objects
+ORDER, TRADE, TICKER, QUOTE, DEPTH, LIST = range(1, 7)
+
+# never reorder: ids are stored. New currencies go at the end
+CURRENCY_IDS = (None, 'BTC', 'USD', 'EUR', 'LTC', 'RUR', 'RUB', 'GBP',
+                'JPY', 'CNY', 'CAD', 'AUD', 'CHF', 'PLN', 'NMC', 'NVC',
+                'TRC', 'PPC', 'FTC', 'XRP')
+_currency_ids = dict((name, i) for i, name in enumerate(CURRENCY_IDS) if name)
+
+ORDER_TYPES = (Order.BID, Order.ASK, Order.MARKET_BUY, Order.MARKET_SELL)
+_order_type_ids = dict((t, i) for i, t in enumerate(ORDER_TYPES))
+
+_header = struct.Struct("<2sBB")
+_byte = struct.Struct("<B")
+_short = struct.Struct("<H")
+_int = struct.Struct("<I")
+_long = struct.Struct("<q")
+_decimal = struct.Struct("<bq")
+_TEXT = -128                # exponent of a Decimal stored as text
+_NONE = -(2 ** 63)          # a datetime that is None
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class CodecError(ValueError):
+    """raised on data that can't be encoded or decoded"""
+
+
+# ---- encoding -----------------------------------------------------------
+
+def _string(out, s, length=_byte):
+    s = s.encode('utf-8') if isinstance(s, unicode) else s
+    out.append(length.pack(len(s)))
+    out.append(s)
+
+
+def _currency(out, currency):
+    i = _currency_ids.get(currency.name)
+    if i is None:
+        out.append(_byte.pack(0))
+        _string(out, currency.name)
+    else:
+        out.append(_byte.pack(i))
+
+
+def _decimal_(out, d):
+    sign, digits, exp = d.as_tuple()
+    if isinstance(exp, int) and -128 < exp < 128 and len(digits) < 19 \
+            and not (sign and not any(digits)):     # -0 keeps its sign as text
+        coefficient = 0
+        for digit in digits:
+            coefficient = coefficient * 10 + digit
+        out.append(_decimal.pack(exp, -coefficient if sign else coefficient))
+    else:
+        out.append(_decimal.pack(_TEXT, 0))
+        _string(out, str(d))
+
+
+def _datetime(out, t):
+    if t is None:
+        out.append(_long.pack(_NONE))
+    else:
+        delta = t - _EPOCH
+        out.append(_long.pack((delta.days * 86400 + delta.seconds) * 1000000
+                              + delta.microseconds))
+
+
+def _rate(out, rate):
+    if rate is None:
+        out.append(_byte.pack(0))
+        return
+    out.append(_byte.pack(1))
+    _currency(out, rate._c[0])
+    _currency(out, rate._c[1])
+    _decimal_(out, rate._er)
+
+
+def _amount(out, amount):
+    if amount is None:
+        out.append(_byte.pack(0))
+        return
+    out.append(_byte.pack(1))
+    _currency(out, amount.currency)
+    _decimal_(out, amount.value)
+
+
+def _market(out, market):
+    _string(out, market.name)
+    _currency(out, market.currency1)
+    _currency(out, market.currency2)
+
+
+def _order(out, o):
+    _market(out, o.market)
+    _datetime(out, o.timestamp)
+    out.append(_byte.pack(_order_type_ids[o.order_type]))
+    _amount(out, o.from_amount)
+    _rate(out, o.exchange_rate)
+    _string(out, o.properties, _short)
+
+
+def _trade(out, t):
+    _market(out, t.market)
+    _datetime(out, t.timestamp)
+    _amount(out, t.from_amount)
+    _rate(out, t.exchange_rate)
+
+
+def _ticker(out, t):
+    _market(out, t.market)
+    _datetime(out, t.time)
+    for field in Ticker.RATE_FIELDS:
+        _rate(out, getattr(t, field))
+    if t.volume is None:
+        out.append(_byte.pack(0))
+    else:
+        out.append(_byte.pack(1))
+        _decimal_(out, Decimal(t.volume))
+
+
+def _quote(out, q):
+    _market(out, q.market)
+    _datetime(out, q.timestamp)
+    _rate(out, q.bid)
+    _rate(out, q.ask)
+    _amount(out, q.bid_size)
+    _amount(out, q.ask_size)
+
+
+def _depth(out, depth, market):
+    # the orders of a side share their market and order type; their
+    # timestamps too, unless they differ
+    _market(out, market)
+    for side in ('asks', 'bids'):
+        orders = list(depth[side])
+        timestamps = set(o.timestamp for o in orders)
+        shared = len(timestamps) <= 1
+        out.append(_int.pack(len(orders)))
+        out.append(_byte.pack(1 if shared else 0))
+        if shared:
+            _datetime(out, timestamps.pop() if timestamps else None)
+        for o in orders:
+            if not shared:
+                _datetime(out, o.timestamp)
+            _amount(out, o.from_amount)
+            _rate(out, o.exchange_rate)
+
+
+_encoders = ((Order, ORDER, _order), (Trade, TRADE, _trade),
+             (Ticker, TICKER, _ticker), (Quote, QUOTE, _quote))
+
+
+def _encode(out, obj, market=None):
+    for cls, kind, encode in _encoders:
+        if isinstance(obj, cls):
+            out.append(_byte.pack(kind))
+            encode(out, obj)
+            return
+    if isinstance(obj, dict):
+        market = market or getattr(obj, 'market', None)
+        if market is None:
+            for o in list(obj['asks'][:1]) + list(obj['bids'][:1]):
+                market = o.market
+        if market is None:
+            raise CodecError("can't encode an empty depth without its "
+                             "market")
+        out.append(_byte.pack(DEPTH))
+        _depth(out, obj, market)
+    elif isinstance(obj, (list, tuple)):
+        out.append(_byte.pack(LIST))
+        out.append(_int.pack(len(obj)))
+        for item in obj:
+            _encode(out, item, market)
+    else:
+        raise CodecError("can't encode {0!r}".format(obj))
+
+
+def dumps(obj, market=None):
+    """encodes obj. market is only needed to encode a depth without
+    orders"""
+    out = [MAGIC, _byte.pack(VERSION)]
+    _encode(out, obj, market)
+    return "".join(out)
+
+
+# ---- decoding -----------------------------------------------------------
+
+class _Reader(object):
+    __slots__ = ('data', 'pos', 'markets')
+
+    def __init__(self, data, markets):
+        self.data = data
+        self.pos = 0
+        self.markets = markets
+
+    def unpack(self, s):
+        values = s.unpack_from(self.data, self.pos)
+        self.pos += s.size
+        return values
+
+    def byte(self):
+        return self.unpack(_byte)[0]
+
+    def string(self, length=_byte):
+        n = self.unpack(length)[0]
+        s = self.data[self.pos:self.pos + n]
+        if len(s) != n:
+            raise CodecError("truncated data")
+        self.pos += n
+        return s
+
+    def currency(self):
+        i = self.byte()
+        if i == 0:
+            return Currency(self.string().decode('utf-8'))
+        try:
+            return Currency(CURRENCY_IDS[i])
+        except IndexError:
+            raise CodecError("unknown currency id {0}".format(i))
+
+    def decimal(self):
+        exp, coefficient = self.unpack(_decimal)
+        if exp == _TEXT:
+            return Decimal(self.string())
+        return Decimal("%de%d" % (coefficient, exp))    # exact, keeps exp
+
+    def datetime(self):
+        us = self.unpack(_long)[0]
+        if us == _NONE:
+            return None
+        return _EPOCH + timedelta(microseconds=us)
+
+    def rate(self):
+        if not self.byte():
+            return None
+        c1, c2 = self.currency(), self.currency()
+        return ExchangeRate.fast(c1, c2, self.decimal())
+
+    def amount(self):
+        if not self.byte():
+            return None
+        currency = self.currency()
+        return Amount.fast(self.decimal(), currency)
+
+    def market(self):
+        name = self.string().decode('utf-8')
+        c1, c2 = self.currency(), self.currency()
+        return self.markets(name, c1, c2)
+
+
+def _read_order(r):
+    market = r.market()
+    timestamp = r.datetime()
+    order_type = ORDER_TYPES[r.byte()]
+    from_amount = r.amount()
+    rate = r.rate()
+    return Order.from_trusted(market, timestamp, order_type, from_amount,
+                              rate, r.string(_short))
+
+
+def _read_trade(r):
+    market = r.market()
+    timestamp = r.datetime()
+    from_amount = r.amount()
+    return Trade.from_trusted(market, timestamp, from_amount, r.rate())
+
+
+def _read_ticker(r):
+    market = r.market()
+    time = r.datetime()
+    rates = dict((field, r.rate()) for field in Ticker.RATE_FIELDS)
+    volume = r.decimal() if r.byte() else None
+    return Ticker.from_trusted(market, time, volume=volume, **rates)
+
+
+def _read_quote(r):
+    market = r.market()
+    timestamp = r.datetime()
+    bid, ask = r.rate(), r.rate()
+    bid_size, ask_size = r.amount(), r.amount()
+    return Quote(market, timestamp, bid, ask, bid_size, ask_size)
+
+
+def _read_depth(r):
+    market = r.market()
+    depth = Depth(market, None, None)
+    for side, order_type in (('asks', Order.ASK), ('bids', Order.BID)):
+        n = r.unpack(_int)[0]
+        shared = r.byte()
+        if shared:
+            timestamp = r.datetime()
+        orders = depth[side] = []
+        for _ in xrange(n):
+            if not shared:
+                timestamp = r.datetime()
+            from_amount = r.amount()
+            orders.append(Order.from_trusted(market, timestamp, order_type,
+                                             from_amount, r.rate()))
+    return depth
+
+
+def _read_list(r):
+    return [_read(r) for _ in xrange(r.unpack(_int)[0])]
+
+
+_readers = {ORDER: _read_order, TRADE: _read_trade, TICKER: _read_ticker,
+            QUOTE: _read_quote, DEPTH: _read_depth, LIST: _read_list}
+
+
+def _read(r):
+    kind = r.byte()
+    if kind not in _readers:
+        raise CodecError("unknown kind {0}".format(kind))
+    return _readers[kind](r)
+
+
+def _get_market(name, currency1, currency2):
+    from mexbtcapi.api import get_market
+    try:
+        return get_market(name, currency2, currency1)
+    except KeyError:
+        raise CodecError("no market {0} to decode with; pass one to "
+                         "loads".format(name))
+
+
+def loads(data, market=None, resolve=None):
+    """decodes what dumps encoded. Decoded objects belong to market if
+    given; otherwise to resolve(name, currency1, currency2), by default
+    the shared Market of that exchange (mexbtcapi.get_market)"""
+    if market is not None:
+        markets = lambda name, c1, c2: market
+    else:
+        markets = resolve or _get_market
+    try:
+        magic, version = _header.unpack_from(data)[:2]
+    except struct.error:
+        raise CodecError("truncated data")
+    if magic != MAGIC:
+        raise CodecError("not encoded by mexbtcapi.util.codec")
+    if version > VERSION:
+        raise CodecError("encoded by a newer version ({0})".format(version))
+    r = _Reader(data, markets)
+    r.pos = _header.size - 1    # the kind is read with the object
+    try:
+        return _read(r)
+    except struct.error:
+        raise CodecError("truncated data")
+
+
+class Codec(object):
+    """dumps and loads with a fixed market (or resolve function), e.g. to
+    serialize the values of a util.cache.Cache"""
+
+    def __init__(self, market=None, resolve=None):
+        self.market = market
+        self.resolve = resolve
+
+    def dumps(self, obj):
+        return dumps(obj, self.market)
+
+    def loads(self, data):
+        return loads(data, self.market, self.resolve)
@@ -15,13 +15,9 @@ class Compare(object):
         return self.reverse*self._cmp(x, y)
         
     def _cmp(self, x, y):
-        a = x.exchange_rate.convert(Amount(1, self.currency)).value > y.exchange_rate.convert(Amount(1, self.currency)).value
-        if a > 0:
-            return 1
-        elif a == 0:
-            return 0
-        else:
-            return -1
+        one = Amount(1, self.currency)
+        return cmp(x.exchange_rate.convert(one).value,
+                   y.exchange_rate.convert(one).value)
 
 def comp(c):
     return Compare(False, c)
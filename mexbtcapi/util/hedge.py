@@ -0,0 +1,222 @@
+"""Tail latency control for the public requests made to exchanges.
+
+Hedging: an idempotent request (depth, ticker, trades...) that hasn't
+answered by a percentile of its observed latencies is sent again, and
+whichever copy answers first is used. Stragglers then only cost one extra
+request, instead of their whole latency.
+
+Circuit breaking: after a number of consecutive failures of an exchange
+its circuit opens, and requests to it fail fast with CircuitOpen instead
+of waiting on a degraded venue. After reset_timeout seconds a single
+request is let through; if it succeeds, the circuit closes again. Only
+network errors and HTTP 5xx answers count as failures (see
+exchange_failure). get_breaker(exchange).enabled = False turns an
+exchange's circuit breaking off.
+"""
+
+import httplib
+import Queue
+import sys
+import threading
+import time
+import urllib2
+
+from mexbtcapi.util.metrics import REGISTRY
+from mexbtcapi.util.scheduler import Throttled
+
+
+class CircuitOpen(Exception):
+    """raised instead of making a request to a degraded exchange"""
+
+
+class HedgingPolicy(object):
+    """
+    percentile: the observed latency percentile after which a request is
+    sent again
+    min_delay: never send a copy sooner than this (seconds)
+    max_hedges: most copies sent of a single request
+    min_samples: latencies to observe before hedging at all
+    """
+
+    def __init__(self, percentile=95, min_delay=0.05, max_hedges=1,
+                 min_samples=20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.min_samples = min_samples
+
+    def delay(self, exchange, kind):
+        """seconds to wait before sending a copy of a request of kind to
+        exchange, or None to not hedge. The percentile is read from the
+        LATENCY histogram, so it's only as accurate as its buckets"""
+        labels = (exchange, kind)
+        if LATENCY.count(labels) < self.min_samples:
+            return None
+        return max(LATENCY.percentile(self.percentile, labels),
+                   self.min_delay)
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failures=5, reset_timeout=30):
+        self.name = name
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.enabled = True     # False lets every request through
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+
+    def allow(self):
+        """raises CircuitOpen if a request shouldn't be made now"""
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and \
+                    time.time() - self.opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN    # let this one request try
+                return
+            raise CircuitOpen("{0} is failing, not sending requests for "
+                              "{1}s".format(self.name, self.reset_timeout))
+
+    def success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def cancel(self):
+        """gives the request let through by allow() back, when it was
+        never really made: a half-open circuit lets the next one try"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def failure(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or \
+                    self.failures >= self.max_failures:
+                self.state = self.OPEN
+                self.opened = time.time()
+
+    def __repr__(self):
+        return "<CircuitBreaker({0}, {1})>".format(self.name, self.state)
+
+
+def exchange_failure(e):
+    """whether the exception e, raised by a request, is the exchange's (or
+    the network's) fault: a connection or protocol error, or an HTTP 5xx
+    answer. Errors parsing a response, the end of a replayed recording and
+    the like are not"""
+    if isinstance(e, urllib2.HTTPError):
+        return e.code >= 500
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    if status is not None:      # an HTTP error of the requests library
+        return status >= 500
+    return isinstance(e, (IOError, httplib.HTTPException))
+
+
+def hedged_call(f, args=(), kwargs=None, delay=None, max_hedges=1):
+    """calls f, and again (up to max_hedges more times) every delay
+    seconds it hasn't answered. Returns (the first result, the time since
+    the first call); raises only if every call fails"""
+    kwargs = kwargs or {}
+    results = Queue.Queue()
+    start = time.time()
+
+    def attempt():
+        try:
+            results.put((True, f(*args, **kwargs)))
+        except Exception:
+            results.put((False, sys.exc_info()))
+
+    def launch():
+        t = threading.Thread(target=attempt)
+        t.daemon = True
+        t.start()
+
+    launch()
+    launched, failed = 1, 0
+    while True:
+        hedge = delay is not None and launched <= max_hedges
+        try:
+            ok, value = results.get(timeout=delay if hedge else None)
+        except Queue.Empty:
+            launch()
+            launched += 1
+            continue
+        if ok:
+            return value, time.time() - start
+        failed += 1
+        if failed == launched:
+            raise value[0], value[1], value[2]
+
+
+REQUESTS = REGISTRY.counter("mexbtcapi_requests_total",
+    "Public requests made to exchanges", ("exchange", "kind"))
+ERRORS = REGISTRY.counter("mexbtcapi_request_errors_total",
+    "Public requests to exchanges that failed", ("exchange", "kind"))
+REJECTED = REGISTRY.counter("mexbtcapi_requests_rejected_total",
+    "Public requests not made because the exchange's circuit was open",
+    ("exchange", "kind"))
+LATENCY = REGISTRY.histogram("mexbtcapi_request_seconds",
+    "Latency of the public requests to exchanges", ("exchange", "kind"))
+
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+def get_breaker(exchange):
+    """the CircuitBreaker shared by every request to exchange"""
+    with _lock:
+        if exchange not in _breakers:
+            _breakers[exchange] = CircuitBreaker(exchange)
+        return _breakers[exchange]
+
+
+def call_public(exchange, kind, f, args=(), kwargs=None, policy=None):
+    """makes an idempotent public request f(*args, **kwargs) to exchange,
+    through its circuit breaker and, if a HedgingPolicy is given, hedged"""
+    breaker = get_breaker(exchange)
+    labels = (exchange, kind)
+    try:
+        breaker.allow()
+    except CircuitOpen:
+        REJECTED.inc(labels)
+        raise
+    REQUESTS.inc(labels)
+    delay = None if policy is None else policy.delay(exchange, kind)
+    try:
+        if delay is None:
+            start = time.time()
+            result = f(*args, **(kwargs or {}))
+            latency = time.time() - start
+        else:
+            result, latency = hedged_call(f, args, kwargs, delay,
+                                          policy.max_hedges)
+    except Throttled:
+        # our own rate limiting, not the exchange's fault: the request
+        # wasn't made, so it can't have been a half-open circuit's probe
+        breaker.cancel()
+        raise
+    except Exception, e:
+        ERRORS.inc(labels)
+        if exchange_failure(e):
+            breaker.failure()
+        else:
+            # not the exchange's fault: neither a failure nor, if it was
+            # a half-open circuit's probe, a success
+            breaker.cancel()
+        raise
+    breaker.success()
+    LATENCY.observe(latency, labels)
+    return result
@@ -0,0 +1,225 @@
+"""Memory profiling of long running processes (recorders, monitors...).
+
+snapshot() counts the live instances of the concept types (Order, Trade,
+Amount, ExchangeRate, Ticker, Currency...) and estimates the bytes they
+retain, and the entries held in Monitor buffers. If tracemalloc is
+available and tracing (see start_tracing), the snapshot also has the
+memory allocated by each module. Two snapshots are compared with diff():
+
+    before = memprofile.snapshot()
+    ...
+    print memprofile.report(memprofile.snapshot(), before)
+
+install_signal_handler() does the same on SIGUSR1, printing each report
+against the previous one, so a running process can be inspected with
+`kill -USR1 <pid>`.
+
+The retained bytes of an object are its own size, its __dict__'s and its
+scalar attributes' (numbers, strings, dates); other concept objects it
+refers to are counted under their own type. They're an estimate: scalars
+shared by many objects are counted once per object.
+"""
+
+import gc
+import os
+import signal
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _require_tracemalloc():
+    if tracemalloc is None:
+        raise ImportError("memory tracing needs tracemalloc (python 3.4+, or "
+                          "pytracemalloc on a patched python 2.7)")
+
+
+_SCALARS = (int, long, float, Decimal, str, unicode, date, datetime,
+            timedelta, type(None), bool)
+
+
+def _types():
+    # imported here, as the concepts import the utilities
+    from mexbtcapi.concepts.currency import Amount, Currency, ExchangeRate
+    from mexbtcapi.concepts.market import Order, Quote, Ticker, Trade
+    return (Order, Trade, Quote, Ticker, Amount, ExchangeRate, Currency)
+
+
+def _retained(obj):
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+        values = attrs.values()
+    else:
+        values = [getattr(obj, s, None)
+                  for s in getattr(type(obj), '__slots__', ())]
+    for v in values:
+        if isinstance(v, _SCALARS):
+            size += sys.getsizeof(v)
+    return size
+
+
+def _monitor_buffer(monitor):
+    size = sys.getsizeof(monitor.data)
+    for entry in monitor.data:
+        size += sys.getsizeof(entry)
+        if monitor.keep_datetime:
+            size += sys.getsizeof(entry[0])
+    return len(monitor.data), size
+
+
+def count_objects(types=None):
+    """returns a dictionary of type name -> (live instances, retained
+    bytes) of types (default: the concept types), plus "Monitor buffers"
+    (entries, bytes of the buffers of every Monitor)"""
+    from mexbtcapi.util.monitor import Monitor
+    types = tuple(types or _types())
+    counts = dict((t.__name__, [0, 0]) for t in types)
+    counts["Monitor buffers"] = [0, 0]
+    for obj in gc.get_objects():
+        if isinstance(obj, types):
+            # counted as its exact type if asked for, else as a base
+            name = type(obj).__name__
+            if name not in counts:
+                name = [t for t in types if isinstance(obj, t)][0].__name__
+            c = counts[name]
+            c[0] += 1
+            c[1] += _retained(obj)
+        elif isinstance(obj, Monitor):
+            n, size = _monitor_buffer(obj)
+            c = counts["Monitor buffers"]
+            c[0] += n
+            c[1] += size
+    return dict((k, tuple(v)) for k, v in counts.items())
+
+
+def start_tracing(frames=1):
+    """starts tracemalloc, so snapshots include memory per module"""
+    _require_tracemalloc()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    _require_tracemalloc()
+    tracemalloc.stop()
+
+
+def _module_names():
+    names = {}
+    for name, module in sys.modules.items():
+        filename = getattr(module, '__file__', None)
+        if filename:
+            names[os.path.splitext(os.path.abspath(filename))[0]] = name
+    return names
+
+
+def allocations_by_module():
+    """returns a dictionary of module name (or file name, for files that
+    aren't modules) -> (allocations, bytes) of the memory traced by
+    tracemalloc, None if it isn't tracing"""
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    names = _module_names()
+    result = {}
+    stats = tracemalloc.take_snapshot().statistics('filename')
+    for stat in stats:
+        filename = stat.traceback[0].filename
+        name = names.get(os.path.splitext(os.path.abspath(filename))[0],
+                         filename)
+        count, size = result.get(name, (0, 0))
+        result[name] = (count + stat.count, size + stat.size)
+    return result
+
+
+class MemorySnapshot(object):
+    """
+    objects: type name -> (live instances, retained bytes)
+    modules: module name -> (allocations, bytes), or None if tracemalloc
+    wasn't tracing
+    """
+
+    def __init__(self, timestamp, objects, modules=None):
+        self.timestamp = timestamp
+        self.objects = objects
+        self.modules = modules
+
+    def __repr__(self):
+        return "<MemorySnapshot({0}, {1} objects, {2} bytes)>".format(
+            datetime.fromtimestamp(self.timestamp),
+            sum(c for c, _ in self.objects.values()),
+            sum(s for _, s in self.objects.values()))
+
+
+def snapshot(types=None):
+    return MemorySnapshot(time.time(), count_objects(types),
+                          allocations_by_module())
+
+
+def _diff(old, new):
+    rows = []
+    for key in set(old) | set(new):
+        c0, s0 = old.get(key, (0, 0))
+        c1, s1 = new.get(key, (0, 0))
+        if (c0, s0) != (c1, s1):
+            rows.append((key, c1 - c0, s1 - s0))
+    rows.sort(key=lambda r: -abs(r[2]))
+    return rows
+
+
+def diff(old, new):
+    """compares two MemorySnapshots. Returns (objects, modules): lists of
+    (key, count change, bytes change), biggest change in bytes first.
+    modules is None unless both snapshots traced allocations"""
+    modules = None
+    if old.modules is not None and new.modules is not None:
+        modules = _diff(old.modules, new.modules)
+    return _diff(old.objects, new.objects), modules
+
+
+def report(snap, previous=None, limit=20):
+    """returns a text report of snap, compared with previous if given"""
+    lines = ["memory at {0}".format(datetime.fromtimestamp(snap.timestamp))]
+
+    def table(title, current, changes):
+        lines.append(title)
+        if changes is None:
+            rows = sorted(current.items(), key=lambda r: -r[1][1])[:limit]
+            for key, (count, size) in rows:
+                lines.append("  {0:<40} {1:>10} {2:>14}".format(key, count,
+                                                                size))
+        else:
+            for key, count, size in changes[:limit]:
+                lines.append("  {0:<40} {1:>+10} {2:>+14}".format(key, count,
+                                                                  size))
+
+    objects = modules = None
+    if previous is not None:
+        objects, modules = diff(previous, snap)
+        lines[0] += ", since {0}".format(
+            datetime.fromtimestamp(previous.timestamp))
+    table("objects (count, bytes):", snap.objects, objects)
+    if snap.modules is not None:
+        table("allocations per module (count, bytes):", snap.modules,
+              modules)
+    return "\n".join(lines) + "\n"
+
+
+def install_signal_handler(signum=signal.SIGUSR1, stream=None):
+    """on signum, writes a report (compared with the one before) to stream
+    (default: sys.stderr)"""
+    state = {'previous': None}
+
+    def handler(signum, frame):
+        snap = snapshot()
+        (stream or sys.stderr).write(report(snap, state['previous']))
+        state['previous'] = snap
+
+    signal.signal(signum, handler)
@@ -0,0 +1,362 @@
+"""Process metrics: counters, gauges and histograms, exported in the
+Prometheus text format.
+
+Metrics live in a Registry (REGISTRY by default) and are identified by
+name and label values. Updates are made to a shard owned by the updating
+thread, so the hot paths never contend for a lock; the shards are only
+summed when the metrics are collected.
+
+The metrics can be pulled over HTTP (serve) or dumped to a file every
+few seconds (FileDumper), e.g. for node_exporter's textfile collector.
+"""
+
+import BaseHTTPServer
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+
+
+# default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Sharded(object):
+    """per-thread dictionaries of label values -> state. The shards of
+    the threads that have ended are merged into a base dictionary, so
+    they don't pile up"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []       # (thread, shard)
+        self._base = {}
+        self._lock = threading.Lock()
+
+    def _add(self, a, b):
+        """the state of two shards' states combined"""
+        raise NotImplementedError()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _prune(self):
+        """merges the shards of ended threads into the base. Called with
+        the lock held"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for k, v in shard.items():
+                # a new state, not an update: snapshots may be reading it
+                old = self._base.get(k)
+                self._base[k] = v if old is None else self._add(old, v)
+        self._shards = live
+
+    def _snapshots(self):
+        with self._lock:
+            self._prune()
+            shards = [self._base] + [s for _, s in self._shards]
+        # copying a dict is atomic: its owner may be updating it
+        return [dict(s) for s in shards]
+
+    def _states(self, labels):
+        """the states of labels in the shards that have one"""
+        with self._lock:
+            shards = [self._base] + [s for _, s in self._shards]
+        return [v for v in (s.get(labels) for s in shards) if v is not None]
+
+    def clear(self):
+        """forgets every value. Updates made meanwhile may be lost"""
+        with self._lock:
+            self._base = {}
+            for _, shard in self._shards:
+                shard.clear()
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def samples(self):
+        """returns a list of (suffix, label values, extra labels, value)"""
+        raise NotImplementedError()
+
+
+class Counter(Metric, _Sharded):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        Metric.__init__(self, name, help, labels)
+        _Sharded.__init__(self)
+
+    def _add(self, a, b):
+        return a + b
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return sum(s.get(labels, 0) for s in self._snapshots())
+
+    def samples(self):
+        totals = {}
+        for s in self._snapshots():
+            for k, v in s.items():
+                totals[k] = totals.get(k, 0) + v
+        return [('', k, (), v) for k, v in sorted(totals.items())]
+
+
+class Gauge(Metric):
+    """A value that is set (not accumulated). Setting it is a single
+    dictionary assignment. A gauge may instead be computed on collection,
+    by a function returning a dictionary of label values -> value"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        Metric.__init__(self, name, help, labels)
+        self.values = {}
+        self.function = function
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def value(self, labels=()):
+        return self.values.get(labels)
+
+    def samples(self):
+        values = self.function() if self.function else dict(self.values)
+        return [('', k, (), v) for k, v in sorted(values.items())]
+
+
+class Histogram(Metric, _Sharded):
+    """Observations counted in cumulative buckets, as in Prometheus"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        _Sharded.__init__(self)
+        self.buckets = tuple(sorted(buckets))
+
+    def _add(self, a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # counts per bucket (and +Inf), then sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, labels=()):
+        """returns a context manager that observes the time spent in it"""
+        return _Timer(self, labels)
+
+    def _total(self, labels):
+        states = self._states(labels)
+        return reduce(self._add, states) if states else None
+
+    def count(self, labels=()):
+        """the number of observations of labels"""
+        state = self._total(labels)
+        return 0 if state is None else sum(state[:-1])
+
+    def total(self, labels=()):
+        """the sum of the observations of labels"""
+        state = self._total(labels)
+        return 0.0 if state is None else state[-1]
+
+    def percentile(self, p, labels=()):
+        """the p-th percentile (0-100) of the observations of labels,
+        interpolated within its bucket (as Prometheus' histogram_quantile
+        does). None if there are none"""
+        state = self._total(labels)
+        n = 0 if state is None else sum(state[:-1])
+        if not n:
+            return None
+        rank = p / 100.0 * n
+        seen, lower = 0, 0.0
+        for bound, count in zip(self.buckets, state[:-1]):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]     # the +Inf bucket: no better bound
+
+    def label_values(self):
+        """the label values observed"""
+        keys = set()
+        for s in self._snapshots():
+            keys.update(s)
+        return sorted(keys)
+
+    def samples(self):
+        totals = {}
+        for s in self._snapshots():
+            for k, state in s.items():
+                t = totals.setdefault(k, [0] * len(state[:-1]) + [0.0])
+                for i, v in enumerate(state):
+                    t[i] += v
+        samples = []
+        for k, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append(('_bucket', k, (('le', le),), cumulative))
+            samples.append(('_sum', k, (), state[-1]))
+            samples.append(('_count', k, (), cumulative))
+        return samples
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.start, self.labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("metric {0} is a {1}".format(name,
+                                                              metric.type))
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._get(Gauge, name, help, labels, function=function)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def to_prometheus(self):
+        """all the metrics, in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        lines = []
+        for m in metrics:
+            lines.append("# HELP {0} {1}".format(m.name, m.help))
+            lines.append("# TYPE {0} {1}".format(m.name, m.type))
+            for suffix, values, extra, value in m.samples():
+                labels = zip(m.labels, values) + list(extra)
+                label_text = ""
+                if labels:
+                    label_text = "{" + ",".join('{0}="{1}"'.format(
+                        k, _escape(v)) for k, v in labels) + "}"
+                lines.append("{0}{1}{2} {3}".format(m.name, suffix,
+                                                    label_text, repr(value)))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(histogram):
+    """decorates a Market method, observing its duration in histogram
+    (labelled with the market's name and pair)"""
+    def decorate(method):
+        @wraps(method)
+        def timed_method(self, *args, **kwargs):
+            pair = "{0}/{1}".format(self.currency2, self.currency1)
+            with histogram.time((self.name, pair)):
+                return method(self, *args, **kwargs)
+        return timed_method
+    return decorate
+
+
+# ---- exporting ----------------------------------------------------------
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.to_prometheus()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=9108, host='127.0.0.1', registry=REGISTRY):
+    """serves the metrics of registry over HTTP from a daemon thread.
+    Returns the server (call its shutdown method to stop it)"""
+    class Handler(_Handler):
+        pass
+    Handler.registry = registry
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+class FileDumper(threading.Thread):
+    """writes the metrics of registry to filename every interval seconds.
+    The file is replaced atomically, so it's never read half-written"""
+
+    def __init__(self, filename, interval=15, registry=REGISTRY):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.interval = interval
+        self.registry = registry
+        self.stop_event = threading.Event()
+
+    def dump(self):
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.registry.to_prometheus())
+        os.rename(tmp, self.filename)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.dump()
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.dump()
@@ -3,29 +3,41 @@ import threading
 import time
 from collections import deque
 
+from mexbtcapi.util.metrics import REGISTRY
+
+TICK_LAG = REGISTRY.histogram("mexbtcapi_monitor_tick_lag_seconds",
+    "How late each Monitor poll started", ("monitor",))
+MISSED_POLLS = REGISTRY.counter("mexbtcapi_monitor_missed_polls_total",
+    "Monitor polls skipped because the previous one overran", ("monitor",))
+
 
 class MonitorThread(threading.Thread):
     """executes a function f with sleep_time intervals in between
     """
 
-    def __init__(self, sleep_time, callback):
+    def __init__(self, sleep_time, callback, label=None):
         threading.Thread.__init__(self)
         self.sleep_time = sleep_time
         self.callback = callback
         self.stop_signal = False
+        self.label = (label or getattr(callback, '__name__', 'monitor'),)
 
     def run(self):
-        start_time = datetime.datetime.now()
+        # polls are scheduled every sleep_time seconds from the start;
+        # a poll that overruns skips the ones it overlaps with
+        start_time = time.time()
+        tick = 0
         while True:
+            TICK_LAG.observe(time.time() - (start_time + tick * self.sleep_time),
+                             self.label)
             self.callback()
-            d = datetime.now() - start_time
-            seconds = (d.microseconds + (d.seconds + d.days * 24 * 3600) * \
-                       (10 ** 6)) / float(10 ** 6)
-            duration = seconds % self.sleep_time  # method execution time
-            sleep_time = max(0, self.sleep_time - duration)
             if self.stop_signal:
                 break
-            time.sleep(sleep_time)
+            next_tick = int((time.time() - start_time) // self.sleep_time) + 1
+            if next_tick > tick + 1:
+                MISSED_POLLS.inc(self.label, next_tick - tick - 1)
+            tick = next_tick
+            time.sleep(max(0, start_time + tick * self.sleep_time - time.time()))
 
     def stop(self):
         self.stop_signal = True
@@ -33,8 +45,8 @@ class MonitorThread(threading.Thread):
         return
 
     @staticmethod
-    def new_thread(sleep_time, callback):
-        t = MonitorThread(sleep_time, callback)
+    def new_thread(sleep_time, callback, label=None):
+        t = MonitorThread(sleep_time, callback, label)
         t.setDaemon(True)
         t.start()
         return t
@@ -107,7 +119,7 @@ class Monitor(object):
         if different:
             if len(self.data) >= self.memory:
                 self._remove_entry()
-            d = (datetime.datetime.now(), data) if self.keep_datetime else data
+            d = (datetime.now(), data) if self.keep_datetime else data
             self.data.append(d)
             self.flush(always=False)
 
@@ -119,7 +131,8 @@ class Monitor(object):
                 self.external_callback(self)
 
     def start(self):
-        self.thread = MonitorThread.new_thread(self.sleep_time, self.callback)
+        self.thread = MonitorThread.new_thread(self.sleep_time, self.callback,
+                                               getattr(self.f, '__name__', None))
 
     def stop(self):
         assert self.thread
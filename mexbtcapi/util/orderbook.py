@@ -0,0 +1,138 @@
+"""A limit order book with price-time priority.
+
+Each side keeps its price levels in a dictionary (price -> orders in
+arrival order) and a heap of prices, so that adding an order, cancelling
+it and finding the best price are all O(log n) or better. Prices of
+emptied levels are left in the heap and discarded when they reach the
+top.
+"""
+
+import heapq
+from collections import OrderedDict
+
+
+BID = 'BID'
+ASK = 'ASK'
+
+
+class RestingOrder(object):
+    """An order resting on a LimitOrderBook.
+
+    price: Decimal, in the buy currency, per unit of the item
+    volume: Decimal, remaining volume of the item
+    queue_ahead: estimated volume (of the item) that must trade at this
+    price before this order starts getting filled
+    """
+    __slots__ = ('oid', 'side', 'price', 'volume', 'queue_ahead', 'order')
+
+    def __init__(self, oid, side, price, volume, queue_ahead=0, order=None):
+        assert side in (BID, ASK)
+        self.oid = oid
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.queue_ahead = queue_ahead
+        self.order = order
+
+    def __repr__(self):
+        return "<RestingOrder({0}, {1}, {2} @ {3}, {4} ahead)>".format(
+            self.oid, self.side, self.volume, self.price, self.queue_ahead)
+
+
+class BookSide(object):
+    """One side (bids or asks) of a LimitOrderBook"""
+
+    def __init__(self, side):
+        self.side = side
+        self.levels = {}    # price -> OrderedDict(oid -> RestingOrder)
+        self.heap = []      # prices, negated for bids
+        self._sign = -1 if side == BID else 1
+
+    def add(self, order):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = OrderedDict()
+            heapq.heappush(self.heap, self._sign * order.price)
+        level[order.oid] = order
+
+    def remove(self, order):
+        level = self.levels[order.price]
+        del level[order.oid]
+        if not level:
+            del self.levels[order.price]
+
+    def best(self):
+        """returns the best price of this side, or None if empty"""
+        heap = self.heap
+        while heap:
+            price = self._sign * heap[0]
+            if price in self.levels:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def level(self, price):
+        """returns the orders at a given price, in time priority"""
+        return self.levels.get(price, OrderedDict()).values()
+
+    def volume(self, price):
+        return sum(o.volume for o in self.level(price))
+
+    def crosses(self, price, other_price):
+        """is price at least as good as other_price, from this side's
+        point of view?"""
+        return price >= other_price if self.side == BID else \
+            price <= other_price
+
+    def prices(self):
+        """returns the prices of this side, best first. This sorts every
+        level: matching walks them with best() instead"""
+        return sorted(self.levels, reverse=(self.side == BID))
+
+    def __iter__(self):
+        """iterates over the orders of this side, in price-time priority"""
+        for price in self.prices():
+            for order in self.levels[price].values():
+                yield order
+
+    def __len__(self):
+        return sum(len(l) for l in self.levels.values())
+
+
+class LimitOrderBook(object):
+    """Orders indexed by id and by price-time priority on each side"""
+
+    def __init__(self):
+        self.bids = BookSide(BID)
+        self.asks = BookSide(ASK)
+        self.orders = {}
+
+    def side(self, side):
+        return self.bids if side == BID else self.asks
+
+    def add(self, order):
+        assert order.oid not in self.orders
+        self.orders[order.oid] = order
+        self.side(order.side).add(order)
+
+    def cancel(self, oid):
+        """removes an order from the book, returning it. Raises KeyError
+        if no such order is resting on the book"""
+        order = self.orders.pop(oid)
+        self.side(order.side).remove(order)
+        return order
+
+    def get(self, oid):
+        return self.orders.get(oid)
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def __contains__(self, oid):
+        return oid in self.orders
+
+    def __len__(self):
+        return len(self.orders)
@@ -0,0 +1,310 @@
+"""Paper trading: an ActiveParticipant that never touches an exchange.
+
+SimulatedParticipant keeps the orders placed on it in a local
+LimitOrderBook and fills them against the depth and trades of a Market
+(live, or replayed through util.record), honouring price-time priority
+and an estimate of each order's position in the exchange queue.
+"""
+
+import itertools
+from datetime import datetime
+
+from mexbtcapi.concepts.currency import Amount, ExchangeRate
+from mexbtcapi.concepts.market import ActiveParticipant, Order
+from mexbtcapi.util.orderbook import BID, ASK, LimitOrderBook, RestingOrder
+
+
+class SimulatedOrder(Order):
+    """An Order placed on a SimulatedParticipant"""
+
+    def __init__(self, oid, *args, **kwargs):
+        super(SimulatedOrder, self).__init__(*args, **kwargs)
+        self.oid = oid
+        self.filled = Amount(0, self.market.currency2)
+
+    def __repr__(self):
+        return "<SimulatedOrder({0}, {1}, {2}, {3}, {4}, filled {5}>" \
+            .format(self.market, self.timestamp, self.oid, self.order_type,
+            self.from_amount, self.filled)
+
+
+class SimulatedFill(object):
+    """The (partial) execution of a SimulatedOrder"""
+    __slots__ = ('timestamp', 'order', 'price', 'volume')
+
+    def __init__(self, timestamp, order, price, volume):
+        self.timestamp = timestamp
+        self.order = order
+        self.price = price      # ExchangeRate
+        self.volume = volume    # Amount of the item
+
+    def __repr__(self):
+        return "<SimulatedFill({0}, {1}, {2} @ {3})>".format(self.timestamp,
+            self.order.oid, self.volume, self.price)
+
+
+class SimulatedParticipant(ActiveParticipant):
+    """
+    A participant whose orders are matched locally against the depth and
+    trades of its market. Feed it with update() (which polls the market),
+    or with onDepth() / onTrades() when replaying or streaming.
+
+    balances: dictionary of Currency to Amount, updated on every fill. If
+    given, orders that need more than the balance not already reserved
+    by open orders are rejected
+    """
+
+    def __init__(self, market, balances=None):
+        super(SimulatedParticipant, self).__init__(market)
+        self.book = LimitOrderBook()
+        self.check_balances = balances is not None
+        self.balances = dict(balances or {})
+        self.fills = []
+        self._oids = itertools.count(1)
+        # the exchange's book, as {price: volume} per side, and its prices
+        # sorted worst first, so that the best is popped once taken
+        self._depth = {BID: {}, ASK: {}}
+        self._prices = {BID: [], ASK: []}
+
+    # ---- conversions -------------------------------------------------
+
+    def _price(self, exchange_rate):
+        return exchange_rate.convert(Amount(1, self.market.currency2)).value
+
+    def _volume(self, order, price):
+        """the volume of the item an order refers to"""
+        a = order.from_amount
+        if a.currency == self.market.currency2:
+            return a.value
+        return a.value / price
+
+    def _side(self, order):
+        if order.order_type in (Order.BID, Order.MARKET_BUY):
+            return BID
+        return ASK
+
+    def _available(self, currency):
+        """the balance of currency not reserved by open orders"""
+        balance = self.balances.get(currency)
+        available = balance.value if balance is not None else 0
+        orders = self.book.orders.values()
+        if currency == self.market.currency1:
+            reserved = sum(o.volume * o.price for o in orders if o.side == BID)
+        else:
+            reserved = sum(o.volume for o in orders if o.side == ASK)
+        return available - reserved
+
+    def _checkBalance(self, side, price, volume):
+        """raises InvalidOrder if an order can't be paid for"""
+        if side == ASK:
+            currency, needed = self.market.currency2, volume
+        else:
+            currency = self.market.currency1
+            if price is not None:
+                needed = volume * price
+            else:
+                # a market order pays what it takes from the book
+                opposite = self._depth[ASK]
+                needed, left = 0, volume
+                for p in reversed(self._prices[ASK]):
+                    take = min(left, opposite[p])
+                    needed += take * p
+                    left -= take
+                    if left == 0:
+                        break
+        if needed > self._available(currency):
+            raise self.market.InvalidOrder("Insufficient {0} balance"
+                                           .format(currency))
+
+    # ---- ActiveParticipant interface ----------------------------------
+
+    def placeOrder(self, order):
+        """places an Order, filling at once whatever part of it crosses
+        the exchange's book. The rest of a limit order stays on the book;
+        the rest of a market order is dropped"""
+        side = self._side(order)
+        market_order = order.order_type in (Order.MARKET_BUY,
+                                            Order.MARKET_SELL)
+        opposite = self._prices[ASK if side == BID else BID]
+        if market_order:
+            if not opposite:
+                raise self.market.InvalidOrder("No depth to match against")
+            best = opposite[-1]
+            price = None
+            volume = self._volume(order, best)
+        else:
+            price = self._price(order.exchange_rate)
+            volume = self._volume(order, price)
+        if self.check_balances:
+            self._checkBalance(side, price, volume)
+
+        oid = next(self._oids)
+        placed = SimulatedOrder(oid, self.market, datetime.now(),
+                                order.order_type, order.from_amount,
+                                order.exchange_rate, order.properties,
+                                entity=self)
+        resting = RestingOrder(oid, side, price, volume, order=placed)
+        self._take(resting, placed.timestamp)
+        if resting.volume > 0 and not market_order:
+            resting.queue_ahead = self._depth[side].get(price, 0) + \
+                self.book.side(side).volume(price)
+            self.book.add(resting)
+        return placed
+
+    def cancelOrder(self, order):
+        """Cancel an existing order"""
+        assert isinstance(order, SimulatedOrder)
+        try:
+            self.book.cancel(order.oid)
+        except KeyError:
+            raise ActiveParticipant.OrderAlreadyClosedError()
+
+    def getOpenOrders(self):
+        """Gets all the open orders"""
+        return [o.order for o in itertools.chain(self.book.bids,
+                                                 self.book.asks)]
+
+    def queuePosition(self, order):
+        """returns the estimated Amount of the item ahead of order in the
+        exchange queue, or None if the order is not open"""
+        resting = self.book.get(order.oid)
+        if resting is None:
+            return None
+        return Amount(resting.queue_ahead, self.market.currency2)
+
+    # ---- market data ---------------------------------------------------
+
+    def update(self):
+        """polls the market for depth (and trades, if available)"""
+        self.onDepth(self.market.getDepth())
+        try:
+            trades = self.market.getTrades()
+        except NotImplementedError:
+            trades = None
+        if trades:
+            self.onTrades(trades)
+
+    def onDepth(self, depth):
+        """depth: as returned by Market.getDepth"""
+        c2 = self.market.currency2
+        new = {BID: {}, ASK: {}}
+        for typ, side in (('bids', BID), ('asks', ASK)):
+            levels = new[side]
+            for o in depth[typ]:
+                price = self._price(o.exchange_rate)
+                volume = o.exchange_rate.convert(o.from_amount, c2).value
+                levels[price] = levels.get(price, 0) + volume
+        self._depth = new
+        self._prices = {BID: sorted(new[BID]), ASK: sorted(new[ASK],
+                                                           reverse=True)}
+        now = datetime.now()
+        for side in (BID, ASK):
+            book_side = self.book.side(side)
+            for price, level in book_side.levels.items():
+                # orders ahead of ours can't be more than what's left there
+                ahead = new[side].get(price, 0)
+                for resting in level.values():
+                    resting.queue_ahead = min(resting.queue_ahead, ahead)
+                    ahead += resting.volume
+            # orders the exchange's book has moved through are now takers,
+            # from the best price until one is left standing
+            while True:
+                price = book_side.best()
+                if price is None:
+                    break
+                for resting in book_side.level(price):
+                    self._take(resting, now)
+                    if resting.volume == 0:
+                        self.book.cancel(resting.oid)
+                if price in book_side.levels:
+                    break
+
+    def onTrades(self, trades):
+        """trades: a list of Trade, in the order they happened"""
+        c2 = self.market.currency2
+        for t in trades:
+            price = self._price(t.exchange_rate)
+            volume = t.exchange_rate.convert(t.from_amount, c2).value
+            self._tradeThrough(self._tradeSide(price), price, volume,
+                               t.timestamp)
+
+    def _tradeSide(self, price):
+        """the side of our book a trade at price was against: trades at or
+        below the middle of the exchange's book sold to the bids, the
+        others bought from the asks"""
+        bids, asks = self._depth[BID], self._depth[ASK]
+        if bids and asks:
+            return BID if 2 * price <= max(bids) + min(asks) else ASK
+        best_bid = self.book.bids.best()
+        return BID if best_bid is not None and best_bid >= price else ASK
+
+    # ---- matching ---------------------------------------------------
+
+    def _take(self, resting, timestamp):
+        """fills resting against the exchange's book, as far as its price
+        allows"""
+        side = resting.side
+        opposite = self._depth[ASK if side == BID else BID]
+        prices = self._prices[ASK if side == BID else BID]
+        book_side = self.book.side(side)
+        while resting.volume and prices:
+            price = prices[-1]
+            if resting.price is not None and \
+                    not book_side.crosses(resting.price, price):
+                break
+            volume = min(resting.volume, opposite[price])
+            opposite[price] -= volume
+            if opposite[price] == 0:
+                del opposite[price]
+                prices.pop()
+            self._fill(resting, price, volume, timestamp)
+
+    def _tradeThrough(self, side, price, volume, timestamp):
+        """fills the orders of one side of the book that a trade of volume
+        at price reaches, in price-time priority. Returns the volume
+        left"""
+        book_side = self.book.side(side)
+        while volume:
+            level_price = book_side.best()
+            if level_price is None or \
+                    not book_side.crosses(level_price, price):
+                break
+            at_price = level_price == price
+            traded = volume
+            ours_ahead = 0      # our earlier orders at this price
+            for resting in list(book_side.level(level_price)):
+                if at_price:
+                    # the queue ahead (ours included) gets filled first
+                    ahead = max(resting.queue_ahead, ours_ahead)
+                    ours_ahead += resting.volume
+                    take = min(resting.volume, volume,
+                               max(0, traded - ahead))
+                    resting.queue_ahead = max(0, resting.queue_ahead - traded)
+                else:
+                    take = min(resting.volume, volume)
+                if take:
+                    volume -= take
+                    self._fill(resting, level_price, take, timestamp)
+                    if resting.volume == 0:
+                        self.book.cancel(resting.oid)
+            if level_price in book_side.levels:
+                break       # the trade ends at this level
+        return volume
+
+    def _fill(self, resting, price, volume, timestamp):
+        c1, c2 = self.market.currency1, self.market.currency2
+        resting.volume -= volume
+        order = resting.order
+        order.filled += Amount(volume, c2)
+        sign = 1 if resting.side == BID else -1
+        for c, delta in ((c2, sign * volume), (c1, -sign * volume * price)):
+            self.balances[c] = self.balances.get(c, Amount(0, c)) + \
+                Amount(delta, c)
+        self.fills.append(SimulatedFill(timestamp, order,
+            ExchangeRate(c2, c1, price), Amount(volume, c2)))
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return "<SimulatedParticipant({0})>".format(self.market)
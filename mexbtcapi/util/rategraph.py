@@ -0,0 +1,223 @@
+"""Cross-rate conversion between any currencies, through any markets.
+
+A RateGraph keeps, for every pair of currencies some market trades, the
+best executable rate in each direction (selling at the bid, buying at the
+ask). convert() follows the path of markets that yields the most (or, if
+asked, the one with the fewest hops) to reach the target currency.
+
+Paths are cached. A rate update only drops the cached paths it can
+affect: when a rate gets worse, those that go through it; when it gets
+better (or a new one appears), those that could now go through it.
+"""
+
+import threading
+from collections import deque
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount
+
+
+class NoPath(Exception):
+    """raised when a currency can't be converted into another"""
+    def __init__(self, from_currency, to_currency):
+        self.from_currency, self.to_currency = from_currency, to_currency
+
+    def __str__(self):
+        return "No conversion path from {0} to {1}".format(
+            self.from_currency, self.to_currency)
+
+
+class Path(object):
+    """A sequence of conversions: currencies[0] -> ... -> currencies[-1]"""
+    __slots__ = ('currencies',)
+
+    def __init__(self, currencies):
+        self.currencies = tuple(currencies)
+
+    def edges(self):
+        c = self.currencies
+        return zip(c[:-1], c[1:])
+
+    def __len__(self):
+        return len(self.currencies) - 1
+
+    def __repr__(self):
+        return "<Path({0})>".format(" -> ".join(map(str, self.currencies)))
+
+
+class RateGraph(object):
+    """
+    max_hops: maximum number of conversions a path may have
+    fewest_hops: prefer the paths with fewest conversions (ties are broken
+    by rate) instead of the paths with the best rate
+    """
+
+    def __init__(self, max_hops=4, fewest_hops=False):
+        self.max_hops = max_hops
+        self.fewest_hops = fewest_hops
+        self.lock = threading.RLock()
+        self.rates = {}     # (from, to) -> {source: rate}
+        self.best = {}      # (from, to) -> best rate over all sources
+        self.out = {}       # from -> set of to
+        self.into = {}      # to -> set of from
+        self._paths = {}    # (from, to) -> Path, or None if unreachable
+        self._edge_paths = {}   # (from, to) -> set of cached path keys
+
+    # ---- ingesting ----------------------------------------------------
+
+    def setRate(self, from_currency, to_currency, rate, source=None):
+        """one from_currency can be exchanged for rate to_currency at
+        source (usually a Market)"""
+        rate = Decimal(rate)
+        edge = (from_currency, to_currency)
+        with self.lock:
+            old = self.best.get(edge)
+            self.rates.setdefault(edge, {})[source] = rate
+            new = self.best[edge] = max(self.rates[edge].values())
+            self.out.setdefault(from_currency, set()).add(to_currency)
+            self.into.setdefault(to_currency, set()).add(from_currency)
+            if old is None or new > old:
+                self._invalidateReaching(edge)
+            elif new < old:
+                self._invalidateUsing(edge)
+
+    def removeRate(self, from_currency, to_currency, source=None):
+        edge = (from_currency, to_currency)
+        with self.lock:
+            rates = self.rates.get(edge, {})
+            rates.pop(source, None)
+            if rates:
+                old, self.best[edge] = self.best[edge], max(rates.values())
+                if self.best[edge] < old:
+                    self._invalidateUsing(edge)
+                return
+            self.rates.pop(edge, None)
+            self.best.pop(edge, None)
+            self.out.get(from_currency, set()).discard(to_currency)
+            self.into.get(to_currency, set()).discard(from_currency)
+            self._invalidateUsing(edge)
+
+    def setQuote(self, market, bid, ask):
+        """bid, ask: ExchangeRate (or None) of market's item
+        (currency2) in its buy currency (currency1)"""
+        c1, c2 = market.currency1, market.currency2
+        one = Amount(1, c2)
+        if bid is not None:
+            self.setRate(c2, c1, bid.convert(one).value, market)
+        if ask is not None:
+            self.setRate(c1, c2, 1 / ask.convert(one).value, market)
+
+    def ingestTicker(self, market, ticker):
+        self.setQuote(market, ticker.buy, ticker.sell)
+
+    def ingestQuote(self, market, quote):
+        """quote: as returned by market.getQuote"""
+        self.setQuote(market, quote.bid, quote.ask)
+
+    def ingestDepth(self, market, depth):
+        """uses the top of book of depth, as returned by market.getDepth"""
+        one = Amount(1, market.currency2)
+        price = lambda o: o.exchange_rate.convert(one).value
+        bids, asks = depth['bids'], depth['asks']
+        bid = max(bids, key=price).exchange_rate if bids else None
+        ask = min(asks, key=price).exchange_rate if asks else None
+        self.setQuote(market, bid, ask)
+
+    def refresh(self, markets):
+        """polls every market for its quote"""
+        for market in markets:
+            self.ingestQuote(market, market.getQuote())
+
+    # ---- querying -----------------------------------------------------
+
+    def path(self, from_currency, to_currency):
+        """returns the Path used to convert between the two currencies"""
+        key = (from_currency, to_currency)
+        with self.lock:
+            if key in self._paths:
+                path = self._paths[key]
+            else:
+                path = self._paths[key] = self._search(*key)
+                if path is not None:
+                    for edge in path.edges():
+                        self._edge_paths.setdefault(edge, set()).add(key)
+        if path is None:
+            raise NoPath(from_currency, to_currency)
+        return path
+
+    def rate(self, from_currency, to_currency):
+        """returns how much to_currency one from_currency is worth"""
+        if from_currency is to_currency:
+            return Decimal(1)
+        with self.lock:
+            rate = Decimal(1)
+            for edge in self.path(from_currency, to_currency).edges():
+                rate *= self.best[edge]
+            return rate
+
+    def convert(self, amount, to_currency):
+        return Amount(amount.value * self.rate(amount.currency, to_currency),
+                      to_currency)
+
+    # ---- internals ----------------------------------------------------
+
+    def _search(self, source, target):
+        """bounded-hops Bellman-Ford, maximizing the product of rates"""
+        if source is target:
+            return Path((source,))
+        best = {source: (Decimal(1), (source,))}
+        frontier = best
+        for _ in range(self.max_hops):
+            reached = {}
+            for c, (value, path) in frontier.items():
+                for d in self.out.get(c, ()):
+                    if d in path:
+                        continue
+                    v = value * self.best[(c, d)]
+                    if d not in reached or v > reached[d][0]:
+                        reached[d] = (v, path + (d,))
+            frontier = {}
+            for d, (v, path) in reached.items():
+                if d not in best or v > best[d][0]:
+                    best[d] = frontier[d] = (v, path)
+            if self.fewest_hops and target in reached:
+                return Path(reached[target][1])
+            if not frontier:
+                break
+        found = best.get(target)
+        return Path(found[1]) if found else None
+
+    def _drop(self, keys):
+        for key in keys:
+            path = self._paths.pop(key, None)
+            if path is not None:
+                for edge in path.edges():
+                    self._edge_paths.get(edge, set()).discard(key)
+
+    def _invalidateUsing(self, edge):
+        """drops the cached paths that go through edge"""
+        self._drop(list(self._edge_paths.get(edge, ())))
+
+    def _reach(self, start, neighbours):
+        seen = set([start])
+        queue = deque([(start, 0)])
+        while queue:
+            c, hops = queue.popleft()
+            if hops == self.max_hops:
+                continue
+            for d in neighbours.get(c, ()):
+                if d not in seen:
+                    seen.add(d)
+                    queue.append((d, hops + 1))
+        return seen
+
+    def _invalidateReaching(self, edge):
+        """drops the cached paths that could go through edge: those that
+        start where edge's origin can be reached from, and end where
+        edge's destination can reach"""
+        if not self._paths:
+            return
+        sources = self._reach(edge[0], self.into)
+        targets = self._reach(edge[1], self.out)
+        self._drop([k for k in self._paths
+                    if k[0] in sources and k[1] in targets])
@@ -0,0 +1,237 @@
+"""Record-and-replay of raw exchange responses.
+
+A Recorder stores every raw response an adapter receives, together with
+the time it arrived, in a compressed, indexed log. A Player reads such a
+log back and hands the responses to the very same adapter code, either
+at the recorded pace or as fast as possible.
+
+The log is made of two files:
+    filename        zlib-compressed JSON blocks, one per response
+    filename.idx    one line per response: time, kind, key, offset, length
+
+Markets are attached to a Recorder or a Player through
+Market.hookTransport().
+"""
+
+import json
+import threading
+import time
+import zlib
+from collections import deque
+
+
+CALL = 'call'   # the response is the return value of a method call
+ATTR = 'attr'   # the response is the value of an attribute (property)
+
+INDEX_SUFFIX = ".idx"
+
+
+def call_key(*args, **kwargs):
+    """distinguishes the calls of a hooked client method by their
+    arguments, so that a replay returns the response of the same call"""
+    return json.dumps([args, kwargs], sort_keys=True, default=repr)
+
+
+class RecordingExhausted(Exception):
+    """raised by a Player when there are no more recorded responses for
+    a given key"""
+    def __init__(self, key):
+        self.key = key
+
+    def __str__(self):
+        return "No more recorded responses for {0}".format(self.key)
+
+
+class IndexEntry(object):
+    __slots__ = ('timestamp', 'kind', 'key', 'offset', 'length')
+
+    def __init__(self, timestamp, kind, key, offset, length):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.key = key
+        self.offset = offset
+        self.length = length
+
+    def to_line(self):
+        return "{0!r}\t{1}\t{2}\t{3}\t{4}\n".format(self.timestamp, self.kind,
+                    self.key, self.offset, self.length)
+
+    @staticmethod
+    def from_line(line):
+        timestamp, kind, key, offset, length = line.rstrip("\n").split("\t")
+        return IndexEntry(float(timestamp), kind, key, int(offset),
+                          int(length))
+
+
+class RecordLog(object):
+    """Low level access to a recording (data file + index file)"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+
+    def append(self, timestamp, kind, key, response):
+        """appends a response to the log. Not thread safe"""
+        block = zlib.compress(json.dumps(response))
+        with open(self.filename, "ab") as f:
+            f.seek(0, 2)
+            offset = f.tell()
+            f.write(block)
+        entry = IndexEntry(timestamp, kind, key, offset, len(block))
+        with open(self.index_filename, "a") as f:
+            f.write(entry.to_line())
+        return entry
+
+    def index(self):
+        """returns the list of IndexEntry of this log, in recording order"""
+        with open(self.index_filename, "r") as f:
+            return [IndexEntry.from_line(l) for l in f if l.strip()]
+
+    def read(self, entry, f=None):
+        """returns the response stored at a given IndexEntry"""
+        if f is None:
+            with open(self.filename, "rb") as f:
+                return self.read(entry, f)
+        f.seek(entry.offset)
+        return json.loads(zlib.decompress(f.read(entry.length)))
+
+
+class Recorder(object):
+    """Stores the raw responses of the hooked transports on a RecordLog"""
+    live = True     # the requests reach the exchange (see Player.live)
+
+    def __init__(self, filename):
+        self.log = RecordLog(filename)
+        self.lock = threading.Lock()
+
+    def record(self, kind, key, response):
+        with self.lock:
+            self.log.append(time.time(), kind, key, response)
+
+    def wrap(self, name, f, key=None):
+        """returns a function that calls f, recording its return value.
+        key, if given, is called with the same arguments as f and must
+        return a string that distinguishes the call (an url, for example)
+        """
+        def recorded(*args, **kwargs):
+            response = f(*args, **kwargs)
+            k = name if key is None else name + ":" + key(*args, **kwargs)
+            self.record(CALL, k, response)
+            return response
+        return recorded
+
+    def hook(self, name, obj):
+        """returns a proxy of obj (a third-party client) that records
+        every method return value and attribute read"""
+        return _RecordingProxy(self, name, obj)
+
+
+class Player(object):
+    """Feeds the responses of a recording back, in the same order for
+    each key. The method calls of hooked clients are keyed by their
+    arguments too, so a call gets the response recorded for the same call.
+
+    speed: None replays as fast as possible; otherwise, the recorded
+    time between responses is divided by speed (1.0 is the recorded pace)
+    """
+    live = False    # no request reaches the exchange: no rate limits apply
+
+    def __init__(self, filename, speed=None):
+        self.log = RecordLog(filename)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.queues = {}
+        index = self.log.index()
+        for entry in index:
+            self.queues.setdefault(entry.key, deque()).append(entry)
+        self.first_timestamp = index[0].timestamp if index else None
+        self.start_time = None
+        self.last_timestamp = None  # recording time of the last response
+        self.datafile = open(self.log.filename, "rb")
+
+    def kind(self, key):
+        """returns the kind of the next recorded response for key. A key
+        only recorded with arguments (key:arguments) is a CALL"""
+        queue = self.queues.get(key)
+        if queue:
+            return queue[0].kind
+        prefix = key + ":"
+        if any(k.startswith(prefix) for k in self.queues):
+            return CALL
+        raise RecordingExhausted(key)
+
+    def next(self, key):
+        """returns the next recorded response for key, waiting until its
+        recorded time if replaying at a given pace"""
+        with self.lock:
+            queue = self.queues.get(key)
+            if not queue:
+                raise RecordingExhausted(key)
+            entry = queue.popleft()
+            response = self.log.read(entry, self.datafile)
+            if self.start_time is None:
+                self.start_time = time.time()
+            self.last_timestamp = entry.timestamp
+        if self.speed:
+            due = self.start_time + \
+                (entry.timestamp - self.first_timestamp) / self.speed
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return response
+
+    def remaining(self):
+        """returns the number of responses not yet replayed"""
+        return sum(len(q) for q in self.queues.values())
+
+    def wrap(self, name, f=None, key=None):
+        """returns a function that, instead of calling f, returns the
+        recorded responses of a Recorder.wrap with the same name and key"""
+        def replayed(*args, **kwargs):
+            k = name if key is None else name + ":" + key(*args, **kwargs)
+            return self.next(k)
+        return replayed
+
+    def hook(self, name, obj=None):
+        """returns a proxy that replaces the third-party client recorded
+        by Recorder.hook. obj is not used"""
+        return _ReplayingProxy(self, name)
+
+    def close(self):
+        self.datafile.close()
+
+
+class _RecordingProxy(object):
+    def __init__(self, recorder, name, obj):
+        self._recorder = recorder
+        self._name = name
+        self._obj = obj
+
+    def __getattr__(self, attr):
+        value = getattr(self._obj, attr)
+        key = self._name + "." + attr
+        if callable(value):
+            return self._recorder.wrap(key, value, key=call_key)
+        self._recorder.record(ATTR, key, value)
+        return value
+
+
+class _ReplayingProxy(object):
+    def __init__(self, player, name):
+        self._player = player
+        self._name = name
+
+    def __getattr__(self, attr):
+        key = self._name + "." + attr
+        if self._player.kind(key) == CALL:
+            return self._replayed(key)
+        return self._player.next(key)
+
+    def _replayed(self, key):
+        player = self._player
+        def replayed(*args, **kwargs):
+            k = key + ":" + call_key(*args, **kwargs)
+            if k not in player.queues and key in player.queues:
+                k = key     # recorded before calls were keyed by arguments
+            return player.next(k)
+        return replayed
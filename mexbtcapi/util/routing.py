@@ -0,0 +1,178 @@
+"""Simulation of conversions that go through several markets.
+
+A route is a sequence of markets that takes a source currency to a
+target currency: LTC -> USD may go through ltc_usd directly, or through
+ltc_btc and then btc_usd. RouteSimulator walks each leg's book with the
+output of the previous leg and picks the route that yields the most.
+
+The books of a snapshot are turned into BookCurves once: cumulative
+volume and value per level, so that filling any amount is a binary
+search instead of a walk through the levels. Many routes and amounts can
+then be evaluated per snapshot cheaply.
+"""
+
+import bisect
+from decimal import Decimal
+
+from mexbtcapi.concepts.currency import Amount
+
+
+class BookSideCurve(object):
+    """Cumulative depth of one side of a book, best level first.
+
+    volumes[i]: item volume of levels 0..i
+    values[i]: buy currency value of levels 0..i
+    """
+    __slots__ = ('prices', 'volumes', 'values')
+
+    def __init__(self, levels):
+        """levels: (price, item volume) pairs, best first"""
+        self.prices, self.volumes, self.values = [], [], []
+        volume = value = Decimal(0)
+        for price, v in levels:
+            if v <= 0 or price <= 0:
+                continue    # exchanges send empty levels
+            volume += v
+            value += v * price
+            self.prices.append(price)
+            self.volumes.append(volume)
+            self.values.append(value)
+
+    def _fill(self, x, cumulative, other):
+        """fills x along cumulative (volumes or values), returning
+        (x filled, the matching amount of the other cumulative)"""
+        if not cumulative or x <= 0:
+            return Decimal(0), Decimal(0)
+        i = bisect.bisect_left(cumulative, x)
+        if i == len(cumulative):
+            return cumulative[-1], other[-1]
+        before = cumulative[i - 1] if i else Decimal(0)
+        other_before = other[i - 1] if i else Decimal(0)
+        level = cumulative[i] - before
+        part = (x - before) / level
+        return x, other_before + part * (other[i] - other_before)
+
+    def byVolume(self, volume):
+        """returns (volume filled, value) for volume of the item"""
+        return self._fill(volume, self.volumes, self.values)
+
+    def byValue(self, value):
+        """returns (value filled, volume) for value in the buy currency"""
+        return self._fill(value, self.values, self.volumes)
+
+
+class BookCurve(object):
+    """Both sides of a market's book, ready for fast fills"""
+
+    def __init__(self, market, depth):
+        self.market = market
+        c2, one = market.currency2, Amount(1, market.currency2)
+        def levels(orders, reverse):
+            l = [(o.exchange_rate.convert(one).value,
+                  o.exchange_rate.convert(o.from_amount, c2).value)
+                 for o in orders]
+            l.sort(key=lambda x: x[0], reverse=reverse)
+            return l
+        self.bids = BookSideCurve(levels(depth['bids'], True))
+        self.asks = BookSideCurve(levels(depth['asks'], False))
+
+    def convert(self, amount):
+        """exchanges amount (of either currency of the market) at market,
+        returning (Amount received, Amount used of amount)"""
+        c1, c2 = self.market.currency1, self.market.currency2
+        if amount.currency is c2:     # sell the item, hitting the bids
+            used, received = self.bids.byVolume(amount.value)
+            return Amount(received, c1), Amount(used, c2)
+        if amount.currency is c1:     # buy the item, lifting the asks
+            used, received = self.asks.byValue(amount.value)
+            return Amount(received, c2), Amount(used, c1)
+        raise ValueError("{0} is not traded at {1}".format(amount.currency,
+                                                          self.market))
+
+
+class RouteResult(object):
+    """The outcome of sending an amount through a route.
+
+    spent: the Amount of the source currency the first leg took
+    legs: (used, received) Amounts of each leg
+    complete: whether every leg could take all of its input
+    """
+    __slots__ = ('route', 'spent', 'received', 'legs', 'complete')
+
+    def __init__(self, route, spent, received, legs, complete):
+        self.route = route
+        self.spent = spent
+        self.received = received
+        self.legs = legs
+        self.complete = complete
+
+    def __repr__(self):
+        return "<RouteResult({0}: {1} -> {2}{3})>".format(
+            " -> ".join(m.name for m in self.route), self.spent,
+            self.received, "" if self.complete else ", partial")
+
+
+class RouteSimulator(object):
+    """Evaluates routes across a set of markets, on a snapshot of their
+    books taken by snapshot()"""
+
+    def __init__(self, markets):
+        self.markets = list(markets)
+        self.curves = {}
+
+    def snapshot(self, depths=None):
+        """fetches the depth of every market (unless given, as a
+        dictionary of market to depth) and builds their BookCurves"""
+        if depths is None:
+            depths = dict((m, m.getDepth()) for m in self.markets)
+        self.curves = dict((m, BookCurve(m, d)) for m, d in depths.items())
+
+    def routes(self, from_currency, to_currency, max_legs=3):
+        """returns every route (a tuple of markets) from from_currency to
+        to_currency, with at most max_legs legs"""
+        found = []
+        def walk(currency, route, visited):
+            if currency is to_currency and route:
+                found.append(tuple(route))
+                return
+            if len(route) == max_legs:
+                return
+            for m in self.markets:
+                if m in route or m not in self.curves:
+                    continue
+                if m.currency1 is currency:
+                    nxt = m.currency2
+                elif m.currency2 is currency:
+                    nxt = m.currency1
+                else:
+                    continue
+                if nxt in visited:
+                    continue
+                walk(nxt, route + [m], visited | set([nxt]))
+        walk(from_currency, [], set([from_currency]))
+        return found
+
+    def simulate(self, route, amount):
+        """sends amount through route, returning a RouteResult"""
+        legs = []
+        current, spent, complete = amount, amount, True
+        for market in route:
+            received, used = self.curves[market].convert(current)
+            legs.append((used, received))
+            if used.value < current.value:
+                complete = False
+                if len(legs) == 1:
+                    spent = used
+            current = received
+        return RouteResult(route, spent, current, legs, complete)
+
+    def best(self, amount, to_currency, max_legs=3, routes=None):
+        """returns the RouteResult of the route that converts amount into
+        the most to_currency, preferring routes that fill completely.
+        Returns None if there's no route"""
+        if routes is None:
+            routes = self.routes(amount.currency, to_currency, max_legs)
+        results = [self.simulate(r, amount) for r in routes]
+        if not results:
+            return None
+        return max(results, key=lambda r: (r.complete, r.received.value))
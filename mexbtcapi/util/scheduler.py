@@ -0,0 +1,251 @@
+"""Rate-limit aware scheduling of the requests made to exchanges.
+
+Each exchange gets a Scheduler, with a token bucket for the exchange and
+one per API key. Every request takes a token before going out; when
+there's none left, requests wait in order of priority:
+
+    TRADING > ACCOUNT > MARKET_DATA
+
+so an order never queues behind a depth poll (a request that only waits
+for its API key's tokens doesn't hold back the others). Lower priorities also
+leave a reserve of tokens untouched (see RESERVE), so a burst of market
+data polling can't starve order traffic, and market data requests are
+shed (Throttled is raised) instead of queueing when too many are already
+waiting.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from mexbtcapi.util.metrics import REGISTRY
+
+
+TRADING = 0
+ACCOUNT = 1
+MARKET_DATA = 2
+
+PRIORITY_NAMES = {TRADING: 'trading', ACCOUNT: 'account',
+                  MARKET_DATA: 'market_data'}
+
+# fraction of a bucket's capacity each priority can't use
+RESERVE = {TRADING: 0.0, ACCOUNT: 0.1, MARKET_DATA: 0.3}
+
+# how many requests of each priority may wait before new ones are shed
+# (None: never shed)
+MAX_QUEUE = {TRADING: None, ACCOUNT: None, MARKET_DATA: 10}
+
+# (requests per second, burst) of each exchange, and of each API key
+LIMITS = {
+    'BTCe': ((2.0, 10), (1.0, 5)),
+    'Bitstamp': ((1.0, 60), (1.0, 60)),     # 600 requests per 10 minutes
+    'Bitfinex': ((1.0, 30), (1.0, 30)),
+}
+DEFAULT_LIMITS = ((1.0, 10), (1.0, 10))
+
+
+class Throttled(Exception):
+    """raised when a request is shed, or can't get a token in time"""
+
+
+class TokenBucket(object):
+    """Holds up to capacity tokens, refilled at rate tokens per second.
+    Not thread safe by itself: Scheduler locks around it"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.time()
+
+    def refill(self, now=None):
+        now = time.time() if now is None else now
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait(self, n=1, reserve=0.0):
+        """seconds until n tokens can be taken, leaving reserve (a
+        fraction of the capacity) in the bucket"""
+        deficit = n + reserve * self.capacity - self.refill()
+        return max(deficit / self.rate, 0.0)
+
+    def take(self, n=1):
+        self.tokens -= n
+
+
+class Scheduler(object):
+    """
+    rate, capacity: of the exchange's token bucket
+    key_rate, key_capacity: of each API key's token bucket
+
+    enabled: when False, acquire returns at once: nothing is rate limited
+    (e.g. in benchmarks, or load tests against a mock exchange)
+    """
+
+    def __init__(self, name, rate, capacity, key_rate=None,
+                 key_capacity=None):
+        self.name = name
+        self.enabled = True
+        self.bucket = TokenBucket(rate, capacity)
+        self.key_rate = key_rate or rate
+        self.key_capacity = key_capacity or capacity
+        self.keys = {}          # API key -> TokenBucket
+        self.reserve = dict(RESERVE)
+        self.max_queue = dict(MAX_QUEUE)
+        self.cond = threading.Condition(threading.Lock())
+        self.waiting = []       # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self.granted = dict((p, 0) for p in PRIORITY_NAMES)
+        self.shed = dict((p, 0) for p in PRIORITY_NAMES)
+        self.waited = dict((p, 0.0) for p in PRIORITY_NAMES)
+
+    def _buckets(self, key):
+        if key is None:
+            return (self.bucket,)
+        if key not in self.keys:
+            self.keys[key] = TokenBucket(self.key_rate, self.key_capacity)
+        return (self.bucket, self.keys[key])
+
+    def _queued(self, priority):
+        return sum(1 for ticket in self.waiting if ticket[0] == priority)
+
+    def _wait(self, priority, key):
+        """seconds until a request of priority (and key) can take a token"""
+        reserve = self.reserve[priority]
+        return max(b.wait(1, reserve) for b in self._buckets(key))
+
+    def _remove(self, ticket):
+        self.waiting.remove(ticket)
+        heapq.heapify(self.waiting)
+        self.cond.notify_all()
+
+    def acquire(self, priority=MARKET_DATA, key=None, timeout=None):
+        """waits for a token of the exchange (and of key, if given).
+        Returns the seconds waited. Raises Throttled if the request is shed
+        or timeout seconds pass"""
+        if not self.enabled:
+            return 0.0
+        start = time.time()
+        with self.cond:
+            limit = self.max_queue.get(priority)
+            if limit is not None and self._queued(priority) >= limit:
+                self.shed[priority] += 1
+                raise Throttled("{0}: too many {1} requests waiting".format(
+                    self.name, PRIORITY_NAMES[priority]))
+            ticket = (priority, next(self._sequence), key)
+            heapq.heappush(self.waiting, ticket)
+            self.cond.notify_all()
+            try:
+                while True:
+                    # the best waiting request that can go now goes: one
+                    # waiting on its key's bucket doesn't hold the others
+                    wait = self._wait(priority, key)
+                    if wait <= 0:
+                        if any(t < ticket and self._wait(t[0], t[2]) <= 0
+                               for t in self.waiting):
+                            wait = None     # a better one goes first
+                        else:
+                            for b in self._buckets(key):
+                                b.take()
+                            self._remove(ticket)
+                            waited = time.time() - start
+                            self.granted[priority] += 1
+                            self.waited[priority] += waited
+                            return waited
+                    if timeout is not None:
+                        left = start + timeout - time.time()
+                        if left <= 0:
+                            self.shed[priority] += 1
+                            raise Throttled("{0}: no token in {1}s".format(
+                                self.name, timeout))
+                        wait = left if wait is None else min(wait, left)
+                    self.cond.wait(wait)
+            except BaseException:
+                if ticket in self.waiting:
+                    self._remove(ticket)
+                raise
+
+    def call(self, priority, f, *args, **kwargs):
+        self.acquire(priority)
+        return f(*args, **kwargs)
+
+    def wrap(self, priority, f, key=None):
+        """returns f, taking a token before every call"""
+        def scheduled(*args, **kwargs):
+            self.acquire(priority, key)
+            return f(*args, **kwargs)
+        return scheduled
+
+    def hook(self, obj, priority=MARKET_DATA, key=None, priorities=None):
+        """returns a proxy of obj (e.g. an exchange client) whose method
+        calls take a token first. priorities: method name -> priority, for
+        methods that don't have the default priority"""
+        return _ScheduledProxy(self, obj, priority, key, priorities or {})
+
+    def metrics(self):
+        """the current budget and usage, as a dictionary"""
+        with self.cond:
+            now = time.time()
+            return {
+                'tokens': self.bucket.refill(now),
+                'capacity': self.bucket.capacity,
+                'keys': dict((k, b.refill(now)) for k, b in self.keys.items()),
+                'queued': dict((PRIORITY_NAMES[p], self._queued(p))
+                               for p in PRIORITY_NAMES),
+                'granted': dict((PRIORITY_NAMES[p], n)
+                                for p, n in self.granted.items()),
+                'shed': dict((PRIORITY_NAMES[p], n)
+                             for p, n in self.shed.items()),
+                'waited': dict((PRIORITY_NAMES[p], s)
+                               for p, s in self.waited.items()),
+            }
+
+    def __repr__(self):
+        return "<Scheduler({0}, {1:.1f}/{2:.0f} tokens)>".format(self.name,
+            self.bucket.tokens, self.bucket.capacity)
+
+
+class _ScheduledProxy(object):
+    def __init__(self, scheduler, obj, priority, key, priorities):
+        self._scheduler = scheduler
+        self._obj = obj
+        self._priority = priority
+        self._key = key
+        self._priorities = priorities
+
+    def __getattr__(self, attr):
+        value = getattr(self._obj, attr)
+        if not callable(value):
+            return value
+        priority = self._priorities.get(attr, self._priority)
+        return self._scheduler.wrap(priority, value, self._key)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(exchange):
+    """returns the Scheduler shared by everything that talks to exchange
+    (a market name, e.g. 'BTCe'), creating it with its LIMITS"""
+    with _schedulers_lock:
+        if exchange not in _schedulers:
+            (rate, capacity), (key_rate, key_capacity) = \
+                LIMITS.get(exchange, DEFAULT_LIMITS)
+            _schedulers[exchange] = Scheduler(exchange, rate, capacity,
+                                              key_rate, key_capacity)
+        return _schedulers[exchange]
+
+
+def _budget():
+    with _schedulers_lock:
+        schedulers = _schedulers.items()
+    return dict(((name,), s.metrics()['tokens']) for name, s in schedulers)
+
+REGISTRY.gauge("mexbtcapi_rate_limit_tokens",
+               "Tokens left in each exchange's rate limit", ("exchange",),
+               function=_budget)
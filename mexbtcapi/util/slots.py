@@ -0,0 +1,23 @@
+class Slotted(object):
+    """A base for classes with __slots__. Pickle protocols 0 and 1 can't
+    save those without __getstate__, which this provides: the state is a
+    dictionary of the slots (of every class in the hierarchy) and, for
+    subclasses without __slots__, of the instance __dict__"""
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            for name in slots:
+                if name not in ('__dict__', '__weakref__') and \
+                        hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
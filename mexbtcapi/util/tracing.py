@@ -0,0 +1,163 @@
+"""Per-phase latency tracing of the calls made to exchanges.
+
+Market methods decorated with traced() open a trace, tagged with the
+exchange, the pair and the method. While it's open, the request
+functions time their phases:
+
+    call        the whole request to the exchange (Market._publicCall)
+    queue       waiting for the exchange's rate limit
+    connect     opening the connection (TCP and TLS)
+    ttfb        sending the request until the first byte of the answer
+    body        reading the rest of the answer
+    decode      parsing the JSON
+
+(the third-party clients only tell their whole call apart) and when the
+trace closes, its total time and the time spent outside of calls to the
+exchange (construct: building the concept objects) are recorded too.
+Every duration goes to the log-bucketed DURATIONS histogram of the
+metrics registry, queried in-process with query().
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from mexbtcapi.util.metrics import REGISTRY
+
+
+ENABLED = True
+
+# each power of two, from about 8 microseconds to a minute, is split in
+# this many buckets
+BUCKETS_PER_OCTAVE = 2
+BUCKETS = tuple(2 ** (i / float(BUCKETS_PER_OCTAVE)) for i in
+                xrange(-17 * BUCKETS_PER_OCTAVE, 6 * BUCKETS_PER_OCTAVE + 1))
+
+DURATIONS = REGISTRY.histogram("mexbtcapi_trace_seconds",
+    "Duration of the phases of the calls made to exchanges",
+    ("exchange", "pair", "method", "phase"), buckets=BUCKETS)
+
+
+class Series(object):
+    """The durations (in seconds) recorded with some tags"""
+
+    def __init__(self, tags):
+        self.tags = tags
+
+    @property
+    def count(self):
+        return DURATIONS.count(self.tags)
+
+    def mean(self):
+        count = self.count
+        return DURATIONS.total(self.tags) / count if count else None
+
+    def percentile(self, p):
+        """the p-th percentile (0-100), accurate to about a bucket"""
+        return DURATIONS.percentile(p, self.tags)
+
+    def __repr__(self):
+        if not self.count:
+            return "<Series(empty)>"
+        return "<Series({0} calls, mean {1:.4f}s, p50 {2:.4f}s, " \
+               "p99 {3:.4f}s)>".format(self.count, self.mean(),
+                                      self.percentile(50), self.percentile(99))
+
+
+def _record(exchange, pair, method, phase, seconds):
+    # the tags a phase outside of a trace doesn't have are ''
+    DURATIONS.observe(seconds, (exchange or '', pair or '', method or '',
+                                phase))
+
+
+def query(exchange=None, pair=None, method=None, phase=None):
+    """returns the durations recorded with the given tags, as a dictionary
+    of (exchange, pair, method, phase) to Series"""
+    want = (exchange, pair, method, phase)
+    return dict((k, Series(k)) for k in DURATIONS.label_values()
+                if all(w is None or w == v for w, v in zip(want, k)))
+
+
+def reset():
+    """forgets the recorded durations"""
+    DURATIONS.clear()
+
+
+class _Trace(object):
+    __slots__ = ('exchange', 'pair', 'method', 'accounted', 'depth')
+
+    def __init__(self, exchange, pair, method):
+        self.exchange, self.pair, self.method = exchange, pair, method
+        self.accounted = 0.0    # time spent in top-level phases
+        self.depth = 0          # phases currently open
+
+
+_local = threading.local()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def trace(exchange, pair=None, method=None):
+    """times a call to an exchange; phases inside it are tagged with it"""
+    if not ENABLED:
+        yield
+        return
+    stack = _stack()
+    t = _Trace(exchange, pair, method)
+    stack.append(t)
+    start = time.time()
+    try:
+        yield
+    finally:
+        total = time.time() - start
+        stack.pop()
+        _record(exchange, pair, method, 'total', total)
+        _record(exchange, pair, method, 'construct',
+                max(total - t.accounted, 0.0))
+        if stack:
+            stack[-1].accounted += t.accounted
+
+
+@contextmanager
+def phase(name, exchange=None):
+    """times a phase of the current trace. Outside of a trace, it's
+    tagged with exchange only"""
+    if not ENABLED:
+        yield
+        return
+    stack = _stack()
+    t = stack[-1] if stack else None
+    if t is not None:
+        t.depth += 1
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        if t is None:
+            _record(exchange, None, None, name, elapsed)
+        else:
+            t.depth -= 1
+            if t.depth == 0:
+                t.accounted += elapsed
+            _record(t.exchange, t.pair, t.method, name, elapsed)
+
+
+def traced(method):
+    """decorates a Market method so that its calls are traced, tagged with
+    the market's name and pair"""
+    @wraps(method)
+    def traced_method(self, *args, **kwargs):
+        if not ENABLED:
+            return method(self, *args, **kwargs)
+        pair = "{0}/{1}".format(self.currency2, self.currency1)
+        with trace(self.name, pair, method.__name__):
+            return method(self, *args, **kwargs)
+    return traced_method